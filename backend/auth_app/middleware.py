@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+from auth_app.tiers import get_user_tier
+
+
+class TierSnapshotMiddleware:
+    """Attaches account tier snapshot of the user to the request as `request.tier`.
+    Snapshot is resolved lazily once per request, on first access.
+    Has to be placed after AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.tier = SimpleLazyObject(lambda: get_user_tier(request.user))
+        return self.get_response(request)
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:46
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0002_alter_customuser_usertier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnailheight',
+            name='outputFormat',
+            field=models.CharField(choices=[('JPEG', 'JPEG'), ('PNG', 'PNG'), ('WEBP', 'WebP')], default='JPEG', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='thumbnailheight',
+            name='quality',
+            field=models.PositiveSmallIntegerField(default=75, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)]),
+        ),
+    ]
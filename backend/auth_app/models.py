@@ -9,6 +9,8 @@ class ThumbnailHeight(models.Model):
     Currently, available_height is read only in admin panel page.
 
     available_height: a single height of thumbnail available in user account tier
+    outputFormat: format of stored thumbnail, WebP/AVIF variants are generated next to it
+    quality: encoder quality of thumbnail and its variants
     """
     available_height = models.PositiveIntegerField(
         validators=[MinValueValidator(25), MaxValueValidator(8640)], 
@@ -16,6 +18,15 @@ class ThumbnailHeight(models.Model):
         unique = True,
         default = 25,
         ) # Ive set minimal and default value to 25 and max to 8640 (16k image height)
+    outputFormat = models.CharField(
+        max_length = 10,
+        choices = [('JPEG', 'JPEG'), ('PNG', 'PNG'), ('WEBP', 'WebP')],
+        default = 'JPEG',
+        ) # images with alpha channel are stored as PNG instead of JPEG
+    quality = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        default = 75,
+        ) # JPEG, WebP and AVIF encoder quality, the same for thumbnail and its variants
 
     def __str__(self) -> str:
         return f"Defined thumbnail height PK {str(self.pk)} - {str(self.available_height)}px"
@@ -1,7 +1,10 @@
+from django.conf import settings
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
-from auth_app.models import ThumbnailHeight
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from auth_app.models import ThumbnailHeight, UserTier
+from auth_app.tiers import invalidate_tier_snapshot
 from imgs_app.tasks import heights_update_task
 
 User = get_user_model()
@@ -11,6 +14,50 @@ def trigger_thumb_height(sender, instance, created, **kwargs):
     """
     As soon as ThumbnailHeight object is saved by Django ORM,
     all images are placed in que (tasks.py) for async height processing.
+    In lazy render mode the new height is rendered on first request instead.
     """
-    if created:
+    if created and settings.THUMBNAIL_RENDER_MODE == 'eager':
         heights_update_task.delay(instance.id)
+
+
+def invalidate_tier_snapshots(tier_ids):
+    """
+    Snapshots are removed at once and again after commit,
+    so snapshot read by other process meanwhile is not kept.
+    """
+    tier_ids = list(tier_ids)
+    for tier_id in tier_ids:
+        invalidate_tier_snapshot(tier_id)
+    transaction.on_commit(lambda: [invalidate_tier_snapshot(tier_id) for tier_id in tier_ids])
+
+
+@receiver(post_save, sender=UserTier)
+@receiver(post_delete, sender=UserTier)
+def invalidate_user_tier(sender, instance, **kwargs):
+    invalidate_tier_snapshots([instance.pk])
+
+
+@receiver(m2m_changed, sender=UserTier.thumbnailHeight.through)
+def invalidate_user_tier_heights(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Heights of the tier changed, either from the tier side or from the height side (reverse).
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        invalidate_tier_snapshots([instance.pk])
+    elif pk_set:
+        invalidate_tier_snapshots(pk_set)
+    else:
+        # Reverse clear does not pass tiers it was removed from
+        invalidate_tier_snapshots(UserTier.objects.values_list('pk', flat = True))
+
+
+@receiver(pre_delete, sender=ThumbnailHeight)
+def invalidate_deleted_height_tiers(sender, instance, **kwargs):
+    """
+    Deleted height is removed from tiers without m2m_changed signal,
+    tiers are collected before the delete.
+    """
+    invalidate_tier_snapshots(instance.usertier_set.values_list('pk', flat = True))
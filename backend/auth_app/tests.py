@@ -1,6 +1,11 @@
 from django.test import TestCase
 from django.core.exceptions import ValidationError  
+from django.test import RequestFactory
+from django.core.cache import cache
 from auth_app.models import ThumbnailHeight, UserTier, CustomUser
+from auth_app import tiers
+from auth_app.tiers import TierSnapshot, get_tier_snapshot
+from auth_app.middleware import TierSnapshotMiddleware
 
 class ModelTestCase(TestCase):
     def setUp(self):
@@ -63,3 +68,48 @@ class ModelTestCase(TestCase):
         # Test the relationship between CustomUser and UserTier
         self.assertEqual(self.custom_user.userTier, self.user_tier)
 
+
+
+class TierSnapshotTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Basic Tier", accessOriginalFile=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        cache.clear()
+
+    def test_snapshot_cached(self):
+        # Test that snapshot is read with a single query and cached afterwards
+        with self.assertNumQueries(1):
+            snapshot = get_tier_snapshot(self.user_tier.pk)
+        self.assertEqual(snapshot, TierSnapshot(self.user_tier.pk, frozenset([200]), True, False))
+        with self.assertNumQueries(0):
+            get_tier_snapshot(self.user_tier.pk)
+
+    def test_snapshot_shared_between_processes(self):
+        # Test that snapshot missing in process memory is read from shared cache
+        get_tier_snapshot(self.user_tier.pk)
+        tiers._local_snapshots.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_tier_snapshot(self.user_tier.pk).heights, frozenset([200]))
+
+    def test_snapshot_invalidated_on_tier_change(self):
+        # Test that tier and its heights changes are visible at once
+        get_tier_snapshot(self.user_tier.pk)
+        self.user_tier.accessGenerateExpiringLinks = True
+        self.user_tier.save()
+        self.assertTrue(get_tier_snapshot(self.user_tier.pk).accessGenerateExpiringLinks)
+        new_height = ThumbnailHeight.objects.create(available_height=400)
+        new_height.usertier_set.add(self.user_tier)
+        self.assertEqual(get_tier_snapshot(self.user_tier.pk).heights, frozenset([200, 400]))
+        self.user_tier.thumbnailHeight.remove(self.thumbnail_height)
+        self.assertEqual(get_tier_snapshot(self.user_tier.pk).heights, frozenset([400]))
+        new_height.delete()
+        self.assertEqual(get_tier_snapshot(self.user_tier.pk).heights, frozenset())
+
+    def test_middleware_attaches_snapshot(self):
+        # Test that request tier is resolved by middleware
+        user = CustomUser.objects.create(username="tieruser", userTier=self.user_tier)
+        request = RequestFactory().get('/')
+        request.user = user
+        TierSnapshotMiddleware(lambda request: None)(request)
+        self.assertEqual(request.tier.heights, frozenset([200]))
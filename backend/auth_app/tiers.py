@@ -0,0 +1,71 @@
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from auth_app.models import UserTier
+
+# Immutable snapshot of account tier, heights are frozenset of available_height values
+TierSnapshot = namedtuple('TierSnapshot', ['pk', 'heights', 'accessOriginalFile', 'accessGenerateExpiringLinks'])
+
+# In-process snapshots {tier pk: (expiry, TierSnapshot)}, kept shortly as they are
+# invalidated only in the process that changed the tier, other processes rely on the timeout
+_local_snapshots = {}
+
+
+def tier_cache_key(tier_id):
+    return f'auth:tier:{tier_id}'
+
+
+def load_tier_snapshot(tier_id):
+    """Reads tier and its heights from db using a single query.
+
+    Args:
+        tier_id (int): The user tier pk.
+
+    Returns:
+        Returns TierSnapshot.
+    """
+    rows = list(UserTier.objects.filter(pk = tier_id).values_list(
+        'accessOriginalFile', 'accessGenerateExpiringLinks', 'thumbnailHeight__available_height'
+    ))
+
+    if not rows:
+        raise UserTier.DoesNotExist(f"User tier {tier_id} does not exist.")
+
+    heights = frozenset(row[2] for row in rows if row[2] is not None)
+    return TierSnapshot(tier_id, heights, rows[0][0], rows[0][1])
+
+
+def get_tier_snapshot(tier_id):
+    """Returns snapshot of the tier from process memory, then from cache (Redis),
+    finally from db. Snapshot read from db is stored in both caches.
+
+    Args:
+        tier_id (int): The user tier pk.
+
+    Returns:
+        Returns TierSnapshot.
+    """
+    local = _local_snapshots.get(tier_id)
+    if local is not None and local[0] > time.monotonic():
+        return local[1]
+
+    snapshot = cache.get(tier_cache_key(tier_id))
+    if snapshot is None:
+        snapshot = load_tier_snapshot(tier_id)
+        cache.set(tier_cache_key(tier_id), snapshot, settings.USER_TIER_CACHE_TIMEOUT)
+
+    _local_snapshots[tier_id] = (time.monotonic() + settings.USER_TIER_LOCAL_CACHE_TIMEOUT, snapshot)
+    return snapshot
+
+
+def get_user_tier(user):
+    """Returns tier snapshot of the user or None for anonymous user."""
+    if not user.is_authenticated:
+        return None
+    return get_tier_snapshot(user.userTier_id)
+
+
+def invalidate_tier_snapshot(tier_id):
+    _local_snapshots.pop(tier_id, None)
+    cache.delete(tier_cache_key(tier_id))
@@ -1,6 +1,7 @@
 # from __future__ import absolute_import
 import os
 from celery import Celery
+from celery.signals import celeryd_init
 from django.conf import settings
 
 # set the default Django settings module for the 'celery' program.
@@ -13,6 +14,24 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 
 
+@celeryd_init.connect
+def configure_queue_worker(sender=None, conf=None, options=None, **kwargs):
+    """Worker consuming single queue of TASK_QUEUE_WORKERS (started with `-Q <queue>`)
+    gets concurrency and prefetch multiplier of the queue. Options given on command line are kept,
+    as they take precedence over configuration.
+    """
+    queues = (options or {}).get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+
+    if len(queues) != 1 or queues[0] not in settings.TASK_QUEUE_WORKERS:
+        return
+
+    queue_options = settings.TASK_QUEUE_WORKERS[queues[0]]
+    conf.worker_concurrency = queue_options['concurrency']
+    conf.worker_prefetch_multiplier = queue_options['prefetch_multiplier']
+
+
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
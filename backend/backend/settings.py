@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'auth_app.middleware.TierSnapshotMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -159,6 +160,52 @@ CACHES = {
     }
 }
 
+# Images and thumbnails lists (keyset paginated on pk)
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 500
+
+# Account tier snapshots (auth_app/tiers.py), invalidated on tier or its heights change
+USER_TIER_CACHE_TIMEOUT = 60 * 60 # in seconds, shared (Redis) cache
+USER_TIER_LOCAL_CACHE_TIMEOUT = 10 # in seconds, in-process cache, bounds staleness in other processes
+
+# Thumbnails processing related settings
+THUMBNAIL_JPEG_DRAFT = False # opt-in, decode JPEG directly at reduced scale (DCT scaling) when downscaling
+THUMBNAIL_REDUCING_GAP = 2.0 # quality guard, decoded image is at least 2x bigger than the thumbnail
+THUMBNAIL_BACKFILL_CHUNK_SIZE = 500 # images processed by single subtask after new height is added
+THUMBNAIL_BACKFILL_GROUP_SIZE = 20 # chunks dispatched at once as celery group
+THUMBNAIL_UPLOAD_BATCH_SIZE = 100 # images created in one transaction are processed by single task (tasks.enqueue_on_commit)
+THUMBNAIL_PROCESS_POOL_WORKERS = 0 # opt-in, number of processes resizing images inside single celery worker (0 - disabled), needs worker started with --pool=threads or --pool=solo
+THUMBNAIL_VARIANT_FORMATS = ['WEBP', 'AVIF'] # stored next to thumbnail (served by Accept header), AVIF only if Pillow supports it
+THUMBNAIL_SPOOL_MAX_SIZE = 1024 * 1024 # in bytes, encoded thumbnail is kept in memory up to this size, then spooled to temporary file
+THUMBNAIL_RENDER_MODE = os.getenv('DJANGO_THUMBNAIL_RENDER_MODE', 'eager') # 'eager' - all heights rendered on upload, 'lazy' - rendered on first request
+THUMBNAIL_RENDER_LOCK_TIMEOUT = 30 # in seconds, concurrent requests of the same thumbnail wait for single render
+THUMBNAIL_RENDER_IN_REQUEST = False # opt-in, on-demand render runs in the web request instead of render_thumbnail_task (interactive queue)
+THUMBNAIL_RENDER_WAIT_TIMEOUT = 5 # in seconds, request waiting for the render gets 503 after
+THUMBNAIL_RENDER_RETRY_AFTER = 5 * 60 # in seconds, failed render is not repeated meanwhile, requests get 503
+THUMBNAIL_ACCESS_RESOLUTION = 60 * 60 # in seconds, lastAccessed of thumbnail is not updated more often
+THUMBNAIL_STORAGE_MAX_BYTES = 0 # lazy mode, least recently used thumbnails are evicted above this size (0 - unbounded)
+THUMBNAIL_EVICTION_BATCH_SIZE = 500 # thumbnails deleted in single query by evict_thumbnails_task
+TASK_INFLIGHT_TIMEOUT = 10 * 60 # in seconds, duplicate enqueues of waiting task are dropped (tasks.enqueue_once), expires if the task is lost
+
+# Resumable chunked uploads (imgs_app/uploads.py)
+UPLOAD_SESSION_TIMEOUT = 24 * 60 * 60 # in seconds since the last chunk, abandoned session and its parts are purged after
+UPLOAD_SESSIONS_PURGE_BATCH_SIZE = 100 # expired sessions deleted at once by purge_upload_sessions_task
+
+# Media files serving (imgs_app/media.py), access is checked by Django, bytes can be sent by the front proxy
+MEDIA_ACCEL_REDIRECT = os.getenv('DJANGO_MEDIA_ACCEL_REDIRECT', '') # '' - streamed by Django, 'nginx' - X-Accel-Redirect, 'sendfile' - X-Sendfile (Apache, lighttpd)
+MEDIA_ACCEL_REDIRECT_LOCATION = '/protected-media/' # nginx internal location aliased to MEDIA_ROOT
+
+# Processing state of uploaded images (imgs_app/status.py), clients wait on it instead of polling lists
+IMAGE_STATUS_MAX_WAIT = 25 # in seconds, max long-poll wait of images/<pk>/status/?wait=
+IMAGE_STATUS_STREAM_TIMEOUT = 5 * 60 # in seconds, server-sent events stream of images/<pk>/status/events/ is closed after
+IMAGE_STATUS_POLL_INTERVAL = 0.5 # in seconds, waiting requests poll cache, not db
+IMAGE_STATUS_CACHE_TIMEOUT = 60 * 60 # in seconds, state written by tasks is kept in cache
+IMAGE_PROCESSING_STALE_AFTER = 10 * 60 # in seconds, image in progress without state change for longer does not block user thumbnails check
+
+# Expiring links related settings
+EXPIRING_LINKS_SIGNED = False # stateless HMAC signed links carrying ids and expiry, not stored in db (links can not be revoked)
+EXPIRING_LINKS_PURGE_BATCH_SIZE = 1000 # expired links deleted in single query by purge_expired_links_task
+
 # CELERY related settings
 CELERY_BROKER_URL = os.getenv('DJANGO_CELERY_BROKER')
 CELERY_RESULT_BACKEND = os.getenv('DJANGO_CELERY_RESULT_BACKEND')
@@ -167,6 +214,41 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Warsaw'
 CELERY_TASK_ALWAYS_EAGER  = False # AFTER DEBUGGING SET FALSE
+# Separate queues, so backfill of new height does not delay thumbnails of fresh uploads.
+# Every queue is consumed by its own worker (docker/backend/server-entrypoint.sh)
+CELERY_TASK_DEFAULT_QUEUE = 'interactive'
+CELERY_TASK_ROUTES = {
+    'imgs_app.tasks.process_uploaded_imgs_task': {'queue': 'interactive'}, # user waits for it
+    'imgs_app.tasks.process_uploaded_img_task': {'queue': 'interactive'},
+    'imgs_app.tasks.render_thumbnail_task': {'queue': 'interactive'}, # on-demand render, client waits for it
+    'imgs_app.tasks.heights_update_task': {'queue': 'bulk'}, # backfill of all images after height is added
+    'imgs_app.tasks.heights_update_chunk_task': {'queue': 'bulk'},
+    'imgs_app.tasks.check_user_thumbs_task': {'queue': 'reconcile'}, # scans, periodic clean up
+    'imgs_app.tasks.purge_expired_links_task': {'queue': 'reconcile'},
+    'imgs_app.tasks.purge_upload_sessions_task': {'queue': 'reconcile'},
+    'imgs_app.tasks.evict_thumbnails_task': {'queue': 'reconcile'},
+}
+# Worker consuming single queue (`-Q interactive`) takes its options from here (backend/celery.py),
+# command line options take precedence. Prefetch 1 - long task does not hold tasks other process could run
+TASK_QUEUE_WORKERS = {
+    'interactive': {'concurrency': int(os.getenv('DJANGO_CELERY_INTERACTIVE_CONCURRENCY', 4)), 'prefetch_multiplier': 1},
+    'bulk': {'concurrency': int(os.getenv('DJANGO_CELERY_BULK_CONCURRENCY', 2)), 'prefetch_multiplier': 1},
+    'reconcile': {'concurrency': 1, 'prefetch_multiplier': 1},
+}
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-links': {
+        'task': 'imgs_app.tasks.purge_expired_links_task',
+        'schedule': 60 * 5, # every 5 minutes
+    },
+    'purge-upload-sessions': {
+        'task': 'imgs_app.tasks.purge_upload_sessions_task',
+        'schedule': 60 * 60, # every hour
+    },
+    'evict-thumbnails': {
+        'task': 'imgs_app.tasks.evict_thumbnails_task',
+        'schedule': 60 * 60, # every hour, no-op unless lazy mode with storage limit
+    },
+}
 
 LOGGING = {
     'version': 1,
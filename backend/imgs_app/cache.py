@@ -0,0 +1,86 @@
+import time
+import uuid
+from django.core.cache import cache
+from django.utils import timezone
+
+LIST_CACHE_TIMEOUT = 60 * 10 # 10 minutes, entries are invalidated on change anyway
+
+
+def _user_version_key(user_id):
+    return f'imgs:user:{user_id}:version'
+
+
+def user_cache_version(user_id):
+    """Returns current version of user's cached payloads.
+    New version is started from current time, so after the key is evicted
+    it does not collide with versions used before.
+    """
+    key = _user_version_key(user_id)
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, time.time_ns(), timeout = None)
+        version = cache.get(key)
+    return version
+
+
+def bump_user_cache_version(user_id):
+    """Invalidates all cached payloads of the user at once."""
+    try:
+        cache.incr(_user_version_key(user_id))
+    except ValueError:
+        # Missing key, next read starts new version
+        pass
+
+
+def list_cache_key(user_id, name, *args):
+    """Returns cache key of user's payload, versioned by user_cache_version."""
+    return ':'.join(['imgs', 'list', str(user_id), str(user_cache_version(user_id)), name, *map(str, args)])
+
+
+LINK_HITS_KEY = 'imgs:link:hits'
+LINK_MISSES_KEY = 'imgs:link:misses'
+
+
+def link_cache_key(lookup):
+    """Returns cache key of resolved expiring link. UUID lookups are normalized,
+    so the same link requested in different UUID notation shares the entry.
+    """
+    try:
+        lookup = uuid.UUID(str(lookup)).hex
+    except ValueError:
+        pass
+    return f'imgs:link:{lookup}'
+
+
+def _incr_counter(key):
+    if not cache.add(key, 1, timeout = None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+
+def get_cached_link(lookup):
+    """Returns cached payload of expiring link or None, counts hits and misses."""
+    payload = cache.get(link_cache_key(lookup))
+    _incr_counter(LINK_HITS_KEY if payload is not None else LINK_MISSES_KEY)
+    return payload
+
+
+def set_cached_link(lookup, payload, expires_at):
+    """Caches payload of expiring link for its remaining lifetime."""
+    timeout = int((expires_at - timezone.now()).total_seconds())
+
+    if timeout > 0:
+        cache.set(link_cache_key(lookup), payload, timeout)
+
+
+def invalidate_cached_link(link):
+    cache.delete(link_cache_key(link.linkToken or link.linkUUID))
+
+
+def link_cache_stats():
+    """Returns dict with number of expiring link cache hits and misses."""
+    stats = cache.get_many([LINK_HITS_KEY, LINK_MISSES_KEY])
+    return {'hits': stats.get(LINK_HITS_KEY, 0), 'misses': stats.get(LINK_MISSES_KEY, 0)}
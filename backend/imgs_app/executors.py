@@ -0,0 +1,122 @@
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from imgs_app.img_processing import render_thumbnails, supported_output_formats
+from imgs_app.outputs import spooled_output
+
+logger = logging.getLogger(__name__)
+
+_process_pool = None
+
+
+def get_process_pool():
+    """Returns process pool used to resize and encode thumbnails, created once per worker.
+    The pool is opt-in, enabled by THUMBNAIL_PROCESS_POOL_WORKERS setting. Children of celery
+    prefork pool are daemonic and can not start processes, images are rendered inline there,
+    worker has to run with `--pool=threads` or `--pool=solo` to use the pool.
+
+    Returns:
+        Returns ProcessPoolExecutor or None if the pool is disabled.
+    """
+    global _process_pool
+    workers = settings.THUMBNAIL_PROCESS_POOL_WORKERS
+
+    if not workers:
+        return None
+
+    if multiprocessing.current_process().daemon:
+        logger.warning("THUMBNAIL_PROCESS_POOL_WORKERS is ignored in daemonic process (celery prefork pool), thumbnails are rendered inline.")
+        return None
+
+    if _process_pool is None:
+        # Spawn is used as celery worker may hold threads and open connections, which are unsafe to fork
+        _process_pool = ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def image_source(uploaded_img):
+    """Returns path of the uploaded image if storage is local, otherwise its content.
+    Path is preferred, as the image is then read by the pool process only.
+    """
+    try:
+        return uploaded_img.uploadedImage.path
+    except NotImplementedError:
+        with uploaded_img.uploadedImage.open('rb') as f:
+            return f.read()
+
+
+def thumbnail_output_formats(thumbnailHeight):
+    """Returns [(format, quality), ...] of thumbnail in given height, its own format first,
+    followed by THUMBNAIL_VARIANT_FORMATS supported by installed Pillow.
+    """
+    supported_formats = supported_output_formats()
+    variant_formats = [
+        variant_format for variant_format in settings.THUMBNAIL_VARIANT_FORMATS
+        if variant_format in supported_formats and variant_format != thumbnailHeight.outputFormat
+    ]
+    return [(img_format, thumbnailHeight.quality) for img_format in [thumbnailHeight.outputFormat] + variant_formats]
+
+
+def render_planned_thumbnails(plan, use_process_pool = True):
+    """Renders thumbnails of planned images. Without the process pool images are rendered
+    one by one in the current process, otherwise jobs are sent to the pool, while at most
+    two jobs per pool process are in flight, to keep memory bounded.
+
+    Args:
+        plan (iterable): (UploadedImage, list(ThumbnailHeight)) tuples, usually from planner.
+        use_process_pool (bool): If the pool can be used, web processes render inline.
+
+    Returns:
+        Returns generator of (UploadedImage, list(ThumbnailHeight), dict of encoded thumbnails)
+        tuples. Encoded thumbnails are None if rendering of the image failed. Thumbnails rendered
+        in the current process are encoded to spooled temporary files, pool returns bytes.
+    """
+    options = {'draft': settings.THUMBNAIL_JPEG_DRAFT, 'reducing_gap': settings.THUMBNAIL_REDUCING_GAP}
+    process_pool = get_process_pool() if use_process_pool else None
+
+    if process_pool is None:
+        for uploaded_img, missing_heights in plan:
+            try:
+                encoded = render_thumbnails(
+                    image_source(uploaded_img), [h.available_height for h in missing_heights],
+                    output_formats = _output_formats(missing_heights), output_factory = spooled_output, **options
+                )
+            except Exception as e:
+                logger.exception(f"An error occurred while rendering image {uploaded_img.pk}. {str(e)}")
+                encoded = None
+            yield uploaded_img, missing_heights, encoded
+        return
+
+    in_flight = deque()
+    max_in_flight = 2*settings.THUMBNAIL_PROCESS_POOL_WORKERS
+
+    for uploaded_img, missing_heights in plan:
+        try:
+            future = process_pool.submit(render_thumbnails, image_source(uploaded_img), [h.available_height for h in missing_heights], output_formats = _output_formats(missing_heights), **options)
+        except Exception as e:
+            logger.exception(f"An error occurred while rendering image {uploaded_img.pk}. {str(e)}")
+            yield uploaded_img, missing_heights, None
+            continue
+
+        in_flight.append((uploaded_img, missing_heights, future))
+
+        if len(in_flight) >= max_in_flight:
+            yield _pool_result(*in_flight.popleft())
+
+    while in_flight:
+        yield _pool_result(*in_flight.popleft())
+
+
+def _output_formats(thumbnailHeights):
+    return {h.available_height: thumbnail_output_formats(h) for h in thumbnailHeights}
+
+
+def _pool_result(uploaded_img, missing_heights, future):
+    try:
+        encoded = future.result()
+    except Exception as e:
+        logger.exception(f"An error occurred while rendering image {uploaded_img.pk}. {str(e)}")
+        encoded = None
+    return uploaded_img, missing_heights, encoded
@@ -1,25 +1,64 @@
+import io
 import logging
+from collections import namedtuple
 from PIL import Image as PILImage
 
 logger = logging.getLogger(__name__)
 
+# Encoded image with its metadata and variants (the same image in other formats), returned by render_thumbnails
+EncodedImage = namedtuple('EncodedImage', ['content', 'width', 'height', 'format', 'variants'], defaults = [()])
+
+# Output formats with file extensions, in order of preference of variants
+OUTPUT_EXTENSIONS = {'AVIF': 'avif', 'WEBP': 'webp', 'PNG': 'png', 'JPEG': 'jpg'}
+
 class SimpleImageProcessing:
     """Image processing class with two methods to resize upload image to thumbnail.
 
     Args:
         imgpath: UploadedImage.uploadedImage ImageField.
+        draft (bool): If JPEG should be decoded directly at reduced scale when downscaling.
+        reducing_gap (float): Quality guard, the decoded image is kept at least
+            reducing_gap times bigger than the requested thumbnail.
     """
-    def __init__(self, imgpath):
+    def __init__(self, imgpath, draft = False, reducing_gap = 2.0):
         self.imgpath = imgpath
+        self.draft = draft
+        self.reducing_gap = max(float(reducing_gap or 1.0), 1.0)
+        self.size = None
     
-    def img_loader(self):
+    def img_loader(self, draft_height = None):
+        """Loads the image. If draft mode is enabled and draft_height is given,
+        JPEG is decoded using DCT scaling (1/2, 1/4 or 1/8) to the smallest scale
+        that is still not lower than draft_height multiplied by reducing_gap.
+        Size of the original image is kept in `size` attribute.
+
+        Args:
+            draft_height (int): The largest height in pixels that will be requested.
+
+        Returns:
+            Returns loaded image.
+        """
         try:
             _img = PILImage.open(self.imgpath)
+            self.size = _img.size
+
+            if self.draft and draft_height and _img.format == 'JPEG':
+                min_height = draft_height*self.reducing_gap
+
+                if min_height < _img.size[1]:
+                    scale = min_height/float(_img.size[1])
+                    _img.draft(_img.mode, (int(_img.size[0]*scale), int(min_height)))
+
             return _img.copy()
 
         except Exception as e:
             logger.exception(f"An error occurred while using img_loader. {str(e)}")
 
+    def _reducing_gap(self):
+        # Resize first reduces image by integer factor (fast), then resamples
+        # with LANCZOS. Used only in draft mode to keep default output unchanged.
+        return self.reducing_gap if self.draft else None
+
     def new_thumbnail_reduce_keep_aspect(self, new_width = 1024, new_height = 1024):
         """This method calculates an appropriate thumbnail size to 
         preserve the aspect of the image and does not enlarge the image.
@@ -71,16 +110,48 @@ class SimpleImageProcessing:
         Returns:
             Returns resized image.
         """
-        img = self.img_loader()
+        img = self.img_loader(draft_height = new_height)
 
         try:
-            hpercent = (new_height/float(img.size[1]))
-            new_width = int((float(img.size[0])*float(hpercent)))
-            return img.resize((new_width, new_height), resample=PILImage.Resampling.LANCZOS, box=None, reducing_gap=None)
+            hpercent = (new_height/float(self.size[1]))
+            new_width = int((float(self.size[0])*float(hpercent)))
+            return img.resize((new_width, new_height), resample=PILImage.Resampling.LANCZOS, box=None, reducing_gap=self._reducing_gap())
 
         except Exception as e:
             logger.exception(f"An error occurred while using new_thumbnail_keep_aspect. {str(e)}")
 
+    def new_thumbnails_keep_aspect(self, new_heights):
+        """Returns images enlarged or reduced to each of specified heights,
+        while maintaining the aspect ratio. The original is decoded only once,
+        heights are processed from the largest to the smallest and every
+        reduced thumbnail is derived from the previous (larger) one.
+
+        Args:
+            new_heights (iterable(int)): The requested heights in pixels.
+
+        Returns:
+            Returns dict of resized images keyed by requested height.
+        """
+        new_heights = sorted(set(new_heights), reverse=True)
+        img = self.img_loader(draft_height = new_heights[0] if new_heights else None)
+        thumbnails = {}
+
+        try:
+            orig_width, orig_height = self.size
+            source = img
+
+            for new_height in new_heights:
+                new_width = int(orig_width*(new_height/float(orig_height)))
+                thumbnails[new_height] = source.resize((new_width, new_height), resample=PILImage.Resampling.LANCZOS, box=None, reducing_gap=self._reducing_gap())
+
+                if new_height <= orig_height:
+                    # Next (smaller) height is derived from already reduced image
+                    source = thumbnails[new_height]
+            return thumbnails
+
+        except Exception as e:
+            logger.exception(f"An error occurred while using new_thumbnails_keep_aspect. {str(e)}")
+
     # def new_thumbnail_crop(self, box):
     #     """Returns a rectangular region from image.
     #     The box is a 4-tuple defining the left, upper, right, and lower pixel coordinate.
@@ -99,3 +170,93 @@ class SimpleImageProcessing:
 
     #     except Exception as e:
     #         print(f"Exception occured: {str(e)}")
+
+
+def supported_output_formats():
+    """Returns output formats which can be encoded by installed Pillow (AVIF needs a plugin)."""
+    PILImage.init()
+    return [img_format for img_format in OUTPUT_EXTENSIONS if img_format in PILImage.SAVE]
+
+
+def has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def encode_image(img, img_format = 'JPEG', quality = None, output = None):
+    """Encodes the image. JPEG of image with alpha channel is encoded as PNG instead,
+    so transparency is not lost.
+
+    Args:
+        img (PIL.Image): The image.
+        img_format (str): The requested format.
+        quality (int): Encoder quality of lossy formats, Pillow default if not set.
+        output (file): Fresh writable file to encode into, new in-memory buffer by default.
+
+    Returns:
+        Returns EncodedImage, its content is bytes, or the output file rewound if given.
+    """
+    options = {}
+
+    if img_format == 'JPEG' and has_alpha(img):
+        img_format = 'PNG'
+
+    if img_format == 'JPEG':
+        options.update(optimize = True, progressive = True)
+        if img.mode not in ('RGB', 'L', 'CMYK'):
+            img = img.convert('RGB')
+    elif img_format == 'PNG':
+        options.update(optimize = True)
+        # e.g. CMYK or YCbCr JPEG upload can not be written as PNG
+        if img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I'):
+            img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+
+    if quality and img_format != 'PNG':
+        options.update(quality = quality)
+
+    image_io = io.BytesIO() if output is None else output
+    img.save(image_io, format = img_format, **options)
+
+    if output is None:
+        return EncodedImage(image_io.getvalue(), img.size[0], img.size[1], img_format)
+
+    output.seek(0)
+    return EncodedImage(output, img.size[0], img.size[1], img_format)
+
+
+def render_thumbnails(source, new_heights, draft = False, reducing_gap = 2.0, img_format = 'JPEG', output_formats = None, output_factory = None):
+    """Decodes the image once, resizes it to all heights and encodes thumbnails.
+    The function does not touch Django, therefore it can be run in a separate process.
+
+    Args:
+        source (str or bytes): Path to the image file or its content.
+        new_heights (iterable(int)): The requested heights in pixels.
+        draft (bool): If JPEG should be decoded directly at reduced scale.
+        reducing_gap (float): Quality guard used in draft mode.
+        img_format (str): Format of encoded thumbnails, if not set by output_formats.
+        output_formats (dict): {height: [(format, quality), ...]}, the first format is used
+            for the thumbnail, the others for its variants.
+        output_factory (callable): Returns fresh file for every encoded image, e.g. spooled
+            temporary file. Encoded content is returned as bytes if not set (picklable).
+
+    Returns:
+        Returns dict of encoded thumbnails (EncodedImage) keyed by requested height.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    output_imgs = SimpleImageProcessing(source, draft = draft, reducing_gap = reducing_gap).new_thumbnails_keep_aspect(new_heights)
+
+    if output_imgs is None:
+        raise Exception("The image could not be processed.")
+
+    encoded = {}
+    for new_height, output_img in output_imgs.items():
+        formats = (output_formats or {}).get(new_height) or [(img_format, None)]
+        thumbnail, *variants = [
+            encode_image(output_img, variant_format, quality, output_factory() if output_factory else None)
+            for variant_format, quality in formats
+        ]
+        encoded[new_height] = thumbnail._replace(variants = tuple(variants))
+    return encoded
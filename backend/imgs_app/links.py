@@ -0,0 +1,38 @@
+import time
+from django.core import signing
+
+SIGNED_LINK_SALT = 'imgs_app.expiring_link'
+
+
+def sign_link(image_id, thumbnail_id, expiry_time):
+    """Returns stateless expiring link token. The token carries only the ids
+    of selected image/thumbnail and expiry timestamp, signed with HMAC (SECRET_KEY),
+    therefore it is verified without any database lookup, stays short and the
+    payload is built from current data once the link is resolved.
+
+    Args:
+        image_id (int): Id of selected image or None.
+        thumbnail_id (int): Id of selected thumbnail or None.
+        expiry_time (int): Link lifetime in seconds.
+
+    Returns:
+        Returns URL safe token.
+    """
+    payload = {'i': image_id, 't': thumbnail_id, 'e': int(time.time()) + expiry_time}
+    return signing.dumps(payload, salt = SIGNED_LINK_SALT)
+
+
+def unsign_link(token):
+    """Verifies stateless expiring link token.
+
+    Returns:
+        Returns tuple (image_id, thumbnail_id) or None if token is invalid or expired.
+    """
+    try:
+        payload = signing.loads(token, salt = SIGNED_LINK_SALT)
+    except signing.BadSignature:
+        return None
+
+    if payload['e'] <= time.time():
+        return None
+    return payload['i'], payload['t']
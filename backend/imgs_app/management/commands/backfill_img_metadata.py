@@ -0,0 +1,56 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from imgs_app.models import UploadedImage, Thumbnail
+from imgs_app.utils import file_content_hash, img_header_info
+
+logger = logging.getLogger(__name__)
+
+METADATA_FIELDS = ['imgWidth', 'imgHeight', 'imgFormat', 'fileSize', 'contentHash']
+
+
+def read_metadata(field_file):
+    """Returns metadata of stored file, only header of the image is read (not decoded)."""
+    with field_file.open('rb'):
+        img_width, img_height, img_format = img_header_info(field_file)
+        return {
+            'imgWidth': img_width,
+            'imgHeight': img_height,
+            'imgFormat': img_format,
+            'fileSize': field_file.size,
+            'contentHash': file_content_hash(field_file),
+        }
+
+
+class Command(BaseCommand):
+    help = "Backfill width, height, format, size and content hash of images and thumbnails stored before these were tracked."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of objects updated in single query.")
+
+    def handle(self, *args, **options):
+        missing_metadata = Q(imgWidth__isnull=True) | Q(imgHeight__isnull=True) | Q(imgFormat='') | Q(fileSize__isnull=True) | Q(contentHash='')
+
+        for model, file_field in ((UploadedImage, 'uploadedImage'), (Thumbnail, 'thumbnail')):
+            queryset = model.objects.filter(missing_metadata).exclude(**{file_field: ''}).only('pk', file_field, *METADATA_FIELDS)
+            batch = []
+            updated = failed = 0
+
+            for obj in queryset.iterator(chunk_size = options['batch_size']):
+                try:
+                    for name, value in read_metadata(getattr(obj, file_field)).items():
+                        setattr(obj, name, value)
+                except Exception as e:
+                    logger.exception(f"An error occurred while reading metadata of {model.__name__} {obj.pk}. {str(e)}")
+                    failed += 1
+                    continue
+
+                batch.append(obj)
+                if len(batch) >= options['batch_size']:
+                    updated += model.objects.bulk_update(batch, METADATA_FIELDS)
+                    batch = []
+
+            if batch:
+                updated += model.objects.bulk_update(batch, METADATA_FIELDS)
+
+            self.stdout.write(f"{model.__name__}: updated {updated}, failed {failed}.")
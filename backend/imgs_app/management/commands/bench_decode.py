@@ -0,0 +1,57 @@
+import io
+import time
+import resource
+import multiprocessing
+from django.core.management.base import BaseCommand
+from PIL import Image as PILImage
+from imgs_app.img_processing import SimpleImageProcessing
+
+
+def make_jpeg(width, height):
+    """Returns JPEG bytes of a synthetic image in requested size."""
+    img = PILImage.effect_noise((width, height), 64).convert('RGB')
+    image_io = io.BytesIO()
+    img.save(image_io, format='JPEG', quality=90)
+    return image_io.getvalue()
+
+
+def decode_case(jpeg_bytes, new_height, draft, reducing_gap):
+    """Runs in a fresh process, so peak RSS is measured for a single decode.
+
+    Returns:
+        Returns tuple of decode time (ms), resize time (ms) and peak RSS (MB).
+    """
+    processing = SimpleImageProcessing(io.BytesIO(jpeg_bytes), draft = draft, reducing_gap = reducing_gap)
+    start = time.perf_counter()
+    img = processing.img_loader(draft_height = new_height)
+    decoded = time.perf_counter()
+    new_width = int(processing.size[0]*(new_height/float(processing.size[1])))
+    img.resize((new_width, new_height), resample=PILImage.Resampling.LANCZOS, reducing_gap=processing._reducing_gap())
+    resized = time.perf_counter()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # ru_maxrss is in KB on Linux
+    return (decoded - start)*1000, (resized - decoded)*1000, peak_rss
+
+
+class Command(BaseCommand):
+    help = "Benchmark JPEG decode time and peak RSS with and without draft (DCT scaling) mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--widths', nargs='+', type=int, default=[1024, 2048, 4096, 8192], help="Widths of synthetic 3:2 uploads.")
+        parser.add_argument('--height', type=int, default=200, help="Requested thumbnail height.")
+        parser.add_argument('--reducing-gap', type=float, default=2.0, help="Quality guard used in draft mode.")
+
+    def handle(self, *args, **options):
+        ctx = multiprocessing.get_context('spawn')
+        self.stdout.write(f"{'upload':>12} {'size MB':>8} {'mode':>6} {'decode ms':>10} {'resize ms':>10} {'peak RSS MB':>12}")
+
+        for width in options['widths']:
+            height = width*2//3
+            jpeg_bytes = make_jpeg(width, height)
+
+            for draft in (False, True):
+                with ctx.Pool(1, maxtasksperchild=1) as pool:
+                    decode_ms, resize_ms, peak_rss = pool.apply(decode_case, (jpeg_bytes, options['height'], draft, options['reducing_gap']))
+                self.stdout.write(
+                    f"{f'{width}x{height}':>12} {len(jpeg_bytes)/1024/1024:>8.1f} {'draft' if draft else 'full':>6} "
+                    f"{decode_ms:>10.1f} {resize_ms:>10.1f} {peak_rss:>12.1f}"
+                )
@@ -0,0 +1,44 @@
+import os
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from imgs_app.img_processing import render_thumbnails
+from imgs_app.management.commands.bench_decode import make_jpeg
+
+
+class Command(BaseCommand):
+    help = "Benchmark thumbnails rendering throughput with process pool of 1, 4 and N processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', nargs='+', type=int, default=[1, 4, os.cpu_count()], help="Pool sizes to compare.")
+        parser.add_argument('--images', type=int, default=32, help="Number of images rendered per pool size.")
+        parser.add_argument('--width', type=int, default=3000, help="Width of synthetic 3:2 uploads.")
+        parser.add_argument('--heights', nargs='+', type=int, default=[200, 400], help="Requested thumbnail heights.")
+        parser.add_argument('--draft', action='store_true', help="Use JPEG draft decoding.")
+
+    def handle(self, *args, **options):
+        ctx = multiprocessing.get_context('spawn')
+        self.stdout.write(f"{'processes':>10} {'seconds':>8} {'images/s':>9} {'speedup':>8}")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'upload.jpg')
+            with open(path, 'wb') as f:
+                f.write(make_jpeg(options['width'], options['width']*2//3))
+
+            baseline = None
+            for processes in sorted(set(options['processes'])):
+                with ProcessPoolExecutor(max_workers = processes, mp_context = ctx) as process_pool:
+                    # Warm up the pool, so process start up is not measured
+                    list(process_pool.map(render_thumbnails, [path]*processes, [[25]]*processes))
+
+                    start = time.perf_counter()
+                    futures = [process_pool.submit(render_thumbnails, path, options['heights'], draft = options['draft']) for _ in range(options['images'])]
+                    for future in futures:
+                        future.result()
+                    elapsed = time.perf_counter() - start
+
+                throughput = options['images']/elapsed
+                baseline = baseline or throughput
+                self.stdout.write(f"{processes:>10} {elapsed:>8.2f} {throughput:>9.1f} {throughput/baseline:>7.1f}x")
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from imgs_app.tasks import delete_expired_links
+
+
+class Command(BaseCommand):
+    help = "Delete expired links in bounded batches (the same as purge_expired_links_task)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EXPIRING_LINKS_PURGE_BATCH_SIZE, help="Number of links deleted in single query.")
+
+    def handle(self, *args, **options):
+        deleted = delete_expired_links(options['batch_size'])
+        self.stdout.write(f"Deleted {deleted} expired links.")
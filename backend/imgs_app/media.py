@@ -0,0 +1,191 @@
+import re
+import mimetypes
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.negotiation import BaseContentNegotiation
+from imgs_app.img_processing import OUTPUT_EXTENSIONS
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_BLOCK_SIZE = 64 * 1024
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Media files are returned as stored, Accept header of the client (e.g. image/*)
+    is not negotiated against API renderers, which are used for errors only.
+    """
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix = None):
+        return (renderers[0], renderers[0].media_type)
+
+
+def parse_range(header, size):
+    """Parses single `bytes=start-end` range, multiple ranges are not supported.
+
+    Args:
+        header (str): The Range header value or None.
+        size (int): The file size in bytes.
+
+    Returns:
+        Returns (start, end) tuple, end inclusive, or None if whole file is sent.
+        Raises ValueError if the range is not satisfiable.
+    """
+    match = RANGE_RE.match(header or '')
+
+    if not match or match.groups() == ('', ''):
+        return None
+
+    start, end = match.groups()
+
+    if not start:
+        # Suffix range, last `end` bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable.")
+    return start, end
+
+
+def _file_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(RANGE_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _file_response(request, field_file, content_type, etag, last_modified):
+    size = field_file.size
+    if_range = request.headers.get('If-Range')
+    validators = [etag, http_date(last_modified) if last_modified else None]
+
+    try:
+        # Range of changed file is ignored, whole file is sent
+        byte_range = None if if_range and if_range not in validators else parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status = 416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = field_file.storage.open(field_file.name, 'rb')
+
+    if byte_range is None:
+        return FileResponse(file, content_type = content_type)
+
+    start, end = byte_range
+    response = StreamingHttpResponse(_file_range(file, start, end - start + 1), status = 206, content_type = content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    return response
+
+
+def serve_media(request, field_file, content_hash = None):
+    """Returns response of stored file, access has to be checked by the view.
+    Conditional GET is answered with 304 using ETag (content hash) and Last-Modified.
+    Bytes are sent by the front proxy if MEDIA_ACCEL_REDIRECT is set ('nginx' uses
+    X-Accel-Redirect, 'sendfile' uses X-Sendfile), otherwise streamed with Range support.
+
+    Args:
+        request: The request.
+        field_file (FieldFile): The stored file.
+        content_hash (str): SHA-256 of the file, used as ETag.
+
+    Returns:
+        Returns HttpResponse.
+    """
+    if not field_file:
+        raise Http404("File not found.")
+
+    try:
+        last_modified = int(field_file.storage.get_modified_time(field_file.name).timestamp())
+    except FileNotFoundError:
+        raise Http404("File not found.")
+    except NotImplementedError:
+        last_modified = None
+
+    etag = quote_etag(content_hash) if content_hash else None
+    response = get_conditional_response(request, etag = etag, last_modified = last_modified)
+
+    if response is None:
+        content_type = mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+
+        if settings.MEDIA_ACCEL_REDIRECT == 'nginx':
+            response = HttpResponse(content_type = content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_LOCATION + quote(field_file.name)
+        elif settings.MEDIA_ACCEL_REDIRECT == 'sendfile':
+            response = HttpResponse(content_type = content_type)
+            response['X-Sendfile'] = field_file.path
+        else:
+            response = _file_response(request, field_file, content_type, etag, last_modified)
+
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    # Access depends on account tier, therefore response is revalidated on every view
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def accepted_image_formats(accept):
+    """Returns image formats explicitly listed in Accept header, wildcards are ignored,
+    so variants are served only to clients which announce their support.
+
+    Args:
+        accept (str): The Accept header value or None.
+
+    Returns:
+        Returns set of format names, e.g. {'AVIF', 'WEBP'}.
+    """
+    img_formats = set()
+
+    for media_range in (accept or '').split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        quality = 1.0
+
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+
+        if quality > 0 and media_type.lower().startswith('image/') and media_type != 'image/*':
+            img_formats.add(media_type[6:].upper())
+    return img_formats
+
+
+def serve_thumbnail(request, thumb):
+    """Returns response of the thumbnail or of its variant preferred by the client (Accept header).
+
+    Args:
+        request: The request.
+        thumb (Thumbnail): The thumbnail, access has to be checked by the view.
+
+    Returns:
+        Returns HttpResponse, varying by Accept header.
+    """
+    accepted_formats = accepted_image_formats(request.headers.get('Accept'))
+    variants = {variant.imgFormat: variant for variant in thumb.variants.all()} if accepted_formats else {}
+    field_file, content_hash = thumb.thumbnail, thumb.contentHash
+
+    for img_format in OUTPUT_EXTENSIONS:
+        if img_format in accepted_formats and img_format in variants:
+            field_file, content_hash = variants[img_format].file, variants[img_format].contentHash
+            break
+
+    response = serve_media(request, field_file, content_hash)
+    patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='contentHash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
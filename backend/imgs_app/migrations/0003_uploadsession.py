@@ -0,0 +1,30 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('imgs_app', '0002_uploadedimage_contenthash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('fileName', models.CharField(max_length=255)),
+                ('fileSize', models.PositiveBigIntegerField()),
+                ('receivedBytes', models.PositiveBigIntegerField(default=0)),
+                ('parts', models.JSONField(blank=True, default=list, editable=False)),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+                ('expiresAt', models.DateTimeField(blank=True, db_index=True, editable=False, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
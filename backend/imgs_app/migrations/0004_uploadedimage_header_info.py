@@ -0,0 +1,34 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:26
+
+from django.db import migrations, models
+import imgs_app.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0003_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='imgFormat',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='imgHeight',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='imgWidth',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='uploadedImage',
+            field=models.ImageField(upload_to='uploaded_imgs/', validators=[imgs_app.validators.validate_img_extension, imgs_app.validators.validate_img_size, imgs_app.validators.validate_img_header]),
+        ),
+    ]
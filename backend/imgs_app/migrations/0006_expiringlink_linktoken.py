@@ -0,0 +1,40 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:29
+
+import uuid
+from django.db import migrations, models
+
+
+def populate_link_token(apps, schema_editor):
+    # Links created so far store uuid4().hex in linkUUID
+    ExpiringLink = apps.get_model('imgs_app', 'ExpiringLink')
+    seen = set()
+    links = []
+
+    for link in ExpiringLink.objects.filter(linkToken__isnull=True).only('pk', 'linkUUID').iterator():
+        try:
+            token = uuid.UUID(link.linkUUID)
+        except ValueError:
+            continue
+
+        if token not in seen:
+            seen.add(token)
+            link.linkToken = token
+            links.append(link)
+
+    ExpiringLink.objects.bulk_update(links, ['linkToken'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0005_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expiringlink',
+            name='linkToken',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(populate_link_token, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:30
+
+import datetime
+from django.db import migrations, models
+
+
+def populate_expires_at(apps, schema_editor):
+    ExpiringLink = apps.get_model('imgs_app', 'ExpiringLink')
+    links = []
+
+    for link in ExpiringLink.objects.filter(expiresAt__isnull=True).only('pk', 'createdAt', 'expiryTime').iterator():
+        link.expiresAt = link.createdAt + datetime.timedelta(seconds=link.expiryTime)
+        links.append(link)
+
+    ExpiringLink.objects.bulk_update(links, ['expiresAt'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0006_expiringlink_linktoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expiringlink',
+            name='expiresAt',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_expires_at, migrations.RunPython.noop),
+    ]
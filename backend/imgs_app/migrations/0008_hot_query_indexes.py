@@ -0,0 +1,44 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_thumbnails(apps, schema_editor):
+    # Keeps the first thumbnail of every (parentImage, height) pair, links are moved to it
+    Thumbnail = apps.get_model('imgs_app', 'Thumbnail')
+    ExpiringLink = apps.get_model('imgs_app', 'ExpiringLink')
+    duplicates = Thumbnail.objects.values('parentImage', 'height').annotate(keep=Min('pk'), count=Count('pk')).filter(count__gt=1)
+
+    for duplicate in list(duplicates):
+        redundant = Thumbnail.objects.filter(parentImage=duplicate['parentImage'], height=duplicate['height']).exclude(pk=duplicate['keep'])
+        ExpiringLink.objects.filter(thumbnail__in=redundant).update(thumbnail=duplicate['keep'])
+        redundant.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0007_expiringlink_expiresat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expiringlink',
+            name='linkUUID',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='thumbnail',
+            index=models.Index(fields=['user', 'height'], name='imgs_thumb_user_height_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedimage',
+            index=models.Index(fields=['user', 'id'], name='imgs_img_user_id_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_thumbnails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='thumbnail',
+            constraint=models.UniqueConstraint(fields=('parentImage', 'height'), name='imgs_thumb_parent_height_uniq'),
+        ),
+    ]
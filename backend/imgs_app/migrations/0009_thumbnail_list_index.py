@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='thumbnail',
+            name='imgs_thumb_user_height_idx',
+        ),
+        migrations.AddIndex(
+            model_name='thumbnail',
+            index=models.Index(fields=['user', 'height', 'id'], name='imgs_thumb_user_height_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0009_thumbnail_list_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnail',
+            name='lastAccessed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
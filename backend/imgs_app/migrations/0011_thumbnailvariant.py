@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0010_thumbnail_lastaccessed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThumbnailVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.ImageField(upload_to='thumbnails/')),
+                ('imgFormat', models.CharField(max_length=10)),
+                ('fileSize', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('contentHash', models.CharField(blank=True, max_length=64)),
+                ('thumbnail', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='imgs_app.thumbnail')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='thumbnailvariant',
+            constraint=models.UniqueConstraint(fields=('thumbnail', 'imgFormat'), name='imgs_variant_thumb_format_uniq'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:57
+
+from django.db import migrations, models
+import imgs_app.models
+
+
+def mark_existing_ready(apps, schema_editor):
+    # Images uploaded before were already processed (or are picked up by the user thumbnails check)
+    UploadedImage = apps.get_model('imgs_app', 'UploadedImage')
+    UploadedImage.objects.update(processingState='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0011_thumbnailvariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='processingState',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default=imgs_app.models.initial_processing_state, max_length=10),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0012_uploadedimage_processingstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='finalizedAt',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:45
+
+import datetime
+from django.db import migrations
+
+
+def populate_expires_at(apps, schema_editor):
+    # Links written since 0007 by bulk_create or update() bypass save()
+    ExpiringLink = apps.get_model('imgs_app', 'ExpiringLink')
+    links = []
+
+    for link in ExpiringLink.objects.filter(expiresAt__isnull=True).only('pk', 'createdAt', 'expiryTime').iterator():
+        link.expiresAt = link.createdAt + datetime.timedelta(seconds=link.expiryTime)
+        links.append(link)
+
+    ExpiringLink.objects.bulk_update(links, ['expiresAt'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0013_uploadsession_finalizedat'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_expires_at, migrations.RunPython.noop),
+    ]
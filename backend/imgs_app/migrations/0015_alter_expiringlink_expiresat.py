@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imgs_app', '0014_populate_expiringlink_expiresat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expiringlink',
+            name='expiresAt',
+            field=models.DateTimeField(db_index=True, editable=False),
+        ),
+    ]
@@ -1,22 +1,49 @@
+import uuid
+import datetime
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.auth import get_user_model
 from django.core.files.storage import default_storage
-from imgs_app.validators import validate_img_extension, validate_img_size
+from imgs_app.validators import validate_img_extension, validate_img_size, validate_img_header
 from auth_app.models import ThumbnailHeight
 
 User = get_user_model()
 
+def initial_processing_state():
+    # In lazy render mode thumbnails are rendered on request, therefore image is ready at once
+    return 'ready' if settings.THUMBNAIL_RENDER_MODE == 'lazy' else 'pending'
+
+
 class UploadedImage(models.Model):
     """Default image model uploaded by the user.
     The image is further processed to make thumbnails accordingly to the plan.
     """
+    PENDING, PROCESSING, READY, FAILED = 'pending', 'processing', 'ready', 'failed'
+
     uploadedImage = models.ImageField(
         upload_to = 'uploaded_imgs/', 
         blank = False, 
-        validators = [validate_img_extension, validate_img_size]
+        validators = [validate_img_extension, validate_img_size, validate_img_header]
         )
     user = models.ForeignKey(User, blank = False, on_delete = models.CASCADE)
+    contentHash = models.CharField(max_length = 64, blank = True, db_index = True) # SHA-256 of the file, identical uploads of the user share the stored file and thumbnails
+    imgWidth = models.PositiveIntegerField(blank = True, null = True) # read from header on upload, file is not reopened to learn its size
+    imgHeight = models.PositiveIntegerField(blank = True, null = True)
+    imgFormat = models.CharField(max_length = 10, blank = True)
+    fileSize = models.PositiveBigIntegerField(blank = True, null = True) # in bytes
+    processingState = models.CharField(
+        max_length = 10,
+        choices = [(PENDING, 'Pending'), (PROCESSING, 'Processing'), (READY, 'Ready'), (FAILED, 'Failed')],
+        default = initial_processing_state,
+        ) # thumbnails processing, written by tasks and waited on by clients (status.py)
+    processingUpdatedAt = models.DateTimeField(default = timezone.now, editable = False) # last state change, image in progress for longer is treated as lost
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['user', 'id'], name = 'imgs_img_user_id_idx'), # user's images listed in pk order
+        ]
 
     def __str__(self) -> str:
         return f"Image {str(self.pk)} - User {str(self.user.username)}"
@@ -39,6 +66,36 @@ class Thumbnail(models.Model):
     height = models.ForeignKey(ThumbnailHeight, blank = False, on_delete = models.CASCADE) # Once height is removed, object is deleted - height's object not editable
     user = models.ForeignKey(User, blank = False, on_delete = models.CASCADE) # OK, this introduces redundancy, 
                                                                               # however reduces complexity of queries, therefore its justified
+    imgWidth = models.PositiveIntegerField(blank = True, null = True) # stored once thumbnail is written, clients get layout metadata without touching storage
+    imgHeight = models.PositiveIntegerField(blank = True, null = True)
+    imgFormat = models.CharField(max_length = 10, blank = True)
+    fileSize = models.PositiveBigIntegerField(blank = True, null = True) # in bytes
+    contentHash = models.CharField(max_length = 64, blank = True) # SHA-256 of the file
+    lastAccessed = models.DateTimeField(blank = True, null = True, db_index = True) # updated at most once per THUMBNAIL_ACCESS_RESOLUTION, used by LRU eviction
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['user', 'height', 'id'], name = 'imgs_thumb_user_height_id_idx'), # thumbnails list of user by height in pk order
+        ]
+        constraints = [
+            models.UniqueConstraint(fields = ['parentImage', 'height'], name = 'imgs_thumb_parent_height_uniq'), # single thumbnail per image and height
+        ]
+
+
+class ThumbnailVariant(models.Model):
+    """Thumbnail encoded in another format (WebP, AVIF), 
+    served instead of the thumbnail if client accepts the format.
+    """
+    thumbnail = models.ForeignKey(Thumbnail, related_name = 'variants', on_delete = models.CASCADE, blank = False)
+    file = models.ImageField(upload_to = 'thumbnails/', blank = False)
+    imgFormat = models.CharField(max_length = 10, blank = False)
+    fileSize = models.PositiveBigIntegerField(blank = True, null = True) # in bytes
+    contentHash = models.CharField(max_length = 64, blank = True) # SHA-256 of the file
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['thumbnail', 'imgFormat'], name = 'imgs_variant_thumb_format_uniq'),
+        ]
 
 
 class ExpiringLink(models.Model):
@@ -50,4 +107,31 @@ class ExpiringLink(models.Model):
     image = models.ForeignKey(UploadedImage, models.CASCADE, blank = True, null = True)
     thumbnail = models.ForeignKey(Thumbnail, models.CASCADE, blank = True, null = True)
     createdAt = models.DateTimeField(auto_now_add = True, editable = False)
-    linkUUID = models.CharField(max_length = 100)
+    linkUUID = models.CharField(max_length = 100, db_index = True) # legacy string form of linkToken
+    linkToken = models.UUIDField(unique = True, blank = True, null = True, editable = False) # compact indexed token, links are resolved by it
+    expiresAt = models.DateTimeField(db_index = True, editable = False) # createdAt + expiryTime (set on save), indexed for expired links cleanup
+
+    def save(self, *args, **kwargs):
+        self.expiresAt = (self.createdAt or timezone.now()) + datetime.timedelta(seconds = self.expiryTime)
+        super().save(*args, **kwargs)
+
+
+class UploadSession(models.Model):
+    """Resumable chunked upload session.
+    Chunks are streamed to storage as separate parts, which are
+    joined into UploadedImage once the session is finalized.
+    """
+    id = models.UUIDField(primary_key = True, default = uuid.uuid4, editable = False)
+    user = models.ForeignKey(User, blank = False, on_delete = models.CASCADE)
+    fileName = models.CharField(max_length = 255, blank = False)
+    fileSize = models.PositiveBigIntegerField(blank = False) # declared by client, validated before upload
+    receivedBytes = models.PositiveBigIntegerField(default = 0)
+    parts = models.JSONField(default = list, blank = True, editable = False) # [offset, storage name] of confirmed chunks in order
+    createdAt = models.DateTimeField(auto_now_add = True, editable = False)
+    expiresAt = models.DateTimeField(blank = True, null = True, db_index = True, editable = False) # extended by every chunk, abandoned sessions are purged
+    finalizedAt = models.DateTimeField(blank = True, null = True, editable = False) # claimed by finalize request, concurrent finalize gets 409
+
+    def save(self, *args, **kwargs):
+        if self.expiresAt is None:
+            self.expiresAt = timezone.now() + datetime.timedelta(seconds = settings.UPLOAD_SESSION_TIMEOUT)
+        super().save(*args, **kwargs)
@@ -0,0 +1,41 @@
+import tempfile
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from imgs_app.utils import content_hash, file_content_hash
+
+
+def spooled_output():
+    """Returns fresh temporary file for single encoded image. The file is kept in memory
+    up to THUMBNAIL_SPOOL_MAX_SIZE bytes, bigger output is rolled over to disk.
+    """
+    return tempfile.SpooledTemporaryFile(max_size = settings.THUMBNAIL_SPOOL_MAX_SIZE)
+
+
+def save_encoded(field_file, name, encoded_img):
+    """Writes encoded image to storage of the field (without saving the model).
+    Spooled output is streamed to storage as it is and closed afterwards,
+    bytes (returned by the process pool) are only wrapped.
+
+    Args:
+        field_file (FieldFile): The file field of the model instance.
+        name (str): The file name.
+        encoded_img (EncodedImage): The encoded image, content is bytes or file.
+
+    Returns:
+        Returns (file size, content hash) tuple of the stored file.
+    """
+    content = encoded_img.content
+
+    if isinstance(content, bytes):
+        field_file.save(name, ContentFile(content), save = False)
+        return len(content), content_hash(content)
+
+    try:
+        # Size is not read from disk, part of rolled over file may still be buffered
+        file_size = content.seek(0, 2)
+        output = File(content)
+        file_hash = file_content_hash(output)
+        field_file.save(name, output, save = False)
+        return file_size, file_hash
+    finally:
+        content.close()
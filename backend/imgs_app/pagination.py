@@ -0,0 +1,27 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class PkCursorPagination(CursorPagination):
+    """Keyset (cursor) pagination on pk. Every page is fetched by `pk > cursor`
+    range scan on user's index, so its cost does not depend on page depth.
+    Page size can be set by `page_size` query param, up to LIST_MAX_PAGE_SIZE.
+    """
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = settings.LIST_PAGE_SIZE
+        self.max_page_size = settings.LIST_MAX_PAGE_SIZE
+
+    def get_paginated_payload(self, data, name):
+        """Returns page payload, results are kept under `name` key as before pagination."""
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            name: list(data),
+        }
+
+    def get_cache_args(self, request, fields = None):
+        """Returns page identifying args (cursor, page size, fields) of the cache key."""
+        return [request.query_params.get('cursor', ''), self.get_page_size(request), ','.join(fields or [])]
@@ -2,4 +2,4 @@ from rest_framework.permissions import BasePermission
 
 class NewExpiringLinksCreatePermission(BasePermission):
     def has_permission(self, request, view):
-        return (request.user.userTier.accessGenerateExpiringLinks or request.user.is_staff)
\ No newline at end of file
+        return (request.tier.accessGenerateExpiringLinks or request.user.is_staff)
\ No newline at end of file
@@ -0,0 +1,46 @@
+from functools import reduce
+from operator import or_
+from django.db.models import Exists, OuterRef, Q
+from auth_app.models import ThumbnailHeight
+from imgs_app.models import Thumbnail
+
+
+def _has_height_field(thumbnailHeight):
+    return f'has_height_{thumbnailHeight.pk}'
+
+
+def plan_missing_thumbnails(uploaded_imgs, thumbnailHeights = None, chunk_size = 2000):
+    """Works out all missing (image, height) thumbnail pairs using a single query.
+    Every height is checked with a correlated NOT EXISTS subquery against Thumbnail,
+    which database executes as an anti-join, therefore number of queries does not
+    depend on number of images nor heights.
+
+    Args:
+        uploaded_imgs (QuerySet): UploadedImage queryset to check.
+        thumbnailHeights (iterable(ThumbnailHeight)): Heights to check, all heights by default.
+        chunk_size (int): Number of images fetched from db at once.
+
+    Returns:
+        Returns generator of (UploadedImage, list(ThumbnailHeight)) tuples, where list
+        contains only missing heights of the image.
+    """
+    if thumbnailHeights is None:
+        thumbnailHeights = ThumbnailHeight.objects.all()
+
+    thumbnailHeights = list(thumbnailHeights)
+
+    if not thumbnailHeights:
+        return
+
+    annotations = {
+        _has_height_field(thumbnailHeight): Exists(
+            Thumbnail.objects.filter(parentImage = OuterRef('pk'), height = thumbnailHeight)
+        )
+        for thumbnailHeight in thumbnailHeights
+    }
+    missing_any = reduce(or_, (Q(**{field: False}) for field in annotations))
+    missing_imgs = uploaded_imgs.annotate(**annotations).filter(missing_any).order_by('pk')
+
+    for uploaded_img in missing_imgs.iterator(chunk_size = chunk_size):
+        missing_heights = [h for h in thumbnailHeights if not getattr(uploaded_img, _has_height_field(h))]
+        yield uploaded_img, missing_heights
@@ -1,27 +1,128 @@
-from rest_framework.serializers import ModelSerializer, ValidationError
-from imgs_app.models import UploadedImage, Thumbnail, ExpiringLink
+from rest_framework.serializers import IntegerField, ModelSerializer, ValidationError
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.base import File
+from django.db import transaction
+from imgs_app.models import UploadedImage, Thumbnail, ThumbnailVariant, ExpiringLink, UploadSession
+from imgs_app.validators import validate_img_extension, validate_img_declared_size
+from imgs_app.utils import file_content_hash, img_header_info
+
+METADATA_FIELDS = ['imgWidth', 'imgHeight', 'imgFormat', 'fileSize', 'contentHash']
+
+
+class DynamicFieldsMixin:
+    """Serializer mixin accepting `fields` kwarg, only these fields are serialized."""
+    def __init__(self, *args, fields = None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+def parse_requested_fields(value, serializer_class):
+    """Parses `fields` query param (comma separated field names).
+
+    Args:
+        value (str): The query param value or None.
+        serializer_class: Serializer the fields are selected from.
+
+    Returns:
+        Returns list of field names or None if all fields are requested.
+    """
+    if not value:
+        return None
+
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown_fields = set(fields) - set(serializer_class.Meta.fields)
+
+    if unknown_fields:
+        raise ValidationError(f"Unknown fields: {', '.join(sorted(unknown_fields))}.")
+    return fields
+
+
+class ThumbnailVariantSerializer(ModelSerializer):
+    class Meta:
+        model = ThumbnailVariant
+        fields = ['file', 'imgFormat', 'fileSize']
+        read_only_fields = fields
+
+
+class ThumbnailSerializer(DynamicFieldsMixin, ModelSerializer):
+    variants = ThumbnailVariantSerializer(many = True, read_only = True) # the same thumbnail in other formats, e.g. WebP
 
-class ThumbnailSerializer(ModelSerializer):
     class Meta:
         model = Thumbnail
-        fields = ['thumbnail']
+        fields = ['thumbnail'] + METADATA_FIELDS + ['variants']
+        read_only_fields = METADATA_FIELDS
 
 
-class ImageSerializer(ModelSerializer):
+class ImageSerializer(DynamicFieldsMixin, ModelSerializer):
 
     class Meta:
         model = UploadedImage
-        fields = ['uploadedImage']
+        fields = ['uploadedImage'] + METADATA_FIELDS
+        read_only_fields = METADATA_FIELDS
 
     def create(self, validated_data):
-        img = UploadedImage(
-            uploadedImage = validated_data['uploadedImage'],
-            user = validated_data['user']
-        )
-        img.save()
+        uploaded_file = validated_data['uploadedImage']
+        content_hash = file_content_hash(uploaded_file)
+        img_width, img_height, img_format = img_header_info(uploaded_file)
+        with transaction.atomic():
+            # Shared only within the account, stored name of other user's upload is never returned.
+            # The duplicate stays locked until the image is saved, so its shared file is not released meanwhile (signals.py)
+            duplicate = UploadedImage.objects.select_for_update().filter(contentHash = content_hash, user = validated_data['user']).exclude(uploadedImage = '').order_by('pk').first()
+
+            img = UploadedImage(
+                # Identical file is already stored, therefore reuse it instead of writing it again
+                uploadedImage = duplicate.uploadedImage.name if duplicate else uploaded_file,
+                user = validated_data['user'],
+                contentHash = content_hash,
+                imgWidth = img_width,
+                imgHeight = img_height,
+                imgFormat = img_format,
+                fileSize = uploaded_file.size
+            )
+            img.save()
         return img
 
 
+class GallerySerializer(DynamicFieldsMixin, ModelSerializer):
+    """Image with all its thumbnails allowed by account tier.
+    Expects `allowed_thumbnails` prefetched and `thumbnailsCount` annotated.
+    """
+    thumbnails = ThumbnailSerializer(source = 'allowed_thumbnails', many = True, read_only = True)
+    thumbnailsCount = IntegerField(read_only = True)
+
+    class Meta:
+        model = UploadedImage
+        fields = ['id', 'uploadedImage'] + METADATA_FIELDS + ['thumbnailsCount', 'thumbnails']
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(ModelSerializer):
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'fileName', 'fileSize', 'receivedBytes']
+        read_only_fields = ['id', 'receivedBytes']
+
+    def validate_fileName(self, value):
+        try:
+            validate_img_extension(File(None, name = value))
+        except DjangoValidationError as e:
+            raise ValidationError(e.messages)
+        return value
+
+    def validate_fileSize(self, value):
+        if value == 0:
+            raise ValidationError("File is empty.")
+        try:
+            validate_img_declared_size(value)
+        except DjangoValidationError as e:
+            raise ValidationError(e.messages)
+        return value
+
+
 class ExpiringLinkSerializer(ModelSerializer):
 
     class Meta:
@@ -35,13 +136,13 @@ class ExpiringLinkSerializer(ModelSerializer):
         # Filter the queryset for the 'user' field to show only the request user
         if request and request.user.is_authenticated:
             # And check if user can view original images
-            if request.user.userTier.accessOriginalFile:
+            if request.tier.accessOriginalFile:
                 self.fields['image'].queryset = UploadedImage.objects.filter(user=request.user) 
             else:
                 self.fields['image'].queryset = None
             # Filter thumbnails by defined heights available for account tier
-            account_heights = request.user.userTier.thumbnailHeight.values_list('available_height',flat=True)
-            self.fields['thumbnail'].queryset = Thumbnail.objects.filter(user=request.user, height__available_height__in=account_heights)
+            account_heights = sorted(request.tier.heights)
+            self.fields['thumbnail'].queryset = Thumbnail.objects.select_related('height').filter(user=request.user, height__available_height__in=account_heights)
 
     def validate(self, data):
         """We already check if user is authenticated in view,
@@ -61,16 +162,16 @@ class ExpiringLinkSerializer(ModelSerializer):
         if selected_image is None and selected_thumbnail is None:
             raise ValidationError("Please make selections.")
         
-        if selected_thumbnail and selected_thumbnail.user != request.user:
+        if selected_thumbnail and selected_thumbnail.user_id != request.user.pk:
             raise ValidationError("Please select your thumbnail.")
 
-        if selected_image and selected_image.user != request.user:
+        if selected_image and selected_image.user_id != request.user.pk:
             raise ValidationError("Please select your images.")
 
-        if not selected_thumbnail.height.available_height in request.user.userTier.thumbnailHeight.values_list('available_height',flat=True):
+        if selected_thumbnail and not selected_thumbnail.height.available_height in request.tier.heights:
             raise ValidationError("Incorrect image.")
             
-        if selected_image and not request.user.userTier.accessOriginalFile:
+        if selected_image and not request.tier.accessOriginalFile:
             raise ValidationError("Account tier does not include this feature.")
 
         return data
@@ -1,14 +1,106 @@
+from django.conf import settings
+from django.db import transaction
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from imgs_app.models import UploadedImage
-from imgs_app.tasks import process_uploaded_img_task
+from django.db.models.signals import post_save, post_delete
+from imgs_app.models import UploadedImage, Thumbnail, ThumbnailVariant, ExpiringLink
+from imgs_app.tasks import enqueue_on_commit, process_uploaded_imgs_task
+from imgs_app.cache import bump_user_cache_version, invalidate_cached_link
+
+
+def release_file_on_commit(field_file, references):
+    """Removes the file from storage once the deleting transaction is committed,
+    unless other objects still reference it. The references are checked in the
+    on_commit callback under row locks, so concurrent deletes of objects sharing
+    the file do not both keep it, and an object reusing the file (which locks
+    its source row first) does not lose it.
+
+    Args:
+        field_file (FieldFile): The file of deleted object.
+        references (QuerySet): Objects which may still reference the file.
+    """
+    name, storage = field_file.name, field_file.storage
+    if not name:
+        return
+
+    def release():
+        with transaction.atomic():
+            if not list(references.select_for_update().values_list('pk', flat=True)):
+                storage.delete(name)
+
+    transaction.on_commit(release)
 
 
 @receiver(post_save, sender=UploadedImage)
-def trigger_uploaded_img(sender, instance, created, **kwargs):
+def trigger_uploaded_img(sender, instance, created, using, **kwargs):
+    """
+    As soon as UploadedImage object is saved by Django ORM and its transaction is committed,
+    the image is placed in que (tasks.py) for async height processing. Images created
+    in one transaction (bulk import) are sent in batches.
+    In lazy render mode thumbnails are rendered on first request instead.
+    """
+    if created and settings.THUMBNAIL_RENDER_MODE == 'eager':
+        enqueue_on_commit(process_uploaded_imgs_task, instance.id, using)
+
+
+@receiver(post_delete, sender=UploadedImage)
+def release_uploaded_img_file(sender, instance, **kwargs):
+    """
+    Identical uploads share the stored file, therefore the file is removed
+    from storage once the last image object referencing it is deleted.
+    """
+    release_file_on_commit(instance.uploadedImage, UploadedImage.objects.filter(contentHash=instance.contentHash, uploadedImage=instance.uploadedImage.name))
+
+
+@receiver(post_delete, sender=Thumbnail)
+def release_thumbnail_file(sender, instance, **kwargs):
+    """
+    Thumbnails of identical uploads share the stored file, therefore the file is removed
+    from storage once the last thumbnail object referencing it is deleted.
+    """
+    release_file_on_commit(instance.thumbnail, Thumbnail.objects.filter(height_id=instance.height_id, thumbnail=instance.thumbnail.name))
+
+
+@receiver(post_delete, sender=ThumbnailVariant)
+def release_thumbnail_variant_file(sender, instance, **kwargs):
+    """
+    Variants of reused thumbnails share the stored file, the same as thumbnails.
+    """
+    release_file_on_commit(instance.file, ThumbnailVariant.objects.filter(file=instance.file.name))
+
+
+@receiver(post_save, sender=UploadedImage)
+@receiver(post_delete, sender=UploadedImage)
+@receiver(post_save, sender=Thumbnail)
+@receiver(post_delete, sender=Thumbnail)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """
+    Cached list payloads of the user are invalidated once the change
+    is committed, so stale data is never cached under the new version.
+    """
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_user_cache_version(user_id))
+
+
+@receiver(post_save, sender=ThumbnailVariant)
+@receiver(post_delete, sender=ThumbnailVariant)
+def invalidate_user_cache_on_variant(sender, instance, **kwargs):
+    """
+    Variants are listed with their thumbnail, therefore cached list payloads
+    of the thumbnail's user are invalidated the same way.
+    """
+    if ThumbnailVariant.thumbnail.is_cached(instance):
+        user_id = instance.thumbnail.user_id
+    else:
+        user_id = Thumbnail.objects.filter(pk=instance.thumbnail_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        transaction.on_commit(lambda: bump_user_cache_version(user_id))
+
+
+@receiver(post_delete, sender=ExpiringLink)
+def invalidate_expiring_link(sender, instance, **kwargs):
     """
-    As soon as UploadedImage object is saved by Django ORM,
-    the image is placed in que (tasks.py) for async height processing.
+    Cached link is removed as soon as the link is deleted,
+    also once its image or thumbnail is deleted (cascade).
     """
-    if created:
-        process_uploaded_img_task.delay(instance.id)
+    invalidate_cached_link(instance)
+    transaction.on_commit(lambda: invalidate_cached_link(instance))
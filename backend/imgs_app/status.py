@@ -0,0 +1,101 @@
+import json
+import time
+import asyncio
+import datetime
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from imgs_app.models import UploadedImage
+
+IN_PROGRESS_STATES = (UploadedImage.PENDING, UploadedImage.PROCESSING)
+KEEP_ALIVE_INTERVAL = 15 # in seconds, comment sent to idle event stream, so proxies do not close it
+
+
+def processing_in_progress(images):
+    """Returns images with thumbnails being processed. Image in progress for longer than
+    IMAGE_PROCESSING_STALE_AFTER is left out, its task was lost or its worker crashed.
+
+    Args:
+        images (QuerySet): The uploaded images.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds = settings.IMAGE_PROCESSING_STALE_AFTER)
+    return images.filter(processingState__in = IN_PROGRESS_STATES, processingUpdatedAt__gt = cutoff)
+
+
+def state_cache_key(object_id):
+    return f'imgs:state:{object_id}'
+
+
+def set_processing_state(object_ids, state):
+    """Stores processing state of the images in db and in cache,
+    waiting clients poll the cache only, so waiting does not query db.
+
+    Args:
+        object_ids (iterable(int)): The uploaded image pks.
+        state (str): The state, e.g. UploadedImage.READY.
+    """
+    object_ids = list(object_ids)
+
+    if not object_ids:
+        return
+
+    UploadedImage.objects.filter(pk__in = object_ids).update(processingState = state, processingUpdatedAt = timezone.now())
+    cache.set_many({state_cache_key(pk): state for pk in object_ids}, settings.IMAGE_STATUS_CACHE_TIMEOUT)
+
+
+def get_processing_state(uploaded_img):
+    """Returns current state of the image, stored value of the object is used if cache has none."""
+    return cache.get(state_cache_key(uploaded_img.pk)) or uploaded_img.processingState
+
+
+def wait_processing_state(uploaded_img, timeout):
+    """Long-poll, waits until thumbnails of the image are processed (ready or failed).
+
+    Args:
+        uploaded_img (UploadedImage): The uploaded image.
+        timeout (float): Max seconds to wait.
+
+    Returns:
+        Returns the state, still in progress if timeout passed.
+    """
+    deadline = time.monotonic() + timeout
+    state = get_processing_state(uploaded_img)
+
+    while state in IN_PROGRESS_STATES and time.monotonic() < deadline:
+        time.sleep(settings.IMAGE_STATUS_POLL_INTERVAL)
+        state = get_processing_state(uploaded_img)
+    return state
+
+
+def _state_event(uploaded_img, state):
+    return f'event: state\ndata: {json.dumps({"id": uploaded_img.pk, "processingState": state})}\n\n'
+
+
+async def processing_state_events(uploaded_img, timeout):
+    """Server-sent events stream of the image state, the current state is sent at once,
+    then every change. The stream ends once thumbnails are processed or after timeout.
+    Waiting does not hold a worker thread when served by ASGI (backend/asgi.py).
+
+    Args:
+        uploaded_img (UploadedImage): The uploaded image.
+        timeout (float): Max seconds to stream.
+
+    Returns:
+        Returns async generator of event strings.
+    """
+    deadline = time.monotonic() + timeout
+    sent_state, sent_at = None, time.monotonic()
+
+    while True:
+        state = await cache.aget(state_cache_key(uploaded_img.pk)) or uploaded_img.processingState
+
+        if state != sent_state:
+            sent_state, sent_at = state, time.monotonic()
+            yield _state_event(uploaded_img, state)
+        elif time.monotonic() - sent_at >= KEEP_ALIVE_INTERVAL:
+            sent_at = time.monotonic()
+            yield ': keep-alive\n\n'
+
+        if state not in IN_PROGRESS_STATES or time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(settings.IMAGE_STATUS_POLL_INTERVAL)
@@ -1,76 +1,421 @@
-import io
+import time
 import logging
-from celery import shared_task
+import datetime
+import threading
+from collections import namedtuple
+from celery import group, shared_task
 from pathlib import Path
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum
 from auth_app.models import ThumbnailHeight
-from imgs_app.models import UploadedImage, Thumbnail
-from imgs_app.img_processing import SimpleImageProcessing
+from imgs_app.models import UploadedImage, Thumbnail, ThumbnailVariant, ExpiringLink, UploadSession
+from imgs_app.executors import render_planned_thumbnails
+from imgs_app.img_processing import OUTPUT_EXTENSIONS
+from imgs_app.outputs import save_encoded
+from imgs_app.planner import plan_missing_thumbnails
+from imgs_app.uploads import delete_session_parts
+from imgs_app.status import IN_PROGRESS_STATES, processing_in_progress, set_processing_state
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+
+def create_thumbnails(plan, use_process_pool = True):
+    """Creates thumbnail objects of planned images. Every image is decoded once
+    and processed to all its missing heights keeping image's aspect ratio.
+    Rendering runs in the process pool if it is enabled, see executors.py.
+    Image which failed to render is skipped, so is (image, height) pair being
+    rendered by other worker at the moment (render lock).
+    Processing state of images which failed to render is set to failed. Rendered
+    image is set to ready once none of its thumbnails is missing, e.g. image with
+    a height rendered by other worker is left to that worker. In lazy render mode
+    images never have all thumbnails, rendered image is set to ready then.
+
+    Args:
+        plan (iterable): (UploadedImage, list(ThumbnailHeight)) tuples, usually from planner.
+        use_process_pool (bool): If the process pool can be used.
+    """
+    claimed = {}
+    processed = {UploadedImage.READY: [], UploadedImage.FAILED: []}
+
+    try:
+        for uploaded_img, missing_heights, encoded in render_planned_thumbnails(_claim_plan(plan, claimed), use_process_pool):
+            try:
+                if encoded is None:
+                    processed[UploadedImage.FAILED].append(uploaded_img.pk)
+                    # Requests of the pairs do not render them again until the marker expires
+                    cache.set_many({_render_failed_key(uploaded_img, h): 1 for h in missing_heights}, settings.THUMBNAIL_RENDER_RETRY_AFTER)
+                    continue
+
+                for thumbnailHeight in missing_heights:
+                    _store_thumbnail(uploaded_img, thumbnailHeight, encoded[thumbnailHeight.available_height])
+                processed[UploadedImage.READY].append(uploaded_img.pk)
+            finally:
+                cache.delete_many(claimed.pop(uploaded_img.pk, []))
+    finally:
+        # Plan was not finished, locks of images being rendered are released
+        cache.delete_many([lock_key for lock_keys in claimed.values() for lock_key in lock_keys])
+
+        set_processing_state(processed[UploadedImage.FAILED], UploadedImage.FAILED)
+        if settings.THUMBNAIL_RENDER_MODE == 'lazy':
+            set_processing_state(processed[UploadedImage.READY], UploadedImage.READY)
+        elif processed[UploadedImage.READY]:
+            set_ready_if_complete(UploadedImage.objects.filter(pk__in = processed[UploadedImage.READY]))
+
+
+def _render_lock_key(uploaded_img, thumbnailHeight):
+    return f'imgs:render:{uploaded_img.pk}:{thumbnailHeight.pk}'
+
+
+def _render_queued_key(object_id, height_id):
+    return f'imgs:render_queued:{object_id}:{height_id}'
+
+
+def _render_failed_key(uploaded_img, thumbnailHeight):
+    return f'imgs:render_failed:{uploaded_img.pk}:{thumbnailHeight.pk}'
+
+
+def render_failed(uploaded_img, thumbnailHeight):
+    """Returns True if rendering of the thumbnail failed within THUMBNAIL_RENDER_RETRY_AFTER."""
+    return cache.get(_render_failed_key(uploaded_img, thumbnailHeight)) is not None
+
+
+def set_ready_if_complete(uploaded_imgs, thumbnailHeights = None):
+    """Sets processing state of the images to ready, except images with thumbnails still missing.
+
+    Args:
+        uploaded_imgs (QuerySet): The uploaded images.
+        thumbnailHeights (iterable(ThumbnailHeight)): Heights to check, all heights by default.
+    """
+    incomplete = {uploaded_img.pk for uploaded_img, _ in plan_missing_thumbnails(uploaded_imgs, thumbnailHeights)}
+    set_processing_state([pk for pk in uploaded_imgs.values_list('pk', flat = True) if pk not in incomplete], UploadedImage.READY)
+
+
+def _claim_plan(plan, claimed):
+    """Yields planned heights which are not rendered by other worker at the moment.
+    Render locks taken are added to claimed dict {image pk: [lock keys]}.
+    """
+    for uploaded_img, missing_heights in plan:
+        claimed_heights = []
+
+        for thumbnailHeight in missing_heights:
+            lock_key = _render_lock_key(uploaded_img, thumbnailHeight)
+            if cache.add(lock_key, 1, settings.THUMBNAIL_RENDER_LOCK_TIMEOUT):
+                claimed.setdefault(uploaded_img.pk, []).append(lock_key)
+                claimed_heights.append(thumbnailHeight)
+
+        if claimed_heights:
+            yield uploaded_img, claimed_heights
+
+
+def _store_thumbnail(uploaded_img, thumbnailHeight, encoded_img):
+    file_stem = f'{Path(uploaded_img.uploadedImage.name).stem}_thumbnail_{str(thumbnailHeight.available_height)}'
+    thumb = Thumbnail(
+        parentImage = uploaded_img,
+        height = thumbnailHeight,
+        user_id = uploaded_img.user_id,
+        imgWidth = encoded_img.width,
+        imgHeight = encoded_img.height,
+        imgFormat = encoded_img.format
+    )
+    thumb.fileSize, thumb.contentHash = save_encoded(thumb.thumbnail, f'{file_stem}.{OUTPUT_EXTENSIONS[encoded_img.format]}', encoded_img)
+    variants = []
+
+    for encoded_variant in encoded_img.variants:
+        variant = ThumbnailVariant(thumbnail = thumb, imgFormat = encoded_variant.format)
+        variant.fileSize, variant.contentHash = save_encoded(variant.file, f'{file_stem}.{OUTPUT_EXTENSIONS[encoded_variant.format]}', encoded_variant)
+        variants.append(variant)
+
+    try:
+        # Thumbnail and its variants are committed together, so cached lists
+        # are invalidated (signals.py) once both exist
+        with transaction.atomic():
+            thumb.save()
+            for variant in variants:
+                variant.save()
+    except IntegrityError:
+        # Stored meanwhile by other worker (unique parentImage, height), rendered files are dropped
+        thumb.thumbnail.delete(save = False)
+        for variant in variants:
+            variant.file.delete(save = False)
+
+
+def render_thumbnail_on_demand(uploaded_img, thumbnailHeight, wait_timeout = None):
+    """Returns thumbnail of the image in given height, rendering it if it does not exist yet.
+    The thumbnail is rendered by render_thumbnail_task in the interactive queue, the caller
+    only waits for it, so a web worker is not tied up by decoding and encoding. With
+    THUMBNAIL_RENDER_IN_REQUEST it is rendered in the calling process instead. Rendering is
+    coalesced, so concurrent requests of the same thumbnail render it once, while the others
+    wait until the thumbnail is stored. Failed render is not repeated until
+    THUMBNAIL_RENDER_RETRY_AFTER passes.
+
+    Args:
+        uploaded_img (UploadedImage): The uploaded image.
+        thumbnailHeight (ThumbnailHeight): The requested height.
+        wait_timeout (float): Max seconds to wait for the render, THUMBNAIL_RENDER_WAIT_TIMEOUT by default.
+
+    Returns:
+        Returns Thumbnail or None if rendering failed or did not finish in time.
+    """
+    thumbs = Thumbnail.objects.filter(parentImage = uploaded_img, height = thumbnailHeight)
+    thumb = thumbs.first()
+
+    if thumb is not None or render_failed(uploaded_img, thumbnailHeight):
+        return thumb
+
+    lock_key = _render_lock_key(uploaded_img, thumbnailHeight)
+    queued_key = _render_queued_key(uploaded_img.pk, thumbnailHeight.pk)
+
+    if cache.get(lock_key) is None:
+        if settings.THUMBNAIL_RENDER_IN_REQUEST:
+            # Planner checks again, thumbnail could be stored meanwhile, the render lock is taken
+            # by create_thumbnails, the pair is skipped if other renderer was faster
+            create_thumbnails(plan_missing_thumbnails(UploadedImage.objects.filter(pk = uploaded_img.pk), [thumbnailHeight]), use_process_pool = False)
+        elif cache.add(queued_key, 1, settings.THUMBNAIL_RENDER_LOCK_TIMEOUT):
+            # Queued key is held until the task finishes, the same thumbnail is not enqueued twice
+            try:
+                render_thumbnail_task.delay(uploaded_img.pk, thumbnailHeight.pk)
+            except Exception:
+                cache.delete(queued_key)
+                raise
+        thumb = thumbs.first()
+        if thumb is not None or render_failed(uploaded_img, thumbnailHeight):
+            return thumb
+
+    deadline = time.monotonic() + (settings.THUMBNAIL_RENDER_WAIT_TIMEOUT if wait_timeout is None else wait_timeout)
+    interval = 0.05
+
+    # Only the keys are polled (cache), db is read once the render finished or time is up
+    while cache.get_many([lock_key, queued_key]) and time.monotonic() < deadline:
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        interval = min(2*interval, 0.5)
+    return thumbs.first()
+
+
+def touch_thumbnail(thumb):
+    """Marks thumbnail as accessed now, for LRU eviction. Stored time is updated
+    at most once per THUMBNAIL_ACCESS_RESOLUTION, so hot thumbnails do not write on every view.
+    """
+    now = timezone.now()
+
+    if thumb.lastAccessed is None or thumb.lastAccessed < now - datetime.timedelta(seconds = settings.THUMBNAIL_ACCESS_RESOLUTION):
+        Thumbnail.objects.filter(pk = thumb.pk).update(lastAccessed = now)
+        thumb.lastAccessed = now
+
+
+def reuse_duplicate_thumbnails(uploaded_img):
+    """Creates thumbnail objects of uploaded image pointing to already stored thumbnails
+    of identical (same content hash) image of the same user, therefore these are not processed again.
+
+    Args:
+        uploaded_img (UploadedImage): The uploaded image.
+    """
+    if not uploaded_img.contentHash:
+        return
+
+    existing_heights = Thumbnail.objects.filter(parentImage = uploaded_img).values('height')
+    duplicate_thumbs = Thumbnail.objects.filter(
+        parentImage__contentHash = uploaded_img.contentHash, parentImage__user_id = uploaded_img.user_id
+    ).exclude(parentImage = uploaded_img).exclude(height__in = existing_heights).order_by('height', 'pk')
+    reused_thumbs = {}
+
+    for duplicate_thumb in duplicate_thumbs:
+        reused_thumbs.setdefault(duplicate_thumb.height_id, duplicate_thumb)
+
+    for height_id, duplicate_thumb in reused_thumbs.items():
+        try:
+            with transaction.atomic():
+                # Source thumbnail stays locked until its files are referenced, so these are not released meanwhile (signals.py)
+                if not Thumbnail.objects.select_for_update().filter(pk = duplicate_thumb.pk).exists():
+                    continue
+                thumb = Thumbnail.objects.create(
+                    parentImage = uploaded_img,
+                    thumbnail = duplicate_thumb.thumbnail.name,
+                    height_id = height_id,
+                    user_id = uploaded_img.user_id,
+                    imgWidth = duplicate_thumb.imgWidth,
+                    imgHeight = duplicate_thumb.imgHeight,
+                    imgFormat = duplicate_thumb.imgFormat,
+                    fileSize = duplicate_thumb.fileSize,
+                    contentHash = duplicate_thumb.contentHash
+                )
+                ThumbnailVariant.objects.bulk_create([
+                    ThumbnailVariant(
+                        thumbnail = thumb,
+                        file = variant.file.name,
+                        imgFormat = variant.imgFormat,
+                        fileSize = variant.fileSize,
+                        contentHash = variant.contentHash
+                    )
+                    for variant in duplicate_thumb.variants.all()
+                ])
+        except IntegrityError:
+            # Created meanwhile by other worker
+            continue
+
+
 @shared_task
-def process_uploaded_img_task(object_id):
-    """Asynchronous task to create thumbnail objects of single uploaded image
+def process_uploaded_imgs_task(object_ids):
+    """Asynchronous task to create thumbnail objects of uploaded images
     to all available defined heights.
-    This task is fired once image is uploaded, therefore after user account tier
-    update the thumbnail is already available.
+    This task is fired once images are uploaded and their transaction is committed,
+    images created in one transaction are sent in one message (enqueue_on_commit),
+    therefore after user account tier update the thumbnail is already available.
 
     Args:
-        object_id (int): The uploaded image pk.
+        object_ids (list(int)): The uploaded images pks.
 
     Returns:
         Returns True after task completion.
     """
     try:
-        img_uploaded = UploadedImage.objects.get(pk=object_id)
+        imgs_uploaded = UploadedImage.objects.filter(pk__in = object_ids)
 
-        if not img_uploaded:
-            raise Exception("The image to process does not exist.")
+        if not imgs_uploaded.exists():
+            raise Exception("The images to process do not exist.")
 
-        owner = img_uploaded.user
+        set_processing_state(object_ids, UploadedImage.PROCESSING)
         thumbnailHeights = ThumbnailHeight.objects.all()
-        img_uploaded_path = img_uploaded.uploadedImage
-        selected_img = SimpleImageProcessing(img_uploaded_path)
 
         if not len(thumbnailHeights)>0:
             raise Exception("Account tiers and its hieghts are defined incorrectly!")
 
-        image_io = io.BytesIO()
-
-        for thumbnailHeight in thumbnailHeights:
-            new_height = thumbnailHeight.available_height
-
-            if Thumbnail.objects.filter(parentImage = img_uploaded, height__available_height=new_height):
-                # If object with certain height already exists, iterate to next height
-                continue
-
-            # Process image to desired height keeping image's aspect ratio
-            output_img = selected_img.new_thumbnail_keep_aspect(new_height)
-            output_img.save(image_io, format='JPEG')
-            content_img = ContentFile(image_io.getvalue())
-            thumb = Thumbnail(
-                parentImage = img_uploaded,
-                height = thumbnailHeight,
-                user = owner
-            )
-            thumb.thumbnail.save(f'{Path(img_uploaded.uploadedImage.name).stem}_thumbnail_{str(new_height)}.jpg', content_img)
-            thumb.save()
+        for uploaded_img in imgs_uploaded:
+            reuse_duplicate_thumbnails(uploaded_img)
+
+        create_thumbnails(plan_missing_thumbnails(imgs_uploaded, thumbnailHeights))
+
+        # Nothing was rendered, all thumbnails were reused. Images with thumbnails still
+        # missing are rendered by other worker (render lock), which sets their state
+        set_ready_if_complete(imgs_uploaded.filter(processingState = UploadedImage.PROCESSING), thumbnailHeights)
         return True
 
     except Exception as e:
         logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
+        set_processing_state(UploadedImage.objects.filter(pk__in = object_ids, processingState__in = IN_PROGRESS_STATES).values_list('pk', flat = True), UploadedImage.FAILED)
 
 
 @shared_task
+def process_uploaded_img_task(object_id):
+    """Asynchronous task to create thumbnail objects of single uploaded image,
+    kept for messages enqueued before images were sent in batches.
+
+    Args:
+        object_id (int): The uploaded image pk.
+
+    Returns:
+        Returns True after task completion.
+    """
+    return process_uploaded_imgs_task([object_id])
+
+
+# Batches of object pks waiting for commit {(task name, db alias): OnCommitBatch}
+_on_commit_batches = threading.local()
+OnCommitBatch = namedtuple('OnCommitBatch', ['hooks', 'object_ids'])
+
+
+def enqueue_on_commit(task, object_id, using = None):
+    """Enqueues task with list of object pks once the current transaction is committed,
+    so worker never reads uncommitted (or rolled back) object. Pks of objects created
+    in one transaction are sent in messages of THUMBNAIL_UPLOAD_BATCH_SIZE pks.
+    Outside of transaction the task is enqueued at once.
+
+    Args:
+        task: The celery task taking list of object pks as the only argument.
+        object_id (int): The object pk.
+        using (str): The database alias.
+    """
+    connection = transaction.get_connection(using)
+
+    if not connection.in_atomic_block:
+        task.delay([object_id])
+        return
+
+    batches = _on_commit_batches.__dict__.setdefault('batches', {})
+    key = (task.name, connection.alias)
+    batch = batches.get(key)
+
+    # Commit hooks list is replaced once transaction is committed or rolled back,
+    # batch of the finished transaction is not reused
+    if batch is None or batch.hooks is not connection.run_on_commit:
+        batch = batches[key] = OnCommitBatch(connection.run_on_commit, [])
+        transaction.on_commit(lambda: _dispatch_batch(task, key, batch), using = using)
+    batch.object_ids.append(object_id)
+
+
+def _dispatch_batch(task, key, batch):
+    batches = _on_commit_batches.__dict__.setdefault('batches', {})
+    if batches.get(key) is batch:
+        del batches[key]
+
+    batch_size = settings.THUMBNAIL_UPLOAD_BATCH_SIZE
+    for i in range(0, len(batch.object_ids), batch_size):
+        task.delay(batch.object_ids[i:i + batch_size])
+
+
+def _inflight_key(task, object_id):
+    return f'imgs:inflight:{task.name}:{object_id}'
+
+
+def enqueue_once(task, object_id):
+    """Enqueues task of the object unless the same task is already waiting in the queue,
+    so repeated requests (e.g. client polling) collapse into a single run. The in-flight key
+    is released once the task starts, therefore request arriving during the run schedules
+    the next one. Key of a lost task expires after TASK_INFLIGHT_TIMEOUT.
+
+    Args:
+        task: The celery task taking object pk as the only argument.
+        object_id (int): The object pk.
+
+    Returns:
+        Returns True if the task was enqueued.
+    """
+    inflight_key = _inflight_key(task, object_id)
+
+    if not cache.add(inflight_key, 1, settings.TASK_INFLIGHT_TIMEOUT):
+        return False
+
+    try:
+        task.delay(object_id)
+    except Exception:
+        cache.delete(inflight_key)
+        raise
+    return True
+
+
+def _heights_update_key(object_id, name):
+    return f'heights_update:{object_id}:{name}'
+
+
+def heights_update_progress(object_id):
+    """Returns progress of thumbnails backfill of single height.
+
+    Args:
+        object_id (int): The height object pk.
+
+    Returns:
+        Returns dict with number of dispatched and done chunks and last dispatched image pk.
+    """
+    keys = {name: _heights_update_key(object_id, name) for name in ('cursor', 'dispatched', 'done')}
+    values = cache.get_many(keys.values())
+    return {name: values.get(key, 0) for name, key in keys.items()}
+
+
+@shared_task(acks_late = True)
 def heights_update_task(object_id):
-    """Asynchronous task to create new height thumbnail objects of all uploaded images.
+    """Asynchronous coordinator task to create new height thumbnail objects of all uploaded images.
     This task is fired once ThumbnailHeight model is created.
-    available_height of ThumbnailHeight is not editable (in admin panel, in db its still possible), 
+    available_height of ThumbnailHeight is not editable (in admin panel, in db its still possible),
     therefore there's no need to check for a field update.
 
+    Images are split into keyset paginated chunks (pk ranges) which are dispatched
+    as groups of heights_update_chunk_task. The last dispatched pk is stored in cache,
+    therefore after a crash the task resumes from the last dispatched chunk.
+
     Args:
         object_id (int): The new height object pk.
 
@@ -79,87 +424,294 @@ def heights_update_task(object_id):
     """
     try:
         thumbnailHeight = ThumbnailHeight.objects.get(pk=object_id)
-        all_uploaded_imgs = UploadedImage.objects.all()
-        new_height = thumbnailHeight.available_height
-        image_io = io.BytesIO()
+        chunk_size = settings.THUMBNAIL_BACKFILL_CHUNK_SIZE
+        group_size = settings.THUMBNAIL_BACKFILL_GROUP_SIZE
+        cursor_key = _heights_update_key(object_id, 'cursor')
+        dispatched_key = _heights_update_key(object_id, 'dispatched')
+        last_pk = cache.get(cursor_key)
+
+        if last_pk is None:
+            # Fresh run, otherwise resume after last dispatched chunk
+            last_pk = 0
+            cache.set_many({cursor_key: 0, dispatched_key: 0, _heights_update_key(object_id, 'done'): 0}, timeout = None)
+
+        all_uploaded_imgs = UploadedImage.objects.filter(pk__gt = last_pk).order_by('pk').values_list('pk', flat = True)
 
-        if not all_uploaded_imgs:
+        if not all_uploaded_imgs.exists() and not last_pk:
             raise Exception("No uploaded images found.")
-        
-        for uploaded_img in all_uploaded_imgs:
-            owner = uploaded_img.user
-            img_uploaded_path = uploaded_img.uploadedImage
-
-            if not img_uploaded_path:
-                # Double check
-                raise Exception("The image to process does not exist.")
-
-            if Thumbnail.objects.filter(parentImage = uploaded_img, height__available_height=new_height):
-                # If object with certain height already exists, iterate to next height
-                continue
-
-            selected_img = SimpleImageProcessing(img_uploaded_path)
-
-            # Process image to desired height keeping image's aspect ratio
-            output_img = selected_img.new_thumbnail_keep_aspect(new_height)
-            output_img.save(image_io, format='JPEG')
-            content_img = ContentFile(image_io.getvalue())
-            thumb = Thumbnail(
-                parentImage = uploaded_img,
-                height = thumbnailHeight,
-                user = owner
-            )
-            thumb.thumbnail.save(f'{Path(uploaded_img.uploadedImage.name).stem}_thumbnail_{str(new_height)}.jpg', content_img)
-            thumb.save()
+
+        chunks = []
+        chunk_first_pk = None
+        chunk_len = 0
+
+        for pk in all_uploaded_imgs.iterator(chunk_size = chunk_size):
+            if chunk_first_pk is None:
+                chunk_first_pk = pk
+            chunk_len += 1
+
+            if chunk_len == chunk_size:
+                chunks.append((chunk_first_pk, pk))
+                chunk_first_pk, chunk_len = None, 0
+
+                if len(chunks) == group_size:
+                    _dispatch_heights_update_chunks(thumbnailHeight.pk, chunks)
+                    chunks = []
+
+        if chunk_first_pk is not None:
+            chunks.append((chunk_first_pk, pk))
+
+        if chunks:
+            _dispatch_heights_update_chunks(thumbnailHeight.pk, chunks)
+
+        # All chunks are dispatched, next run of the task starts from the beginning
+        cache.delete(cursor_key)
+        return True
+
+    except Exception as e:
+        logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
+
+
+def _dispatch_heights_update_chunks(object_id, chunks):
+    group([heights_update_chunk_task.s(object_id, first_pk, last_pk) for first_pk, last_pk in chunks]).apply_async()
+    cache.set(_heights_update_key(object_id, 'cursor'), chunks[-1][1], timeout = None)
+    cache.incr(_heights_update_key(object_id, 'dispatched'), len(chunks))
+
+
+@shared_task(acks_late = True)
+def heights_update_chunk_task(object_id, first_pk, last_pk):
+    """Asynchronous task to create new height thumbnail objects of uploaded images
+    with pk in range from first_pk to last_pk (inclusive). Dispatched by heights_update_task.
+
+    Args:
+        object_id (int): The new height object pk.
+        first_pk (int): The first uploaded image pk of the chunk.
+        last_pk (int): The last uploaded image pk of the chunk.
+
+    Returns:
+        Returns True after task completion.
+    """
+    try:
+        thumbnailHeight = ThumbnailHeight.objects.get(pk=object_id)
+        chunk_uploaded_imgs = UploadedImage.objects.filter(pk__gte = first_pk, pk__lte = last_pk)
+
+        create_thumbnails(plan_missing_thumbnails(chunk_uploaded_imgs, [thumbnailHeight]))
+
+        try:
+            cache.incr(_heights_update_key(object_id, 'done'))
+        except ValueError:
+            # Progress keys were removed in the meantime
+            pass
         return True
 
     except Exception as e:
         logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
 
 
+@shared_task
+def render_thumbnail_task(object_id, height_id):
+    """Asynchronous task to create single thumbnail requested by client,
+    see render_thumbnail_on_demand. Should be enqueued by it, so duplicate
+    requests are waiting for single run.
+
+    Args:
+        object_id (int): The uploaded image pk.
+        height_id (int): The thumbnail height pk.
+
+    Returns:
+        Returns True after task completion.
+    """
+    try:
+        thumbnailHeight = ThumbnailHeight.objects.get(pk = height_id)
+        create_thumbnails(plan_missing_thumbnails(UploadedImage.objects.filter(pk = object_id), [thumbnailHeight]))
+        return True
+
+    except Exception as e:
+        logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
+    finally:
+        cache.delete(_render_queued_key(object_id, height_id))
+
+
 @shared_task
 def check_user_thumbs_task(object_id):
+    """Asynchronous task to create all missing thumbnail objects of user's images.
+    Missing (image, height) pairs are worked out by the planner at once.
+    Should be enqueued by enqueue_once, so duplicate requests run it once.
+
+    Args:
+        object_id (int): The user pk.
+
+    Returns:
+        Returns True after task completion.
+    """
     try:
+        cache.delete(_inflight_key(check_user_thumbs_task, object_id))
         user = User.objects.get(pk=object_id)
         user_uploaded_imgs = UploadedImage.objects.filter(user = user)
         thumbnailHeights = ThumbnailHeight.objects.all()
 
-        if not user_uploaded_imgs:
+        if not user_uploaded_imgs.exists():
             raise Exception("No uploaded images found.")
 
         if not len(thumbnailHeights)>0:
             raise Exception("Account tiers and its hieghts are defined incorrectly!")
 
-        image_io = io.BytesIO()
+        create_thumbnails(plan_missing_thumbnails(user_uploaded_imgs, thumbnailHeights))
+
+        # Image stuck in progress (lost task, crashed worker) is ready once all its thumbnails exist
+        stale_imgs = user_uploaded_imgs.filter(processingState__in = IN_PROGRESS_STATES).exclude(pk__in = processing_in_progress(user_uploaded_imgs).values('pk'))
+        set_ready_if_complete(stale_imgs, thumbnailHeights)
+        return True
 
-        for uploaded_img in user_uploaded_imgs:
-            img_uploaded_path = uploaded_img.uploadedImage
+    except Exception as e:
+        logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
 
-            if not img_uploaded_path:
-                # Double check
-                raise Exception("The image to process does not exist.")
 
-            for thumbnailHeight in thumbnailHeights:
-                new_height = thumbnailHeight.available_height
+def delete_expired_links(batch_size = 1000):
+    """Deletes expired links in bounded batches, every batch is an index range
+    scan on expiresAt followed by delete by pk, so locks are held shortly.
 
-                if Thumbnail.objects.filter(parentImage = uploaded_img, height__available_height=new_height):
-                    # If object with certain height already exists, iterate to next height
-                    continue
+    Args:
+        batch_size (int): Number of links deleted in single query.
 
-                selected_img = SimpleImageProcessing(img_uploaded_path)
+    Returns:
+        Returns number of deleted links.
+    """
+    now = timezone.now()
+    deleted = 0
 
-                # Process image to desired height keeping image's aspect ratio
-                output_img = selected_img.new_thumbnail_keep_aspect(new_height)
-                output_img.save(image_io, format='JPEG')
-                content_img = ContentFile(image_io.getvalue())
-                thumb = Thumbnail(
-                    parentImage = uploaded_img,
-                    height = thumbnailHeight,
-                    user = user
-                )
-                thumb.thumbnail.save(f'{Path(uploaded_img.uploadedImage.name).stem}_thumbnail_{str(new_height)}.jpg', content_img)
-                thumb.save()
-        return True
+    while True:
+        expired_pks = list(ExpiringLink.objects.filter(expiresAt__lte = now).order_by('expiresAt').values_list('pk', flat = True)[:batch_size])
+
+        if not expired_pks:
+            return deleted
+
+        deleted += ExpiringLink.objects.filter(pk__in = expired_pks).delete()[0]
+
+
+@shared_task
+def purge_expired_links_task():
+    """Periodic (celery beat) task to delete expired links nobody requested.
+
+    Returns:
+        Returns number of deleted links.
+    """
+    try:
+        return delete_expired_links(settings.EXPIRING_LINKS_PURGE_BATCH_SIZE)
+
+    except Exception as e:
+        logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
+
+
+def delete_expired_upload_sessions(batch_size = 100):
+    """Deletes abandoned (expired) upload sessions with all their stored parts, in bounded batches.
+
+    Args:
+        batch_size (int): Number of sessions deleted at once.
+
+    Returns:
+        Returns number of deleted sessions.
+    """
+    now = timezone.now()
+    deleted = 0
+
+    while True:
+        expired_sessions = list(UploadSession.objects.filter(expiresAt__lte = now).order_by('expiresAt')[:batch_size])
+
+        if not expired_sessions:
+            return deleted
+
+        for session in expired_sessions:
+            delete_session_parts(session)
+        deleted += UploadSession.objects.filter(pk__in = [session.pk for session in expired_sessions]).delete()[0]
+
+
+@shared_task
+def purge_upload_sessions_task():
+    """Periodic (celery beat) task to delete upload sessions nobody finished.
+
+    Returns:
+        Returns number of deleted sessions.
+    """
+    try:
+        return delete_expired_upload_sessions(settings.UPLOAD_SESSIONS_PURGE_BATCH_SIZE)
+
+    except Exception as e:
+        logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
+
+
+def _count_new_references(refs, model, field, names):
+    # Adds number of objects referencing each file not seen yet
+    names = [name for name in names if name not in refs]
+    if names:
+        refs.update(model.objects.filter(**{f'{field}__in': names}).values_list(field).annotate(count = Count('pk')))
+
+
+def evict_thumbnails(max_bytes, batch_size = 500):
+    """Deletes least recently used thumbnails until their total size fits max_bytes.
+    Never accessed thumbnails go first, thumbnails with expiring links are kept.
+    Evicted thumbnail is rendered again on its next request (lazy mode).
+
+    Args:
+        max_bytes (int): Storage budget of thumbnails in bytes.
+        batch_size (int): Number of thumbnails deleted in single query.
+
+    Returns:
+        Returns number of evicted thumbnails.
+    """
+    # Deduplicated files are shared by several objects, therefore every file is counted once
+    total_bytes = (
+        (Thumbnail.objects.values('thumbnail').annotate(size = Max('fileSize')).aggregate(total = Sum('size'))['total'] or 0)
+        + (ThumbnailVariant.objects.values('file').annotate(size = Max('fileSize')).aggregate(total = Sum('size'))['total'] or 0)
+    )
+    candidates = Thumbnail.objects.filter(expiringlink__isnull = True).order_by(F('lastAccessed').asc(nulls_first = True), 'pk')
+    # Remaining references of seen files, file is freed once its last reference is evicted
+    thumbnail_refs, variant_refs = {}, {}
+    evicted = 0
+
+    while total_bytes > max_bytes:
+        batch = []
+        rows = list(candidates.values_list('pk', 'thumbnail', 'fileSize')[:batch_size])
+        variants = {}
+
+        for thumbnail_id, name, file_size in ThumbnailVariant.objects.filter(thumbnail__in = [pk for pk, _, _ in rows]).values_list('thumbnail', 'file', 'fileSize'):
+            variants.setdefault(thumbnail_id, []).append((name, file_size))
+
+        _count_new_references(thumbnail_refs, Thumbnail, 'thumbnail', {name for _, name, _ in rows})
+        _count_new_references(variant_refs, ThumbnailVariant, 'file', {name for files in variants.values() for name, _ in files})
+
+        for pk, name, file_size in rows:
+            if total_bytes <= max_bytes:
+                break
+            batch.append(pk)
+
+            files = [(thumbnail_refs, name, file_size)] + [(variant_refs, variant_name, variant_size) for variant_name, variant_size in variants.get(pk, [])]
+            for refs, file_name, size in files:
+                refs[file_name] -= 1
+                if refs[file_name] == 0:
+                    total_bytes -= size or 0
+
+        if not batch:
+            break
+
+        # Files are released by post_delete signal (signals.py)
+        Thumbnail.objects.filter(pk__in = batch).delete()
+        evicted += len(batch)
+
+    return evicted
+
+
+@shared_task
+def evict_thumbnails_task():
+    """Periodic (celery beat) task keeping stored thumbnails within THUMBNAIL_STORAGE_MAX_BYTES
+    in lazy render mode.
+
+    Returns:
+        Returns number of evicted thumbnails.
+    """
+    try:
+        if settings.THUMBNAIL_RENDER_MODE != 'lazy' or not settings.THUMBNAIL_STORAGE_MAX_BYTES:
+            return 0
+        return evict_thumbnails(settings.THUMBNAIL_STORAGE_MAX_BYTES, settings.THUMBNAIL_EVICTION_BATCH_SIZE)
 
     except Exception as e:
         logger.exception(f"Exception occured during Celery task. Error: {str(e)}")
@@ -1,14 +1,47 @@
+import io
+import json
+import uuid
+import time
+import datetime
+import hashlib
+from pathlib import Path
 from django.test import TestCase
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from .models import UploadedImage, Thumbnail, ExpiringLink
 from auth_app.models import ThumbnailHeight, UserTier
-from .validators import validate_img_extension, validate_img_size
+from auth_app.tiers import get_tier_snapshot
+from .validators import validate_img_extension, validate_img_size, validate_img_header
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from imgs_app.models import UploadedImage, Thumbnail, ExpiringLink
+from imgs_app.models import UploadedImage, Thumbnail, ThumbnailVariant, ExpiringLink, UploadSession
 from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+import billiard
+from imgs_app import executors
+from imgs_app.executors import render_planned_thumbnails
+from imgs_app.img_processing import SimpleImageProcessing, render_thumbnails, encode_image
+from imgs_app.media import accepted_image_formats
+from PIL import Image as PILImage
+from imgs_app.planner import plan_missing_thumbnails
+from imgs_app.tasks import heights_update_task, heights_update_progress, reuse_duplicate_thumbnails, delete_expired_links
+from imgs_app.tasks import render_thumbnail_on_demand, touch_thumbnail, evict_thumbnails, evict_thumbnails_task, create_thumbnails, render_thumbnail_task
+from imgs_app.tasks import check_user_thumbs_task, enqueue_once, process_uploaded_imgs_task, purge_upload_sessions_task
+from imgs_app.status import set_processing_state
+from imgs_app.uploads import delete_session_parts, store_chunk
+from django.utils import timezone
+from imgs_app.serializers import ImageSerializer
+from django.core.cache import cache
+from imgs_app.cache import link_cache_key, link_cache_stats
+from django.test import override_settings
+from django.conf import settings
+from backend.celery import app as celery_app, configure_queue_worker
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
 
 User = get_user_model()
 
@@ -204,3 +237,1331 @@ class ViewsTestCase(TestCase):
         self.client.login(username='testuser', password='testpassword')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ImageProcessingTestCase(TestCase):
+    def setUp(self):
+        self.image_path = './imgs_app/example_imgs/su1_1024x1024.jpg'
+
+    def test_new_thumbnails_keep_aspect_sizes(self):
+        # Test that every requested height is returned keeping the aspect ratio
+        processing = SimpleImageProcessing(self.image_path)
+        thumbnails = processing.new_thumbnails_keep_aspect([200, 400, 25])
+        self.assertEqual(sorted(thumbnails), [25, 200, 400])
+        for height, img in thumbnails.items():
+            self.assertEqual(img.size, (int(1024*height/576), height))
+
+    def test_new_thumbnails_keep_aspect_decodes_once(self):
+        # Test that the original image is loaded only once for all heights
+        processing = SimpleImageProcessing(self.image_path)
+        with mock.patch.object(processing, 'img_loader', wraps=processing.img_loader) as loader:
+            processing.new_thumbnails_keep_aspect([200, 400, 2048])
+        self.assertEqual(loader.call_count, 1)
+
+    def test_img_loader_draft_keeps_quality_guard(self):
+        # Test that JPEG is decoded at reduced scale, not below reducing_gap times the height
+        processing = SimpleImageProcessing(self.image_path, draft=True, reducing_gap=2.0)
+        img = processing.img_loader(draft_height=100)
+        self.assertEqual(processing.size, (1024, 576))
+        self.assertLess(img.size[1], 576)
+        self.assertGreaterEqual(img.size[1], 200)
+
+    def test_new_thumbnails_keep_aspect_draft_sizes(self):
+        # Test that draft mode does not change the size of the thumbnails
+        processing = SimpleImageProcessing(self.image_path, draft=True, reducing_gap=2.0)
+        thumbnails = processing.new_thumbnails_keep_aspect([100, 25])
+        for height, img in thumbnails.items():
+            self.assertEqual(img.size, (int(1024*height/576), height))
+
+
+class PlannerTestCase(TestCase):
+    def setUp(self):
+        self.heights = [ThumbnailHeight.objects.create(available_height=h) for h in (200, 400)]
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.imgs = [UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user) for _ in range(5)]
+
+        # First image has all thumbnails, second one only the smaller one
+        for thumbnail_height in self.heights:
+            Thumbnail.objects.create(parentImage=self.imgs[0], thumbnail="path/to/thumbnail.jpg", height=thumbnail_height, user=self.user)
+        Thumbnail.objects.create(parentImage=self.imgs[1], thumbnail="path/to/thumbnail.jpg", height=self.heights[0], user=self.user)
+
+    def test_plan_missing_thumbnails(self):
+        # Test that only missing (image, height) pairs are planned
+        plan = dict(plan_missing_thumbnails(UploadedImage.objects.filter(user=self.user), self.heights))
+        self.assertNotIn(self.imgs[0], plan)
+        self.assertEqual(plan[self.imgs[1]], [self.heights[1]])
+        for uploaded_img in self.imgs[2:]:
+            self.assertEqual(plan[uploaded_img], self.heights)
+
+    def test_plan_missing_thumbnails_single_query(self):
+        # Test that number of queries does not depend on number of images
+        UploadedImage.objects.bulk_create([UploadedImage(uploadedImage="path/to/image.jpg", user=self.user) for _ in range(20)])
+        with self.assertNumQueries(1):
+            plan = list(plan_missing_thumbnails(UploadedImage.objects.filter(user=self.user), self.heights))
+        self.assertEqual(len(plan), 24)
+
+
+class HeightsUpdateTaskTestCase(TestCase):
+    def setUp(self):
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.imgs = [UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user) for _ in range(5)]
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        cache.clear()
+
+    @override_settings(THUMBNAIL_BACKFILL_CHUNK_SIZE=2, THUMBNAIL_BACKFILL_GROUP_SIZE=2)
+    def test_heights_update_task_dispatches_chunks(self):
+        # Test that images are split into pk ranges and dispatched as chunk subtasks
+        with mock.patch('imgs_app.tasks.heights_update_chunk_task.s') as chunk_signature, \
+                mock.patch('imgs_app.tasks.group') as group:
+            self.assertTrue(heights_update_task(self.thumbnail_height.pk))
+
+        pks = [img.pk for img in self.imgs]
+        chunk_signature.assert_has_calls([
+            mock.call(self.thumbnail_height.pk, pks[0], pks[1]),
+            mock.call(self.thumbnail_height.pk, pks[2], pks[3]),
+            mock.call(self.thumbnail_height.pk, pks[4], pks[4]),
+        ])
+        self.assertEqual(group.call_count, 2)
+        self.assertEqual(heights_update_progress(self.thumbnail_height.pk)['dispatched'], 3)
+
+    @override_settings(THUMBNAIL_BACKFILL_CHUNK_SIZE=2, THUMBNAIL_BACKFILL_GROUP_SIZE=1)
+    def test_heights_update_task_resumes_after_cursor(self):
+        # Test that task resumes from the last dispatched pk after a crash
+        cache.set_many({
+            f'heights_update:{self.thumbnail_height.pk}:cursor': self.imgs[3].pk,
+            f'heights_update:{self.thumbnail_height.pk}:dispatched': 2,
+        }, timeout=None)
+        with mock.patch('imgs_app.tasks.heights_update_chunk_task.s') as chunk_signature, \
+                mock.patch('imgs_app.tasks.group'):
+            heights_update_task(self.thumbnail_height.pk)
+
+        chunk_signature.assert_called_once_with(self.thumbnail_height.pk, self.imgs[4].pk, self.imgs[4].pk)
+        self.assertEqual(heights_update_progress(self.thumbnail_height.pk)['dispatched'], 3)
+
+
+class ExecutorsTestCase(TestCase):
+    def setUp(self):
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.image_bytes = f.read()
+        self.heights = [ThumbnailHeight(pk=1, available_height=200), ThumbnailHeight(pk=2, available_height=100)]
+        self.uploaded_img = UploadedImage(pk=1, uploadedImage="path/to/image.jpg")
+
+    def render(self):
+        with mock.patch('imgs_app.executors.image_source', return_value=self.image_bytes):
+            return list(render_planned_thumbnails([(self.uploaded_img, self.heights)]))
+
+    def test_render_thumbnails_encodes_all_heights(self):
+        # Test that every height is encoded as JPEG
+        encoded = render_thumbnails(self.image_bytes, [200, 100])
+        self.assertEqual(sorted(encoded), [100, 200])
+        for height, encoded_img in encoded.items():
+            self.assertTrue(encoded_img.content.startswith(b'\xff\xd8'))
+            self.assertEqual((encoded_img.width, encoded_img.height, encoded_img.format), (int(1024*height/576), height, 'JPEG'))
+
+    @override_settings(THUMBNAIL_PROCESS_POOL_WORKERS=0)
+    def test_render_planned_thumbnails_inline(self):
+        # Test rendering in the current process
+        [(uploaded_img, heights, encoded)] = self.render()
+        self.assertEqual(uploaded_img, self.uploaded_img)
+        self.assertEqual(sorted(encoded), [100, 200])
+
+    @override_settings(THUMBNAIL_PROCESS_POOL_WORKERS=1)
+    def test_render_planned_thumbnails_process_pool(self):
+        # Test rendering in the process pool gives the same output
+        with mock.patch('imgs_app.executors._process_pool', None):
+            [(uploaded_img, heights, encoded)] = self.render()
+            executors.get_process_pool().shutdown()
+        self.assertEqual(encoded, render_thumbnails(self.image_bytes, [200, 100], output_formats=executors._output_formats(self.heights)))
+
+    @override_settings(THUMBNAIL_PROCESS_POOL_WORKERS=1)
+    def test_process_pool_in_daemonic_process(self):
+        # Test that celery prefork child (daemonic) renders inline instead of failing every image
+        def child(results):
+            with mock.patch('imgs_app.executors._process_pool', None):
+                pool = executors.get_process_pool()
+                [(uploaded_img, heights, encoded)] = self.render()
+            results.put((pool, sorted(encoded) if encoded else None))
+
+        results = billiard.Queue()
+        process = billiard.Process(target=child, args=(results,), daemon=True)
+        process.start()
+        self.assertEqual(results.get(timeout=60), (None, [100, 200]))
+        process.join()
+
+
+class DeduplicationTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.uploaded_image = UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user, contentHash="a"*64)
+        self.thumbnail = Thumbnail.objects.create(
+            parentImage=self.uploaded_image,
+            thumbnail="path/to/thumbnail.jpg",
+            height=self.thumbnail_height,
+            user=self.user
+        )
+
+    def test_upload_reuses_stored_file(self):
+        # Test that identical upload points to the already stored file
+        serializer = ImageSerializer()
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            content = f.read()
+        first = serializer.create({'uploadedImage': SimpleUploadedFile("image.jpg", content), 'user': self.user})
+        with mock.patch.object(first.uploadedImage.storage, 'save') as storage_save:
+            second = serializer.create({'uploadedImage': SimpleUploadedFile("image.jpg", content), 'user': self.user})
+        storage_save.assert_not_called()
+        self.assertEqual(first.contentHash, second.contentHash)
+        self.assertEqual(first.uploadedImage.name, second.uploadedImage.name)
+
+    def test_upload_not_shared_between_users(self):
+        # Test that identical upload of other user is stored again, stored name of the first user is not returned
+        other_user = User.objects.create_user(username="otheruser", password="testpassword", userTier=self.user_tier)
+        serializer = ImageSerializer()
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            content = f.read()
+        first = serializer.create({'uploadedImage': SimpleUploadedFile("private_name.jpg", content), 'user': self.user})
+        second = serializer.create({'uploadedImage': SimpleUploadedFile("image.jpg", content), 'user': other_user})
+        self.assertNotEqual(first.uploadedImage.name, second.uploadedImage.name)
+        self.assertNotIn("private_name", second.uploadedImage.name)
+        for uploaded_image in (first, second):
+            default_storage.delete(uploaded_image.uploadedImage.name)
+
+    def test_thumbnails_not_reused_between_users(self):
+        # Test that thumbnails of identical image of other user are not reused
+        other_user = User.objects.create_user(username="otheruser", password="testpassword", userTier=self.user_tier)
+        duplicate = UploadedImage.objects.create(uploadedImage="path/to/other.jpg", user=other_user, contentHash="a"*64)
+        Thumbnail.objects.filter(parentImage=duplicate).delete()
+        reuse_duplicate_thumbnails(duplicate)
+        self.assertFalse(Thumbnail.objects.filter(parentImage=duplicate).exists())
+
+    def test_reuse_duplicate_thumbnails(self):
+        # Test that thumbnails of identical image are reused instead of processed
+        duplicate = UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user, contentHash="a"*64)
+        Thumbnail.objects.filter(parentImage=duplicate).delete()
+        reuse_duplicate_thumbnails(duplicate)
+        reused = Thumbnail.objects.get(parentImage=duplicate)
+        self.assertEqual(reused.thumbnail.name, self.thumbnail.thumbnail.name)
+        self.assertEqual(reused.height, self.thumbnail_height)
+
+    def test_shared_file_deleted_with_last_reference(self):
+        # Test that shared file is removed from storage only with the last reference
+        duplicate = UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user, contentHash="a"*64)
+        with mock.patch.object(self.uploaded_image.uploadedImage.storage, 'delete') as storage_delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                Thumbnail.objects.filter(parentImage=duplicate).delete()
+                duplicate.delete()
+            storage_delete.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.uploaded_image.delete()
+            storage_delete.assert_has_calls([mock.call("path/to/thumbnail.jpg"), mock.call("path/to/image.jpg")], any_order=True)
+
+    def test_shared_file_kept_when_referenced_before_commit(self):
+        # Test that references are checked on commit, so file reused after the delete is kept
+        with mock.patch.object(self.uploaded_image.uploadedImage.storage, 'delete') as storage_delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.uploaded_image.delete()
+                UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user, contentHash="a"*64)
+            self.assertNotIn(mock.call("path/to/image.jpg"), storage_delete.call_args_list)
+
+
+class UploadSessionTestCase(TestCase):
+    def setUp(self):
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.content = f.read()
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.post(reverse('upload_session_create'), {'fileName': 'image.jpg', 'fileSize': len(self.content)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.session_id = response.data['id']
+
+    def put_chunk(self, start, end):
+        return self.client.put(
+            reverse('upload_session', kwargs={'pk': self.session_id}),
+            data=self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}'
+        )
+
+    def test_chunked_upload(self):
+        # Test that chunks are joined into uploaded image after finalize
+        middle = len(self.content)//2
+        self.assertEqual(self.put_chunk(0, middle - 1).data['receivedBytes'], middle)
+
+        # Interrupted client asks for offset to resume from
+        response = self.client.get(reverse('upload_session', kwargs={'pk': self.session_id}))
+        self.assertEqual(response.data['receivedBytes'], middle)
+
+        self.assertEqual(self.put_chunk(middle, len(self.content) - 1).status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('upload_session_finalize', kwargs={'pk': self.session_id}))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        uploaded_img = UploadedImage.objects.get(user=self.user)
+        with uploaded_img.uploadedImage.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(UploadSession.objects.filter(pk=self.session_id).exists())
+
+    def test_chunk_out_of_order(self):
+        # Test that chunk not starting at received offset is rejected
+        response = self.put_chunk(100, 199)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['receivedBytes'], 0)
+
+    def test_chunk_invalid_magic_bytes(self):
+        # Test that first chunk which is not an image is rejected before finalize
+        self.content = b'GIF89a' + self.content[6:]
+        response = self.put_chunk(0, 99)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('upload_session', kwargs={'pk': self.session_id}))
+        self.assertEqual(response.data['receivedBytes'], 0)
+
+    def test_finalize_incomplete_upload(self):
+        # Test that incomplete upload can not be finalized
+        self.put_chunk(0, 99)
+        response = self.client.post(reverse('upload_session_finalize', kwargs={'pk': self.session_id}))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_concurrent_chunk_of_same_offset(self):
+        # Test that chunk confirmed meanwhile by concurrent request wins and the other part is discarded
+        def store_chunk_concurrently(session, start, stream, length):
+            stored_name = store_chunk(session, start, stream, length)
+            UploadSession.objects.filter(pk=session.pk).update(receivedBytes=length, parts=[[start, 'concurrent.part']])
+            return stored_name
+
+        with mock.patch('imgs_app.views.store_chunk', side_effect=store_chunk_concurrently):
+            response = self.put_chunk(0, 99)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['receivedBytes'], 100)
+        self.assertEqual(UploadSession.objects.get(pk=self.session_id).parts, [[0, 'concurrent.part']])
+        session = UploadSession.objects.get(pk=self.session_id)
+        self.assertEqual(default_storage.listdir(f'upload_sessions/{session.pk}')[1], [])
+
+    def test_concurrent_finalize(self):
+        # Test that session claimed by other finalize request is not finalized again
+        self.put_chunk(0, len(self.content) - 1)
+        UploadSession.objects.filter(pk=self.session_id).update(finalizedAt=timezone.now())
+        response = self.client.post(reverse('upload_session_finalize', kwargs={'pk': self.session_id}))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(UploadedImage.objects.filter(user=self.user).exists())
+        delete_session_parts(UploadSession.objects.get(pk=self.session_id))
+
+    def test_finalize_invalid_upload_releases_claim(self):
+        # Test that session is not left claimed once finalize fails
+        self.put_chunk(0, len(self.content) - 1)
+        with mock.patch('imgs_app.views.validate_img_header', side_effect=ValidationError("Invalid image.")):
+            response = self.client.post(reverse('upload_session_finalize', kwargs={'pk': self.session_id}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(UploadSession.objects.get(pk=self.session_id).finalizedAt)
+        response = self.client.post(reverse('upload_session_finalize', kwargs={'pk': self.session_id}))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        default_storage.delete(UploadedImage.objects.get(user=self.user).uploadedImage.name)
+
+    def test_expired_session_purged(self):
+        # Test that abandoned session is not resumed and is purged with its parts
+        self.put_chunk(0, 99)
+        session = UploadSession.objects.get(pk=self.session_id)
+        [[offset, stored_name]] = session.parts
+        UploadSession.objects.filter(pk=self.session_id).update(expiresAt=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.put_chunk(100, 199).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(purge_upload_sessions_task(), 1)
+        self.assertFalse(UploadSession.objects.filter(pk=self.session_id).exists())
+        self.assertFalse(default_storage.exists(stored_name))
+
+
+class HeaderValidationTestCase(TestCase):
+    def setUp(self):
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.content = f.read()
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+
+    def upload(self, name, content):
+        return self.client.post(reverse('images_upload'), {'uploadedImage': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def test_upload_stores_header_info(self):
+        # Test that width, height and format are stored on upload
+        response = self.upload("image.jpg", self.content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        uploaded_img = UploadedImage.objects.get(user=self.user)
+        self.assertEqual((uploaded_img.imgWidth, uploaded_img.imgHeight, uploaded_img.imgFormat), (1024, 576, 'JPEG'))
+
+    def test_validate_img_header_rejects_malformed_file(self):
+        # Test that file with image extension but other content is rejected
+        with self.assertRaises(ValidationError):
+            validate_img_header(SimpleUploadedFile("image.png", b'\x89PNG\r\n\x1a\n' + b'0'*100))
+
+    def test_validate_img_header_rejects_too_many_pixels(self):
+        # Test that pixel count limit is checked without decoding the image
+        with mock.patch('imgs_app.validators.MAX_IMG_PIXELS', 1024*575), \
+                mock.patch('PIL.ImageFile.ImageFile.load') as load:
+            with self.assertRaises(ValidationError):
+                validate_img_header(SimpleUploadedFile("image.jpg", self.content))
+        load.assert_not_called()
+
+
+class BackfillMetadataTestCase(TestCase):
+    def setUp(self):
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.content = f.read()
+        self.uploaded_image = UploadedImage(user=self.user)
+        self.uploaded_image.uploadedImage.save("image.jpg", ContentFile(self.content))
+
+    def test_backfill_img_metadata(self):
+        # Test that metadata of stored images is backfilled
+        call_command('backfill_img_metadata', stdout=io.StringIO())
+        self.uploaded_image.refresh_from_db()
+        self.assertEqual(
+            (self.uploaded_image.imgWidth, self.uploaded_image.imgHeight, self.uploaded_image.imgFormat, self.uploaded_image.fileSize),
+            (1024, 576, 'JPEG', len(self.content))
+        )
+        self.assertEqual(self.uploaded_image.contentHash, hashlib.sha256(self.content).hexdigest())
+
+
+class ListCacheTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+
+    def create_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user)
+
+    def test_empty_response_not_cached(self):
+        # Test that 204 response is not cached, so new upload is visible at once
+        self.assertEqual(self.client.get(reverse('images_view')).status_code, status.HTTP_204_NO_CONTENT)
+        self.create_image()
+        self.assertEqual(self.client.get(reverse('images_view')).status_code, status.HTTP_200_OK)
+
+    def test_cached_list_invalidated_on_change(self):
+        # Test that list is served from cache and invalidated after upload and delete
+        self.create_image()
+        self.assertEqual(len(self.client.get(reverse('images_view')).data['original_imgs']), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.client.get(reverse('images_view')).data['original_imgs']), 1)
+        self.assertFalse([q for q in queries.captured_queries if 'imgs_app_uploadedimage' in q['sql']])
+        self.create_image()
+        self.assertEqual(len(self.client.get(reverse('images_view')).data['original_imgs']), 2)
+
+    def test_thumbnails_list_invalidated_on_new_thumbnail(self):
+        # Test that new thumbnail is visible at once
+        uploaded_image = self.create_image()
+        url = reverse('thumbnails_view', kwargs={'height': 200})
+        with self.captureOnCommitCallbacks(execute=True):
+            Thumbnail.objects.create(parentImage=uploaded_image, thumbnail="path/to/thumbnail.jpg", height=self.thumbnail_height, user=self.user)
+        self.assertEqual(len(self.client.get(url).data['thumbnails']), 1)
+        second_image = self.create_image()
+        with self.captureOnCommitCallbacks(execute=True):
+            Thumbnail.objects.create(parentImage=second_image, thumbnail="path/to/thumbnail2.jpg", height=self.thumbnail_height, user=self.user)
+        self.assertEqual(len(self.client.get(url).data['thumbnails']), 2)
+
+    def test_thumbnails_list_invalidated_on_new_variant(self):
+        # Test that variant stored after its thumbnail is visible at once
+        uploaded_image = self.create_image()
+        url = reverse('thumbnails_view', kwargs={'height': 200})
+        with self.captureOnCommitCallbacks(execute=True):
+            thumb = Thumbnail.objects.create(parentImage=uploaded_image, thumbnail="path/to/thumbnail.jpg", height=self.thumbnail_height, user=self.user)
+        self.assertEqual(self.client.get(url).data['thumbnails'][0]['variants'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            ThumbnailVariant.objects.create(thumbnail_id=thumb.pk, file="path/to/thumbnail.webp", imgFormat='WEBP')
+        self.assertEqual(len(self.client.get(url).data['thumbnails'][0]['variants']), 1)
+
+
+class ListPaginationTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.imgs = [UploadedImage.objects.create(uploadedImage=f"path/to/image_{i}.jpg", user=self.user, imgWidth=100) for i in range(5)]
+        for uploaded_image in self.imgs:
+            Thumbnail.objects.create(parentImage=uploaded_image, thumbnail="path/to/thumbnail.jpg", height=self.thumbnail_height, user=self.user)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+
+    def test_images_pages(self):
+        # Test that all images are listed once following next links
+        url = reverse('images_view') + '?page_size=2'
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['original_imgs']), 2)
+            names += [img['uploadedImage'] for img in response.data['original_imgs']]
+            url = response.data['next']
+        self.assertEqual(names, [img.uploadedImage.url for img in self.imgs])
+
+    def test_keyset_page_query(self):
+        # Test that next page is fetched by pk range, not by offset
+        response = self.client.get(reverse('images_view') + '?page_size=2')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+        page_query = [q['sql'] for q in queries.captured_queries if 'imgs_app_uploadedimage' in q['sql']][0]
+        self.assertIn(f'"imgs_app_uploadedimage"."id" > {self.imgs[1].pk}', page_query)
+        self.assertNotIn('OFFSET', page_query)
+
+    def test_fields_projection(self):
+        # Test that only requested fields are serialized and fetched
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('images_view') + '?fields=imgWidth')
+        self.assertEqual(response.data['original_imgs'][0], {'imgWidth': 100})
+        page_query = [q['sql'] for q in queries.captured_queries if 'imgs_app_uploadedimage' in q['sql']][0]
+        self.assertNotIn('contentHash', page_query)
+        response = self.client.get(reverse('thumbnails_view', kwargs={'height': 200}) + '?fields=thumbnail')
+        self.assertEqual(set(response.data['thumbnails'][0]), {'thumbnail'})
+
+    def test_unknown_field(self):
+        # Test that unknown field is rejected
+        response = self.client.get(reverse('images_view') + '?fields=user')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_thumbnails_pages(self):
+        # Test thumbnails list pagination
+        response = self.client.get(reverse('thumbnails_view', kwargs={'height': 200}) + '?page_size=3')
+        self.assertEqual(len(response.data['thumbnails']), 3)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['thumbnails']), 2)
+        self.assertIsNone(response.data['next'])
+
+
+class GalleryTestCase(TestCase):
+    def setUp(self):
+        self.heights = [ThumbnailHeight.objects.create(available_height=h) for h in (200, 400, 600)]
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True)
+        self.user_tier.thumbnailHeight.set(self.heights[:2])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.imgs = [UploadedImage.objects.create(uploadedImage=f"path/to/image_{i}.jpg", user=self.user) for i in range(3)]
+        for uploaded_image in self.imgs:
+            for thumbnail_height in self.heights:
+                Thumbnail.objects.create(parentImage=uploaded_image, thumbnail=f"path/to/thumbnail_{thumbnail_height.available_height}.jpg", height=thumbnail_height, user=self.user)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+        get_tier_snapshot(self.user_tier.pk)
+
+    def test_gallery_tier_thumbnails(self):
+        # Test that every image is listed with thumbnails allowed by tier only
+        with self.assertNumQueries(5): # session, user, images with counts, thumbnails, variants
+            response = self.client.get(reverse('images_gallery'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([img['id'] for img in response.data['images']], [img.pk for img in self.imgs])
+        for img in response.data['images']:
+            self.assertEqual(img['thumbnailsCount'], 2)
+            self.assertEqual([t['thumbnail'] for t in img['thumbnails']], ['/media/path/to/thumbnail_200.jpg', '/media/path/to/thumbnail_400.jpg'])
+
+    def test_gallery_query_count_with_variants(self):
+        # Test that page with more images and variants is still read by three queries
+        for thumb in Thumbnail.objects.filter(user=self.user):
+            ThumbnailVariant.objects.create(thumbnail=thumb, file=f"path/to/thumbnail_{thumb.pk}.webp", imgFormat='WEBP')
+        UploadedImage.objects.create(uploadedImage="path/to/image_3.jpg", user=self.user)
+        with self.assertNumQueries(5): # session, user, images with counts, thumbnails, variants
+            response = self.client.get(reverse('images_gallery'))
+        self.assertEqual(len(response.data['images']), 4)
+        self.assertEqual(len(response.data['images'][0]['thumbnails'][0]['variants']), 1)
+
+    def test_gallery_without_original_access(self):
+        # Test that original image is hidden if tier does not include it
+        self.user_tier.accessOriginalFile = False
+        self.user_tier.save()
+        response = self.client.get(reverse('images_gallery'))
+        self.assertNotIn('uploadedImage', response.data['images'][0])
+        self.assertEqual(len(response.data['images'][0]['thumbnails']), 2)
+
+    def test_thumbnails_list_without_images(self):
+        # Test that thumbnails list of user without images does not fail
+        UploadedImage.objects.filter(user=self.user).delete()
+        response = self.client.get(reverse('thumbnails_view', kwargs={'height': 200}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class MediaViewTestCase(TestCase):
+    def setUp(self):
+        self.heights = [ThumbnailHeight.objects.create(available_height=h) for h in (200, 400)]
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True)
+        self.user_tier.thumbnailHeight.set(self.heights[:1])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.content = bytes(range(256)) * 4
+        img_name = default_storage.save('uploaded_imgs/media_test.jpg', ContentFile(self.content))
+        thumb_name = default_storage.save('thumbnails/media_test_thumbnail_200.jpg', ContentFile(self.content))
+        self.uploaded_image = UploadedImage.objects.create(uploadedImage=img_name, user=self.user, contentHash=hashlib.sha256(self.content).hexdigest())
+        self.thumbnails = [
+            Thumbnail.objects.create(parentImage=self.uploaded_image, thumbnail=thumb_name, height=thumbnail_height, user=self.user)
+            for thumbnail_height in self.heights
+        ]
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+
+    def tearDown(self):
+        default_storage.delete(self.uploaded_image.uploadedImage.name)
+        default_storage.delete(self.thumbnails[0].thumbnail.name)
+
+    def test_image_served(self):
+        # Test that file is streamed with validators
+        response = self.client.get(reverse('image_media', kwargs={'pk': self.uploaded_image.pk}), HTTP_ACCEPT='image/*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], f'"{self.uploaded_image.contentHash}"')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('Last-Modified', response)
+
+    def test_conditional_get(self):
+        # Test that repeated view is answered with 304
+        url = reverse('image_media', kwargs={'pk': self.uploaded_image.pk})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{self.uploaded_image.contentHash}"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_range(self):
+        # Test partial content and unsatisfiable range
+        url = reverse('image_media', kwargs={'pk': self.uploaded_image.pk})
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"changed"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(self.content)}-').status_code, 416)
+
+    def test_access(self):
+        # Test ownership and tier access
+        self.assertEqual(self.client.get(reverse('thumbnail_media', kwargs={'pk': self.thumbnails[0].pk})).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('thumbnail_media', kwargs={'pk': self.thumbnails[1].pk})).status_code, status.HTTP_403_FORBIDDEN)
+        self.user_tier.accessOriginalFile = False
+        self.user_tier.save()
+        self.assertEqual(self.client.get(reverse('image_media', kwargs={'pk': self.uploaded_image.pk})).status_code, status.HTTP_403_FORBIDDEN)
+        other_tier = UserTier.objects.create(name="Other Tier", accessOriginalFile=True)
+        User.objects.create_user(username="otheruser", password="testpassword", userTier=other_tier)
+        self.client.login(username='otheruser', password='testpassword')
+        self.assertEqual(self.client.get(reverse('image_media', kwargs={'pk': self.uploaded_image.pk})).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='nginx')
+    def test_accel_redirect(self):
+        # Test that bytes are left to the front proxy
+        response = self.client.get(reverse('image_media', kwargs={'pk': self.uploaded_image.pk}))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.uploaded_image.uploadedImage.name)
+        self.assertEqual(response.content, b'')
+
+
+@override_settings(THUMBNAIL_RENDER_MODE='lazy', THUMBNAIL_RENDER_IN_REQUEST=True)
+class LazyRenderTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            img_name = default_storage.save('uploaded_imgs/lazy_test.jpg', ContentFile(f.read()))
+        with mock.patch('imgs_app.signals.process_uploaded_imgs_task.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.uploaded_image = UploadedImage.objects.create(uploadedImage=img_name, user=self.user)
+        delay.assert_not_called()
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+
+    def tearDown(self):
+        for thumb in Thumbnail.objects.all():
+            default_storage.delete(thumb.thumbnail.name)
+        default_storage.delete(self.uploaded_image.uploadedImage.name)
+
+    def test_rendered_on_first_request(self):
+        # Test that thumbnail is rendered once, on first request
+        self.assertFalse(Thumbnail.objects.exists())
+        url = reverse('image_thumbnail_media', kwargs={'pk': self.uploaded_image.pk, 'height': 200})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        thumb = Thumbnail.objects.get(parentImage=self.uploaded_image)
+        self.assertEqual(thumb.imgHeight, 200)
+        self.assertIsNotNone(thumb.lastAccessed)
+        with mock.patch('imgs_app.tasks.create_thumbnails') as create:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        create.assert_not_called()
+
+    def test_concurrent_render_coalesced(self):
+        # Test that request waits for the render in progress instead of rendering again
+        cache.add(f'imgs:render:{self.uploaded_image.pk}:{self.thumbnail_height.pk}', 1)
+        with mock.patch('imgs_app.tasks.create_thumbnails') as create:
+            self.assertIsNone(render_thumbnail_on_demand(self.uploaded_image, self.thumbnail_height, wait_timeout=0.2))
+        create.assert_not_called()
+
+    @override_settings(THUMBNAIL_RENDER_WAIT_TIMEOUT=0.2)
+    def test_render_wait_limited(self):
+        # Test that request waits for other renderer at most THUMBNAIL_RENDER_WAIT_TIMEOUT
+        cache.add(f'imgs:render:{self.uploaded_image.pk}:{self.thumbnail_height.pk}', 1)
+        url = reverse('image_thumbnail_media', kwargs={'pk': self.uploaded_image.pk, 'height': 200})
+        start = time.monotonic()
+        response = self.client.get(url)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    @override_settings(THUMBNAIL_RENDER_RETRY_AFTER=60)
+    def test_failed_render_retried_later(self):
+        # Test that failed render is not repeated on every request, but after the marker expires
+        url = reverse('image_thumbnail_media', kwargs={'pk': self.uploaded_image.pk, 'height': 200})
+        with mock.patch('imgs_app.executors.render_thumbnails', side_effect=OSError('broken image')):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '60')
+        with mock.patch('imgs_app.tasks.create_thumbnails') as create:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        create.assert_not_called()
+        cache.delete(f'imgs:render_failed:{self.uploaded_image.pk}:{self.thumbnail_height.pk}')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertTrue(Thumbnail.objects.filter(parentImage=self.uploaded_image).exists())
+
+    @override_settings(THUMBNAIL_RENDER_IN_REQUEST=False)
+    def test_rendered_by_task(self):
+        # Test that request only waits for the render enqueued to the interactive queue, once for concurrent requests
+        url = reverse('image_thumbnail_media', kwargs={'pk': self.uploaded_image.pk, 'height': 200})
+        with mock.patch('imgs_app.tasks.render_thumbnail_task.delay') as delay, \
+                mock.patch('imgs_app.tasks.create_thumbnails') as create:
+            self.assertIsNone(render_thumbnail_on_demand(self.uploaded_image, self.thumbnail_height, wait_timeout=0.2))
+            self.assertIsNone(render_thumbnail_on_demand(self.uploaded_image, self.thumbnail_height, wait_timeout=0.2))
+        delay.assert_called_once_with(self.uploaded_image.pk, self.thumbnail_height.pk)
+        create.assert_not_called()
+        render_thumbnail_task(self.uploaded_image.pk, self.thumbnail_height.pk)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_access_time_resolution(self):
+        # Test that access time is not written on every view
+        thumb = render_thumbnail_on_demand(self.uploaded_image, self.thumbnail_height)
+        touch_thumbnail(thumb)
+        with self.assertNumQueries(0):
+            touch_thumbnail(thumb)
+
+    def test_new_height_not_backfilled(self):
+        # Test that new height is not rendered for all images in lazy mode
+        with mock.patch('auth_app.signals.heights_update_task.delay') as delay:
+            ThumbnailHeight.objects.create(available_height=400)
+        delay.assert_not_called()
+
+
+class ThumbnailEvictionTestCase(TestCase):
+    def setUp(self):
+        self.heights = [ThumbnailHeight.objects.create(available_height=h) for h in (200, 400)]
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        now = timezone.now()
+        self.thumbs = []
+        for i in range(3):
+            uploaded_image = UploadedImage.objects.create(uploadedImage=f"path/to/image_{i}.jpg", user=self.user)
+            for j, thumbnail_height in enumerate(self.heights):
+                self.thumbs.append(Thumbnail.objects.create(
+                    parentImage=uploaded_image, thumbnail=f"path/to/thumbnail_{i}_{j}.jpg", height=thumbnail_height, user=self.user,
+                    fileSize=100, lastAccessed=now - datetime.timedelta(hours=len(self.thumbs))
+                ))
+
+    def test_least_recently_used_evicted(self):
+        # Test that the oldest thumbnails are evicted until total size fits
+        ExpiringLink.objects.create(user=self.user, thumbnail=self.thumbs[-1], linkUUID="link")
+        self.assertEqual(evict_thumbnails(max_bytes=350, batch_size=2), 3)
+        self.assertEqual(list(Thumbnail.objects.order_by('pk')), self.thumbs[:2] + self.thumbs[-1:])
+
+    def test_shared_files_counted_once(self):
+        # Test that file shared by thumbnails (and their variants) is counted once and freed with its last reference
+        Thumbnail.objects.filter(pk=self.thumbs[1].pk).update(thumbnail=self.thumbs[0].thumbnail.name)
+        for thumb in self.thumbs[-2:]:
+            ThumbnailVariant.objects.create(thumbnail=thumb, file="path/to/shared.webp", imgFormat='WEBP', fileSize=50)
+        # 5 thumbnail files and 1 variant file, the oldest thumbnail frees only its own file
+        self.assertEqual(evict_thumbnails(max_bytes=450, batch_size=1), 1)
+        # The variant file is freed with its last reference
+        self.assertEqual(evict_thumbnails(max_bytes=300, batch_size=1), 1)
+        self.assertEqual(list(Thumbnail.objects.order_by('pk')), self.thumbs[:4])
+
+    @override_settings(THUMBNAIL_RENDER_MODE='eager', THUMBNAIL_STORAGE_MAX_BYTES=100)
+    def test_eviction_disabled_in_eager_mode(self):
+        # Test that eager mode thumbnails are never evicted
+        self.assertEqual(evict_thumbnails_task(), 0)
+        self.assertEqual(Thumbnail.objects.count(), 6)
+
+
+class OutputFormatsTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.image_path = './imgs_app/example_imgs/su1_1024x1024.jpg'
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+
+    def test_alpha_stored_as_png(self):
+        # Test that transparency is not lost by JPEG encoding
+        encoded = encode_image(PILImage.new('RGBA', (10, 10), (255, 0, 0, 0)), 'JPEG', 75)
+        self.assertEqual(encoded.format, 'PNG')
+        self.assertEqual(PILImage.open(io.BytesIO(encoded.content)).mode, 'RGBA')
+        self.assertEqual(encode_image(PILImage.new('P', (10, 10)), 'JPEG', 75).format, 'JPEG')
+
+    def test_cmyk_stored_as_png(self):
+        # Test that CMYK image can be encoded to PNG tier format
+        encoded = encode_image(PILImage.new('CMYK', (10, 10)), 'PNG')
+        self.assertEqual(encoded.format, 'PNG')
+        self.assertEqual(PILImage.open(io.BytesIO(encoded.content)).mode, 'RGB')
+
+    def test_webp_variant_smaller(self):
+        # Test that WebP variant is much smaller than JPEG encoded with Pillow defaults
+        encoded = render_thumbnails(self.image_path, [200], output_formats={200: [('JPEG', 75), ('WEBP', 75)]})[200]
+        [variant] = encoded.variants
+        baseline = io.BytesIO()
+        SimpleImageProcessing(self.image_path).new_thumbnail_keep_aspect(200).save(baseline, format='JPEG')
+        self.assertEqual(variant.format, 'WEBP')
+        self.assertLess(len(encoded.content), len(baseline.getvalue()))
+        self.assertLess(len(variant.content), 0.7*len(baseline.getvalue()))
+
+    def test_accepted_image_formats(self):
+        # Test that only explicitly accepted formats are returned
+        self.assertEqual(accepted_image_formats('image/avif,image/webp,image/apng,*/*;q=0.8'), {'AVIF', 'WEBP', 'APNG'})
+        self.assertEqual(accepted_image_formats('image/webp;q=0, image/*'), set())
+        self.assertEqual(accepted_image_formats(None), set())
+
+    @override_settings(THUMBNAIL_RENDER_MODE='lazy', THUMBNAIL_RENDER_IN_REQUEST=True, THUMBNAIL_VARIANT_FORMATS=['WEBP'])
+    def test_variant_negotiated(self):
+        # Test that variant is stored and served to clients accepting it
+        with open(self.image_path, 'rb') as f:
+            img_name = default_storage.save('uploaded_imgs/variant_test.jpg', ContentFile(f.read()))
+        uploaded_image = UploadedImage.objects.create(uploadedImage=img_name, user=self.user)
+        thumb = render_thumbnail_on_demand(uploaded_image, self.thumbnail_height)
+        [variant] = thumb.variants.all()
+        self.assertTrue(variant.file.name.endswith('.webp'))
+        url = reverse('thumbnail_media', kwargs={'pk': thumb.pk})
+
+        response = self.client.get(url, HTTP_ACCEPT='image/avif,image/webp,*/*')
+        self.assertEqual((response['Content-Type'], response['ETag']), ('image/webp', f'"{variant.contentHash}"'))
+        self.assertIn('Accept', response['Vary'])
+        response = self.client.get(url, HTTP_ACCEPT='*/*')
+        self.assertEqual((response['Content-Type'], response['ETag']), ('image/jpeg', f'"{thumb.contentHash}"'))
+        for name in (variant.file.name, thumb.thumbnail.name, img_name):
+            default_storage.delete(name)
+
+
+@override_settings(THUMBNAIL_RENDER_MODE='lazy', THUMBNAIL_VARIANT_FORMATS=[])
+class EncodeToStorageTestCase(TestCase):
+    def setUp(self):
+        self.heights = [ThumbnailHeight.objects.create(available_height=h) for h in (400, 200, 50)]
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user_tier.thumbnailHeight.set(self.heights)
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.img_name = default_storage.save('uploaded_imgs/spool_test.jpg', ContentFile(f.read()))
+        self.uploaded_image = UploadedImage.objects.create(uploadedImage=self.img_name, user=self.user)
+
+    def tearDown(self):
+        for thumb in Thumbnail.objects.all():
+            default_storage.delete(thumb.thumbnail.name)
+        default_storage.delete(self.img_name)
+
+    def assertStoredThumbnails(self):
+        thumbs = list(Thumbnail.objects.filter(parentImage=self.uploaded_image).order_by('-height__available_height'))
+        self.assertEqual(len(thumbs), 3)
+        for thumb in thumbs:
+            with default_storage.open(thumb.thumbnail.name, 'rb') as f:
+                content = f.read()
+            self.assertEqual(len(content), thumb.fileSize)
+            self.assertEqual(hashlib.sha256(content).hexdigest(), thumb.contentHash)
+            self.assertEqual(PILImage.open(io.BytesIO(content)).size[1], thumb.height.available_height)
+        # Every output is written to its own file, smaller thumbnail is smaller file
+        self.assertGreater(thumbs[0].fileSize, thumbs[1].fileSize)
+        self.assertGreater(thumbs[1].fileSize, thumbs[2].fileSize)
+
+    def test_spooled_in_memory(self):
+        # Test that thumbnails rendered in process are stored with the right size and content
+        create_thumbnails(plan_missing_thumbnails(UploadedImage.objects.filter(pk=self.uploaded_image.pk)), use_process_pool=False)
+        self.assertStoredThumbnails()
+
+    @override_settings(THUMBNAIL_SPOOL_MAX_SIZE=1)
+    def test_spooled_to_disk(self):
+        # Test that thumbnails rolled over to temporary files are stored intact
+        create_thumbnails(plan_missing_thumbnails(UploadedImage.objects.filter(pk=self.uploaded_image.pk)), use_process_pool=False)
+        self.assertStoredThumbnails()
+
+
+@override_settings(THUMBNAIL_RENDER_MODE='lazy', THUMBNAIL_VARIANT_FORMATS=[])
+class DeduplicatedSchedulingTestCase(TestCase):
+    def setUp(self):
+        self.heights = [ThumbnailHeight.objects.create(available_height=h) for h in (200, 100)]
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user_tier.thumbnailHeight.set(self.heights)
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.img_name = default_storage.save('uploaded_imgs/dedup_test.jpg', ContentFile(f.read()))
+        self.uploaded_image = UploadedImage.objects.create(uploadedImage=self.img_name, user=self.user)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+
+    def tearDown(self):
+        for thumb in Thumbnail.objects.all():
+            default_storage.delete(thumb.thumbnail.name)
+        default_storage.delete(self.img_name)
+
+    def plan(self):
+        return plan_missing_thumbnails(UploadedImage.objects.filter(pk=self.uploaded_image.pk))
+
+    @override_settings(THUMBNAIL_RENDER_MODE='eager', IMAGE_PROCESSING_STALE_AFTER=600)
+    def test_stale_processing_does_not_block_check(self):
+        # Test that image stuck in progress (lost task) does not block the user thumbnails check
+        set_processing_state([self.uploaded_image.pk], UploadedImage.PROCESSING)
+        url = reverse('thumbnails_view', kwargs={'height': 200})
+        with mock.patch('imgs_app.tasks.check_user_thumbs_task.delay') as delay:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        delay.assert_not_called()
+        UploadedImage.objects.filter(pk=self.uploaded_image.pk).update(processingUpdatedAt=timezone.now() - datetime.timedelta(seconds=601))
+        with mock.patch('imgs_app.tasks.check_user_thumbs_task.delay') as delay:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        delay.assert_called_once_with(self.user.pk)
+        check_user_thumbs_task(self.user.pk)
+        self.uploaded_image.refresh_from_db()
+        self.assertEqual(self.uploaded_image.processingState, UploadedImage.READY)
+        self.assertEqual(Thumbnail.objects.filter(parentImage=self.uploaded_image).count(), 2)
+
+    @override_settings(THUMBNAIL_RENDER_MODE='eager')
+    def test_user_check_enqueued_once(self):
+        # Test that polling client enqueues the user check once until it starts
+        url = reverse('thumbnails_view', kwargs={'height': 200})
+        with mock.patch('imgs_app.tasks.check_user_thumbs_task.delay') as delay:
+            for _ in range(3):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        delay.assert_called_once_with(self.user.pk)
+        check_user_thumbs_task(self.user.pk)
+        self.assertEqual(Thumbnail.objects.filter(parentImage=self.uploaded_image).count(), 2)
+        with mock.patch('imgs_app.tasks.check_user_thumbs_task.delay') as delay:
+            self.assertTrue(enqueue_once(check_user_thumbs_task, self.user.pk))
+        delay.assert_called_once_with(self.user.pk)
+
+    def test_rendering_pair_skipped(self):
+        # Test that pair rendered by other worker is not rendered again, lock of the others is released
+        lock_key = f'imgs:render:{self.uploaded_image.pk}:{self.heights[0].pk}'
+        cache.add(lock_key, 1)
+        create_thumbnails(self.plan(), use_process_pool=False)
+        self.assertEqual(list(Thumbnail.objects.values_list('height', flat=True)), [self.heights[1].pk])
+        self.assertIsNone(cache.get(f'imgs:render:{self.uploaded_image.pk}:{self.heights[1].pk}'))
+        cache.delete(lock_key)
+        create_thumbnails(self.plan(), use_process_pool=False)
+        self.assertEqual(Thumbnail.objects.count(), 2)
+
+    def test_concurrent_insert_dropped(self):
+        # Test that thumbnail stored meanwhile by other worker is kept and rendered file is removed
+        plan = list(self.plan())
+        existing = Thumbnail.objects.create(parentImage=self.uploaded_image, thumbnail="path/to/thumbnail.jpg", height=self.heights[0], user=self.user)
+        create_thumbnails(plan, use_process_pool=False)
+        self.assertEqual(Thumbnail.objects.filter(height=self.heights[0]).get(), existing)
+        self.assertEqual(Thumbnail.objects.filter(height=self.heights[1]).count(), 1)
+        self.assertFalse(default_storage.exists(f'thumbnails/{Path(self.img_name).stem}_thumbnail_200.jpg'))
+
+
+class ImageStatusTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        with mock.patch('imgs_app.signals.enqueue_on_commit'):
+            self.uploaded_image = UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        self.async_client.force_login(self.user)
+        self.url = reverse('image_status', kwargs={'pk': self.uploaded_image.pk})
+        cache.clear()
+
+    def test_upload_returns_status(self):
+        # Test that upload returns status link and processing state is written by the task
+        # Task runs synchronously, so the test does not depend on CELERY_TASK_ALWAYS_EAGER
+        with mock.patch.object(process_uploaded_imgs_task, 'delay', side_effect=process_uploaded_imgs_task), \
+                open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('images_upload'), {'uploadedImage': SimpleUploadedFile('status.jpg', f.read())}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        uploaded_image = UploadedImage.objects.get(pk=response.data['id'])
+        self.assertEqual(uploaded_image.processingState, UploadedImage.READY)
+        response = self.client.get(response.data['status'])
+        self.assertEqual(response.data, {'id': uploaded_image.pk, 'processingState': UploadedImage.READY})
+        for thumb in Thumbnail.objects.filter(parentImage=uploaded_image):
+            default_storage.delete(thumb.thumbnail.name)
+        default_storage.delete(uploaded_image.uploadedImage.name)
+
+    def test_single_height_render_not_ready(self):
+        # Test that image is not marked ready by render of single height while other heights are missing
+        other_height = ThumbnailHeight.objects.create(available_height=400)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.uploaded_image.uploadedImage = default_storage.save('uploaded_imgs/single_height_test.jpg', ContentFile(f.read()))
+        self.uploaded_image.save()
+        set_processing_state([self.uploaded_image.pk], UploadedImage.PROCESSING)
+        uploaded_imgs = UploadedImage.objects.filter(pk=self.uploaded_image.pk)
+        create_thumbnails(plan_missing_thumbnails(uploaded_imgs, [self.thumbnail_height]), use_process_pool=False)
+        self.assertEqual(uploaded_imgs.get().processingState, UploadedImage.PROCESSING)
+        create_thumbnails(plan_missing_thumbnails(uploaded_imgs, [other_height]), use_process_pool=False)
+        self.assertEqual(uploaded_imgs.get().processingState, UploadedImage.READY)
+        for thumb in Thumbnail.objects.filter(parentImage=self.uploaded_image):
+            default_storage.delete(thumb.thumbnail.name)
+        default_storage.delete(self.uploaded_image.uploadedImage.name)
+
+    def test_failed_processing(self):
+        # Test that image which can not be processed is marked as failed
+        process_uploaded_imgs_task([self.uploaded_image.pk])
+        self.uploaded_image.refresh_from_db()
+        self.assertEqual(self.uploaded_image.processingState, UploadedImage.FAILED)
+
+    def test_render_locked_not_ready(self):
+        # Test that image with a height rendered by other worker is not marked ready by the task
+        other_height = ThumbnailHeight.objects.create(available_height=400)
+        with open('./imgs_app/example_imgs/su1_1024x1024.jpg', 'rb') as f:
+            self.uploaded_image.uploadedImage = default_storage.save('uploaded_imgs/locked_test.jpg', ContentFile(f.read()))
+        self.uploaded_image.save()
+        lock_key = f'imgs:render:{self.uploaded_image.pk}:{other_height.pk}'
+        cache.add(lock_key, 1)
+        process_uploaded_imgs_task([self.uploaded_image.pk])
+        self.uploaded_image.refresh_from_db()
+        self.assertEqual(self.uploaded_image.processingState, UploadedImage.PROCESSING)
+        self.assertEqual(list(Thumbnail.objects.filter(parentImage=self.uploaded_image).values_list('imgHeight', flat=True)), [200])
+        cache.delete(lock_key)
+        process_uploaded_imgs_task([self.uploaded_image.pk])
+        self.uploaded_image.refresh_from_db()
+        self.assertEqual(self.uploaded_image.processingState, UploadedImage.READY)
+        for thumb in Thumbnail.objects.filter(parentImage=self.uploaded_image):
+            default_storage.delete(thumb.thumbnail.name)
+        default_storage.delete(self.uploaded_image.uploadedImage.name)
+
+    @override_settings(IMAGE_STATUS_POLL_INTERVAL=0)
+    def test_long_poll(self):
+        # Test that request waits until the image is processed, polling cache only
+        self.assertEqual(self.uploaded_image.processingState, UploadedImage.PENDING)
+        response = self.client.get(self.url)
+        self.assertEqual((response.data['processingState'], response['Retry-After']), (UploadedImage.PENDING, '1'))
+        with mock.patch('imgs_app.status.time.sleep', side_effect=lambda seconds: cache.set(f'imgs:state:{self.uploaded_image.pk}', UploadedImage.READY)) as sleep:
+            response = self.client.get(self.url + '?wait=10')
+        self.assertEqual(response.data['processingState'], UploadedImage.READY)
+        sleep.assert_called_once()
+        self.assertEqual(self.client.get(self.url + '?wait=soon').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_thumbnails_list_not_rescanned(self):
+        # Test that polling thumbnails list does not enqueue user check while image is processed
+        with mock.patch('imgs_app.tasks.check_user_thumbs_task.delay') as delay:
+            response = self.client.get(reverse('thumbnails_view', kwargs={'height': 200}))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        delay.assert_not_called()
+
+    @override_settings(IMAGE_STATUS_POLL_INTERVAL=0)
+    async def test_events_stream(self):
+        # Test that state changes are streamed until the image is processed
+        states = iter([UploadedImage.PROCESSING, UploadedImage.PROCESSING, UploadedImage.READY])
+        async def next_state(seconds):
+            cache.set(f'imgs:state:{self.uploaded_image.pk}', next(states))
+        with mock.patch('imgs_app.status.asyncio.sleep', side_effect=next_state):
+            response = await self.async_client.get(reverse('image_status_events', kwargs={'pk': self.uploaded_image.pk}))
+            events = [event async for event in response.streaming_content]
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual([json.loads(event.decode().split('data: ')[1])['processingState'] for event in events], ['pending', 'processing', 'ready'])
+
+    async def test_events_stream_forbidden(self):
+        # Test that anonymous client gets no events
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(reverse('image_status_events', kwargs={'pk': self.uploaded_image.pk}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OnCommitDispatchTestCase(TestCase):
+    def setUp(self):
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+
+    def create_images(self, count):
+        return [UploadedImage.objects.create(uploadedImage=f"path/to/image_{i}.jpg", user=self.user).pk for i in range(count)]
+
+    def test_batched_after_commit(self):
+        # Test that images created in one transaction are enqueued once, after commit
+        with mock.patch('imgs_app.signals.process_uploaded_imgs_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                object_ids = self.create_images(3)
+                delay.assert_not_called()
+        delay.assert_called_once_with(object_ids)
+
+    def test_rolled_back_not_enqueued(self):
+        # Test that image of rolled back transaction is not enqueued, nor it blocks the next batch
+        with mock.patch('imgs_app.signals.process_uploaded_imgs_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        self.create_images(1)
+                        raise ValueError
+                except ValueError:
+                    pass
+                object_ids = self.create_images(1)
+        delay.assert_called_once_with(object_ids)
+
+    @override_settings(THUMBNAIL_UPLOAD_BATCH_SIZE=2)
+    def test_batch_size(self):
+        # Test that bulk import is sent in messages of bounded size
+        with mock.patch('imgs_app.signals.process_uploaded_imgs_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                object_ids = self.create_images(3)
+        self.assertEqual([c.args[0] for c in delay.call_args_list], [object_ids[:2], object_ids[2:]])
+
+
+class TaskQueuesTestCase(TestCase):
+    def test_tasks_routed(self):
+        # Test that uploads, backfills and scans go to separate queues
+        routes = {
+            process_uploaded_imgs_task: 'interactive',
+            render_thumbnail_task: 'interactive',
+            heights_update_task: 'bulk',
+            check_user_thumbs_task: 'reconcile',
+            evict_thumbnails_task: 'reconcile',
+        }
+        for task, queue in routes.items():
+            self.assertEqual(celery_app.amqp.router.route({}, task.name)['queue'].name, queue)
+
+    def test_queue_worker_options(self):
+        # Test that worker of single queue gets its options, command line options are kept
+        conf = mock.Mock(worker_concurrency=None, worker_prefetch_multiplier=4)
+        configure_queue_worker(conf=conf, options={'queues': ['bulk']})
+        self.assertEqual((conf.worker_concurrency, conf.worker_prefetch_multiplier), (settings.TASK_QUEUE_WORKERS['bulk']['concurrency'], 1))
+        conf = mock.Mock(worker_concurrency=None, worker_prefetch_multiplier=4)
+        configure_queue_worker(conf=conf, options={'queues': ['interactive', 'bulk']})
+        self.assertEqual((conf.worker_concurrency, conf.worker_prefetch_multiplier), (None, 4))
+
+
+class ExpiringLinkTokenTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True, accessGenerateExpiringLinks=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.uploaded_image = UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user)
+        self.thumbnail = Thumbnail.objects.create(parentImage=self.uploaded_image, thumbnail="path/to/thumbnail.jpg", height=self.thumbnail_height, user=self.user)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+
+    def create_link(self):
+        data = {'image': self.uploaded_image.pk, 'thumbnail': self.thumbnail.pk, 'expiryTime': 600}
+        response = self.client.post(reverse('expiring_link_create'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['link']
+
+    def test_link_resolved_by_token(self):
+        # Test that new link stores indexed token and is resolved by it
+        link_url = self.create_link()
+        link = ExpiringLink.objects.get(user=self.user)
+        self.assertEqual(link.linkToken.hex, link.linkUUID)
+        response = self.client.get(link_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['thumbnail']['thumbnail'], self.thumbnail.thumbnail.url)
+
+    def test_link_to_image_only(self):
+        # Test that link can be created without thumbnail selection
+        data = {'image': self.uploaded_image.pk, 'expiryTime': 600}
+        response = self.client.post(reverse('expiring_link_create'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(EXPIRING_LINKS_SIGNED=True)
+    def test_signed_link(self):
+        # Test that signed link is resolved without storing it in db, payload is built on resolve
+        link_url = self.create_link()
+        self.assertFalse(ExpiringLink.objects.exists())
+        self.assertLess(len(link_url), 150)
+        UploadedImage.objects.filter(pk=self.uploaded_image.pk).update(fileSize=123)
+        with self.assertNumQueries(5): # session, user, image, thumbnail and its variants
+            response = self.client.get(link_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['image']['uploadedImage'], self.uploaded_image.uploadedImage.url)
+        self.assertEqual(response.data['image']['fileSize'], 123)
+        self.assertEqual(response.data['thumbnail']['thumbnail'], self.thumbnail.thumbnail.url)
+
+    @override_settings(EXPIRING_LINKS_SIGNED=True)
+    def test_signed_link_to_deleted_selection(self):
+        # Test that signed link is not valid once its thumbnail is deleted
+        link_url = self.create_link()
+        self.thumbnail.delete()
+        self.assertEqual(self.client.get(link_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(EXPIRING_LINKS_SIGNED=True)
+    def test_signed_link_tampered_or_expired(self):
+        # Test that tampered and expired signed links are rejected
+        link_url = self.create_link()
+        self.assertEqual(self.client.get(link_url.rstrip('/') + 'x/').status_code, status.HTTP_404_NOT_FOUND)
+        with mock.patch('imgs_app.links.time.time', return_value=time.time() + 601):
+            self.assertEqual(self.client.get(link_url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LinkCacheTestCase(TestCase):
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True, accessGenerateExpiringLinks=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.uploaded_image = UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user)
+        self.thumbnail = Thumbnail.objects.create(parentImage=self.uploaded_image, thumbnail="path/to/thumbnail.jpg", height=self.thumbnail_height, user=self.user)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+
+    def create_link(self, expiryTime=600):
+        data = {'image': self.uploaded_image.pk, 'thumbnail': self.thumbnail.pk, 'expiryTime': expiryTime}
+        response = self.client.post(reverse('expiring_link_create'), data, format='json')
+        return response.data['link'], ExpiringLink.objects.get(user=self.user)
+
+    def test_link_served_from_cache(self):
+        # Test that repeated request of the link does not query the link again
+        link_url, link = self.create_link()
+        first_response = self.client.get(link_url)
+        with self.assertNumQueries(2): # session and user only
+            second_response = self.client.get(link_url)
+        self.assertEqual(first_response.data, second_response.data)
+        self.assertEqual(link_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_link_cached_for_remaining_lifetime(self):
+        # Test that cache entry does not outlive the link
+        link_url, link = self.create_link(expiryTime=600)
+        with mock.patch('imgs_app.cache.cache.set') as cache_set:
+            self.client.get(link_url)
+        self.assertEqual(cache_set.call_args.args[0], link_cache_key(link.linkToken))
+        self.assertLessEqual(cache_set.call_args.args[2], 600)
+        self.assertGreater(cache_set.call_args.args[2], 590)
+
+    def test_deleted_link_removed_from_cache(self):
+        # Test that link deleted with its image is not served from cache
+        link_url, link = self.create_link()
+        self.client.get(link_url)
+        self.assertIsNotNone(cache.get(link_cache_key(link.linkUUID)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.uploaded_image.delete()
+        self.assertIsNone(cache.get(link_cache_key(link.linkUUID)))
+        self.assertEqual(self.client.get(link_url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExpiredLinksPurgeTestCase(TestCase):
+    def setUp(self):
+        self.user_tier = UserTier.objects.create(name="Test Tier")
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.valid_link = ExpiringLink.objects.create(user=self.user, expiryTime=600, linkUUID="valid")
+        self.expired_links = [ExpiringLink.objects.create(user=self.user, expiryTime=300, linkUUID=f"expired_{i}") for i in range(5)]
+        ExpiringLink.objects.filter(pk__in=[link.pk for link in self.expired_links]).update(expiresAt=timezone.now() - datetime.timedelta(seconds=1))
+
+    def test_expires_at_stored(self):
+        # Test that expiry time is stored on save
+        self.assertAlmostEqual(self.valid_link.expiresAt, self.valid_link.createdAt + datetime.timedelta(seconds=600), delta=datetime.timedelta(seconds=1))
+
+    def test_delete_expired_links_in_batches(self):
+        # Test that only expired links are deleted, in bounded batches
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(delete_expired_links(batch_size=2), 5)
+        self.assertEqual(list(ExpiringLink.objects.all()), [self.valid_link])
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('DELETE')]), 3)
+
+    def test_purge_expired_links_command(self):
+        # Test management command
+        out = io.StringIO()
+        call_command('purge_expired_links', stdout=out)
+        self.assertIn("Deleted 5 expired links.", out.getvalue())
+
+
+class QueryPlanTestCase(TestCase):
+    """Query count and EXPLAIN guards of hot endpoints. Every SELECT of the endpoint
+    is explained, on PostgreSQL with sequential scans disabled, so a full table scan
+    in the plan means that no index can serve the query.
+    """
+    def setUp(self):
+        self.thumbnail_height = ThumbnailHeight.objects.create(available_height=200)
+        self.user_tier = UserTier.objects.create(name="Test Tier", accessOriginalFile=True, accessGenerateExpiringLinks=True)
+        self.user_tier.thumbnailHeight.set([self.thumbnail_height])
+        self.user = User.objects.create_user(username="testuser", password="testpassword", userTier=self.user_tier)
+        self.client = APIClient()
+        self.client.login(username='testuser', password='testpassword')
+        self.create_images(1)
+        cache.clear()
+        get_tier_snapshot(self.user_tier.pk) # tier snapshot is cached, see TierSnapshotTestCase
+
+    def create_images(self, count):
+        for _ in range(count):
+            uploaded_image = UploadedImage.objects.create(uploadedImage="path/to/image.jpg", user=self.user)
+            self.thumbnail = Thumbnail.objects.create(parentImage=uploaded_image, thumbnail="path/to/thumbnail.jpg", height=self.thumbnail_height, user=self.user)
+        self.uploaded_image = uploaded_image
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return [line for line in plan if 'Seq Scan on imgs_app_' in line]
+        return [line for line in plan if line.startswith('SCAN ') and 'USING' not in line]
+
+    def assertIndexedQueries(self, num, method, url, data=None):
+        # Runs the request, checks number of queries and plan of every SELECT
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(len(queries), num, [q['sql'] for q in queries.captured_queries])
+
+        for query in queries.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                plan = self.explain(query['sql'])
+                self.assertEqual(self.full_scans(plan), [], f"{query['sql']}\n" + '\n'.join(plan))
+        return response
+
+    def test_images_list(self):
+        # Test images list, number of queries does not depend on number of images
+        response = self.assertIndexedQueries(3, 'get', reverse('images_view'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.create_images(3)
+        cache.clear()
+        self.assertIndexedQueries(3, 'get', reverse('images_view'))
+
+    def test_thumbnails_list(self):
+        # Test thumbnails list, number of queries does not depend on number of thumbnails
+        response = self.assertIndexedQueries(4, 'get', reverse('thumbnails_view', kwargs={'height': 200}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.create_images(3)
+        cache.clear()
+        self.assertIndexedQueries(4, 'get', reverse('thumbnails_view', kwargs={'height': 200}))
+
+    def test_gallery(self):
+        # Test gallery, number of queries does not depend on number of images
+        response = self.assertIndexedQueries(5, 'get', reverse('images_gallery'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.create_images(3)
+        cache.clear()
+        self.assertIndexedQueries(5, 'get', reverse('images_gallery'))
+
+    def test_expiring_link_create(self):
+        # Test expiring link creation
+        data = {'image': self.uploaded_image.pk, 'thumbnail': self.thumbnail.pk, 'expiryTime': 600}
+        response = self.assertIndexedQueries(5, 'post', reverse('expiring_link_create'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_expiring_link_retrieve(self):
+        # Test expiring link resolved by token and by legacy string in a single query
+        link = ExpiringLink(user=self.user, image=self.uploaded_image, thumbnail=self.thumbnail, linkToken=uuid.uuid4())
+        link.linkUUID = link.linkToken.hex
+        link.save()
+        legacy_link = ExpiringLink.objects.create(user=self.user, image=self.uploaded_image, linkUUID="legacy")
+        response = self.assertIndexedQueries(4, 'get', reverse('expiring_link_view', kwargs={'linkUUID': link.linkUUID}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.assertIndexedQueries(3, 'get', reverse('expiring_link_view', kwargs={'linkUUID': legacy_link.linkUUID}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_upload_session(self):
+        # Test upload session offset lookup
+        session = UploadSession.objects.create(user=self.user, fileName="image.jpg", fileSize=100)
+        response = self.assertIndexedQueries(3, 'get', reverse('upload_session', kwargs={'pk': session.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
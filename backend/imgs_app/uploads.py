@@ -0,0 +1,184 @@
+import re
+import uuid
+from django.core.exceptions import ValidationError
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from imgs_app.validators import IMG_MAGIC_BYTES, validate_img_magic_bytes
+
+MAGIC_BYTES_LEN = max(len(magic_bytes) for magic_bytes in IMG_MAGIC_BYTES)
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def parse_content_range(header):
+    """Parses `Content-Range: bytes start-end/total` header.
+
+    Returns:
+        Returns tuple (start, end, total) or None if header is invalid.
+    """
+    match = CONTENT_RANGE_RE.match((header or '').strip())
+
+    if not match:
+        return None
+
+    start, end, total = (int(value) for value in match.groups())
+
+    if end < start or end >= total:
+        return None
+    return start, end, total
+
+
+def session_dir(session):
+    return f'upload_sessions/{session.pk}'
+
+
+def part_name(session, offset, token):
+    # Token is unique per request, so concurrent requests of the same offset never write the same part
+    return f'{session_dir(session)}/{offset:012d}.{token}.part'
+
+
+class ChunkStreamReader:
+    """File-like wrapper of request body stream. It reads at most `length` bytes,
+    raises ValidationError once the stream exceeds the length and checks magic bytes
+    of the first chunk of the file, so invalid upload is rejected before it is stored.
+
+    Args:
+        stream: Request body stream.
+        length (int): Number of bytes declared in Content-Range header.
+        first_chunk (bool): If the chunk starts at offset 0.
+    """
+    def __init__(self, stream, length, first_chunk):
+        self.stream = stream
+        self.size = length
+        self.first_chunk = first_chunk
+        self.read_bytes = 0
+        self.header = b''
+
+    def read(self, size = -1):
+        remaining = self.size - self.read_bytes
+        data = self.stream.read(remaining + 1 if size is None or size < 0 else min(size, remaining + 1))
+        self.read_bytes += len(data)
+
+        if self.read_bytes > self.size:
+            raise ValidationError("Chunk is bigger than declared in Content-Range.")
+
+        if self.first_chunk and len(self.header) < MAGIC_BYTES_LEN:
+            self.header += data[:MAGIC_BYTES_LEN - len(self.header)]
+
+            if len(self.header) >= MAGIC_BYTES_LEN or self.read_bytes == self.size:
+                validate_img_magic_bytes(self.header)
+        return data
+
+
+class UploadPartsReader:
+    """File-like reader joining stored parts of upload session in order,
+    only single part is open at once.
+
+    Args:
+        parts (list): [offset, storage name] of parts in order, as recorded in UploadSession.parts.
+        size (int): Total size of the parts.
+    """
+    def __init__(self, parts, size):
+        self.names = [name for _, name in parts]
+        self.offsets = [offset for offset, _ in parts]
+        self.size = size
+        self.position = 0
+        self.index = None
+        self.current = None
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence = 0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+
+        self.position = max(offset, 0)
+        self.close()
+        return self.position
+
+    def _open_part(self):
+        # Find the last part starting before current position
+        index = 0
+        while index + 1 < len(self.offsets) and self.offsets[index + 1] <= self.position:
+            index += 1
+        self.index = index
+        self.current = default_storage.open(self.names[index], 'rb')
+        self.current.seek(self.position - self.offsets[index])
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(64 * 1024), b''))
+
+        if self.position >= self.size or not self.names:
+            return b''
+
+        if self.current is None:
+            self._open_part()
+
+        data = self.current.read(size)
+
+        while not data and self.index + 1 < len(self.names):
+            self.current.close()
+            self.index += 1
+            self.current = default_storage.open(self.names[self.index], 'rb')
+            data = self.current.read(size)
+
+        self.position += len(data)
+        return data
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+
+def store_chunk(session, start, stream, length):
+    """Streams chunk of the request body to storage as a new part of the session.
+    Parts of interrupted requests are never confirmed, these are deleted with the session.
+
+    Args:
+        session (UploadSession): The upload session.
+        start (int): Offset of the chunk.
+        stream: Request body stream.
+        length (int): Length of the chunk.
+
+    Returns:
+        Returns storage name of stored part, it is recorded with the offset
+        in the session, as storage can store the part under another name.
+    """
+    name = part_name(session, start, uuid.uuid4().hex)
+    reader = ChunkStreamReader(stream, length, first_chunk = start == 0)
+
+    try:
+        stored_name = default_storage.save(name, File(reader, name = name))
+    except Exception:
+        # Do not keep partially written part
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        raise
+
+    if reader.read_bytes != length:
+        default_storage.delete(stored_name)
+        raise ValidationError("Chunk is smaller than declared in Content-Range.")
+    return stored_name
+
+
+def session_parts(session):
+    """Returns [offset, storage name] of confirmed parts of the session in order."""
+    return sorted(session.parts)
+
+
+def delete_session_parts(session):
+    """Deletes all stored files of the session, including parts which were never confirmed."""
+    try:
+        _, files = default_storage.listdir(session_dir(session))
+    except FileNotFoundError:
+        return
+
+    for name in files:
+        default_storage.delete(f'{session_dir(session)}/{name}')
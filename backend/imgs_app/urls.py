@@ -1,16 +1,36 @@
 from django.urls import path
 from imgs_app.views import (
     UploadImageView, 
+    UploadSessionCreateView,
+    UploadSessionView,
+    UploadSessionFinalizeView,
     ImagesListApiView, 
+    GalleryApiView,
+    ImageStatusView,
+    ImageStatusEventsView,
+    ImageMediaView,
+    ThumbnailMediaView,
+    ImageThumbnailMediaView,
     ThumbnailsListApiView, 
     ExpiringLinkCreateApiView,
-    ExpiringLinkRetrieveView
+    ExpiringLinkRetrieveView,
+    SignedExpiringLinkRetrieveView
     )
 
 urlpatterns = [
     path('images/upload/', UploadImageView.as_view(), name='images_upload'),
+    path('images/upload/sessions/', UploadSessionCreateView.as_view(), name='upload_session_create'),
+    path('images/upload/sessions/<uuid:pk>/', UploadSessionView.as_view(), name='upload_session'),
+    path('images/upload/sessions/<uuid:pk>/finalize/', UploadSessionFinalizeView.as_view(), name='upload_session_finalize'),
     path('images/view/', ImagesListApiView.as_view(), name='images_view'),
+    path('images/gallery/', GalleryApiView.as_view(), name='images_gallery'),
+    path('images/<int:pk>/status/', ImageStatusView.as_view(), name='image_status'),
+    path('images/<int:pk>/status/events/', ImageStatusEventsView.as_view(), name='image_status_events'),
     path('thumbnails/view/<int:height>/', ThumbnailsListApiView.as_view(), name='thumbnails_view'),
+    path('media/images/<int:pk>/', ImageMediaView.as_view(), name='image_media'),
+    path('media/images/<int:pk>/thumbnails/<int:height>/', ImageThumbnailMediaView.as_view(), name='image_thumbnail_media'),
+    path('media/thumbnails/<int:pk>/', ThumbnailMediaView.as_view(), name='thumbnail_media'),
     path('expiring_link/new/', ExpiringLinkCreateApiView.as_view(), name='expiring_link_create'),
+    path('expiring_link/signed/<str:token>/', SignedExpiringLinkRetrieveView.as_view(), name='signed_expiring_link_view'),
     path('expiring_link/<str:linkUUID>/', ExpiringLinkRetrieveView.as_view(), name='expiring_link_view'),
 ]
@@ -0,0 +1,50 @@
+import hashlib
+import warnings
+from PIL import Image as PILImage
+
+
+def file_content_hash(file):
+    """Returns SHA-256 hex digest of the file content.
+    File is read in chunks, therefore it is never loaded at once to memory.
+
+    Args:
+        file: Django File object (e.g. UploadedFile or FieldFile).
+
+    Returns:
+        Returns hex digest (64 chars).
+    """
+    sha256 = hashlib.sha256()
+
+    for chunk in file.chunks():
+        sha256.update(chunk)
+
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def content_hash(content):
+    """Returns SHA-256 hex digest of bytes."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def img_header_info(file, formats = None):
+    """Reads image format and dimensions from the file header. Pillow opens
+    the image lazily, load() is not called, therefore pixel data is not decoded.
+
+    Args:
+        file: Django File object (e.g. UploadedFile or FieldFile).
+        formats (list(str)): Pillow formats allowed to be identified, all by default.
+
+    Returns:
+        Returns tuple (width, height, format).
+    """
+    file.seek(0)
+
+    try:
+        with warnings.catch_warnings():
+            # Pixel count limits are checked by the caller
+            warnings.simplefilter('ignore', PILImage.DecompressionBombWarning)
+            with PILImage.open(file, formats = formats) as img:
+                return img.size[0], img.size[1], img.format
+    finally:
+        file.seek(0)
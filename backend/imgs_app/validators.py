@@ -1,12 +1,23 @@
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
+from PIL import Image as PILImage
+from imgs_app.utils import img_header_info
+
+ALLOWED_IMG_EXTENSIONS = ['jpg', 'jpeg', 'png']
+MAX_IMG_SIZE = 25 * 1024 * 1024 # 25MB
+ALLOWED_IMG_FORMATS = ['JPEG', 'PNG']
+MAX_IMG_PIXELS = 15360 * 8640 # 16K image, protects against decompression bombs
+IMG_MAGIC_BYTES = (
+    b'\xff\xd8\xff', # JPEG
+    b'\x89PNG\r\n\x1a\n', # PNG
+)
 
 
 def validate_img_extension(value):
     """
     Custom function to validate image file extension.
     """
-    return FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])(
+    return FileExtensionValidator(allowed_extensions=ALLOWED_IMG_EXTENSIONS)(
         value
     )
 
@@ -14,7 +25,38 @@ def validate_img_size(value):
     """
     Custom function to validate image file size.
     """
-    max_size = 25 * 1024 * 1024 # 25MB
+    validate_img_declared_size(value.size)
 
-    if value.size > max_size:
+def validate_img_declared_size(size):
+    """
+    Custom function to validate image file size declared before upload.
+    """
+    if size > MAX_IMG_SIZE:
         raise ValidationError("File size is above limits.")
+
+def validate_img_magic_bytes(header):
+    """
+    Custom function to validate first bytes of image file,
+    it does not trust the file name.
+    """
+    if not header.startswith(IMG_MAGIC_BYTES):
+        raise ValidationError("File content is not a supported image.")
+
+def validate_img_header(value):
+    """
+    Custom function to validate image format, dimensions and pixel count
+    using the file header only, the image is not decoded.
+    """
+    try:
+        width, height, img_format = img_header_info(value, formats=ALLOWED_IMG_FORMATS)
+    except (OSError, SyntaxError, ValueError, PILImage.DecompressionBombError):
+        raise ValidationError("File content is not a supported image.")
+
+    if img_format not in ALLOWED_IMG_FORMATS:
+        raise ValidationError("File content is not a supported image.")
+
+    if width <= 0 or height <= 0:
+        raise ValidationError("Image dimensions are invalid.")
+
+    if width * height > MAX_IMG_PIXELS:
+        raise ValidationError("Image dimensions are above limits.")
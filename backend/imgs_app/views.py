@@ -1,55 +1,208 @@
 import uuid
-import datetime
 import logging
+import datetime
 from pathlib import Path
+from django.conf import settings
+from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.views import View
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
 from django.utils import timezone
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_headers
+from django.core.cache import cache
+from django.db.models import Count, Prefetch, Q
 from rest_framework import status
-from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveAPIView
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.base import File
+from django.db import transaction
+from rest_framework.generics import CreateAPIView, GenericAPIView, ListAPIView, RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from imgs_app.models import UploadedImage, Thumbnail, ExpiringLink
-from imgs_app.serializers import ImageSerializer, ThumbnailSerializer, ExpiringLinkSerializer
+from rest_framework.exceptions import ValidationError
+from rest_framework.views import APIView
+from imgs_app.models import UploadedImage, Thumbnail, ExpiringLink, UploadSession
+from auth_app.models import ThumbnailHeight
+from imgs_app.serializers import ImageSerializer, ThumbnailSerializer, ExpiringLinkSerializer, UploadSessionSerializer, GallerySerializer, parse_requested_fields
+from imgs_app.pagination import PkCursorPagination
+from imgs_app.validators import validate_img_header
+from imgs_app.uploads import UploadPartsReader, delete_session_parts, parse_content_range, session_parts, store_chunk
 from imgs_app.permissions import NewExpiringLinksCreatePermission
-from imgs_app.tasks import check_user_thumbs_task
+from imgs_app.tasks import check_user_thumbs_task, enqueue_once, render_failed, render_thumbnail_on_demand, touch_thumbnail
+from imgs_app.cache import LIST_CACHE_TIMEOUT, list_cache_key, get_cached_link, set_cached_link
+from imgs_app.links import sign_link, unsign_link
+from imgs_app.media import IgnoreClientContentNegotiation, serve_media, serve_thumbnail
+from imgs_app.status import IN_PROGRESS_STATES, get_processing_state, processing_in_progress, processing_state_events, wait_processing_state
 
 logger = logging.getLogger(__name__)
 
+def image_status_payload(request, uploaded_img):
+    # Returned on upload, client waits on the status link instead of polling thumbnails list
+    return {
+        "id": uploaded_img.pk,
+        "processingState": uploaded_img.processingState,
+        "status": request.build_absolute_uri(reverse('image_status', kwargs = {'pk': uploaded_img.pk})),
+    }
+
+
 class UploadImageView(CreateAPIView):
     permission_classes = [IsAuthenticated, ]
     serializer_class = ImageSerializer
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        if serializer.is_valid():
+            uploaded_img = serializer.save(user = self.request.user)
+            return Response(image_status_payload(request, uploaded_img), status = 201)
+        return Response({"error": str(serializer.errors)}, status = 400)
+
+
+class UploadSessionCreateView(CreateAPIView):
+    """Starts resumable chunked upload, file name and size are validated upfront."""
+    permission_classes = [IsAuthenticated, ]
+    serializer_class = UploadSessionSerializer
+
     def create(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid():
             serializer.save(user = self.request.user)
-            return Response(status = 201)
+            return Response(serializer.data, status = 201)
         return Response({"error": str(serializer.errors)}, status = 400)
 
 
+def active_upload_sessions(user):
+    # Expired (abandoned) sessions are not resumed, these are purged by purge_upload_sessions_task
+    return UploadSession.objects.filter(user = user, expiresAt__gt = timezone.now())
+
+
+class UploadSessionView(RetrieveAPIView):
+    """GET returns number of received bytes (offset to resume upload from).
+    PUT streams a chunk described by `Content-Range: bytes start-end/total`
+    header to storage, chunks have to be sent in order.
+    """
+    permission_classes = [IsAuthenticated, ]
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return active_upload_sessions(self.request.user)
+
+    def put(self, request, *args, **kwargs):
+        content_range = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+
+        if content_range is None or request.stream is None:
+            return Response({"error": "Please send chunk with valid Content-Range header."}, status = 400)
+
+        start, end, total = content_range
+        length = end - start + 1
+
+        session = self.get_object()
+
+        if total != session.fileSize:
+            return Response({"error": "Content-Range total does not match declared file size."}, status = 400)
+
+        if start != session.receivedBytes:
+            return Response({"error": "Unexpected chunk offset.", "receivedBytes": session.receivedBytes}, status = 409)
+
+        # Body of slow client is streamed to storage outside of transaction, no row lock is held meanwhile
+        try:
+            stored_name = store_chunk(session, start, request.stream, length)
+        except DjangoValidationError as e:
+            return Response({"error": str(e.messages)}, status = 400)
+
+        with transaction.atomic():
+            # Session row is locked just to record the part, concurrent chunk of the same offset gets 409 then
+            session = self.get_queryset().select_for_update().filter(pk = session.pk).first()
+
+            # Chunk is confirmed only if no concurrent request confirmed the same offset (db without row locks)
+            confirmed = session is not None and UploadSession.objects.filter(pk = session.pk, receivedBytes = start).update(
+                receivedBytes = start + length,
+                parts = session.parts + [[start, stored_name]],
+                expiresAt = timezone.now() + datetime.timedelta(seconds = settings.UPLOAD_SESSION_TIMEOUT)
+            )
+
+        if not confirmed:
+            default_storage.delete(stored_name)
+            if session is None:
+                return Response({"error": "Upload session expired."}, status = 404)
+            return Response({"error": "Unexpected chunk offset.", "receivedBytes": session.receivedBytes}, status = 409)
+
+        return Response({"receivedBytes": start + length}, status = 200)
+
+
+class UploadSessionFinalizeView(GenericAPIView):
+    """Joins uploaded chunks into uploaded image and removes the session."""
+    permission_classes = [IsAuthenticated, ]
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return active_upload_sessions(self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        session = self.get_object()
+
+        if session.receivedBytes != session.fileSize:
+            return Response({"error": "Upload is not complete.", "receivedBytes": session.receivedBytes}, status = 409)
+
+        # Session is claimed atomically, so concurrent finalize does not create the image twice
+        claimed = UploadSession.objects.filter(pk = session.pk, finalizedAt = None).update(finalizedAt = timezone.now())
+        if not claimed:
+            return Response({"error": "Upload is already being finalized."}, status = 409)
+
+        reader = UploadPartsReader(session_parts(session), session.fileSize)
+
+        try:
+            uploaded_file = File(reader, name = session.fileName)
+            validate_img_header(uploaded_file)
+            uploaded_img = ImageSerializer().create({'uploadedImage': uploaded_file, 'user': self.request.user})
+        except DjangoValidationError as e:
+            UploadSession.objects.filter(pk = session.pk).update(finalizedAt = None)
+            return Response({"error": str(e.messages)}, status = 400)
+        except Exception:
+            # Claim is released, so the session can be finalized again
+            UploadSession.objects.filter(pk = session.pk).update(finalizedAt = None)
+            raise
+        finally:
+            reader.close()
+
+        delete_session_parts(session)
+        session.delete()
+        return Response(image_status_payload(request, uploaded_img), status = 201)
+
+
 class ImagesListApiView(ListAPIView):
     permission_classes = [IsAuthenticated, ]
     serializer_class = ImageSerializer
+    pagination_class = PkCursorPagination
 
-    def get_queryset(self):
+    def get_queryset(self, fields = None):
         user = self.request.user
         original_imgs = UploadedImage.objects.filter(user = user)
+        if fields:
+            original_imgs = original_imgs.only('pk', *fields)
         return original_imgs
 
-    @method_decorator(cache_page(60*10)) # cache for 10minutes
-    @method_decorator(vary_on_headers("Authorization",)) # should take into account when building its cache key
     def list(self, request, *args, **kwargs):
         try:
             user = self.request.user
-            userAccessOriginalFile = user.userTier.accessOriginalFile
+            userAccessOriginalFile = request.tier.accessOriginalFile
             if userAccessOriginalFile:
-                get_images = self.get_queryset()
-                if get_images:
-                    serializer_original_imgs = ImageSerializer(get_images, many = True)
-                    return Response({'original_imgs': serializer_original_imgs.data}, status = 200)
+                try:
+                    fields = parse_requested_fields(request.query_params.get('fields'), ImageSerializer)
+                except ValidationError as e:
+                    return Response({"error": str(e.detail[0])}, status = 400)
+
+                # Per-user cache, invalidated once user's images change (signals.py)
+                cache_key = list_cache_key(user.pk, 'images', *self.paginator.get_cache_args(request, fields))
+                payload = cache.get(cache_key)
+                if payload is not None:
+                    return Response(payload, status = 200)
+
+                get_images = self.paginate_queryset(self.get_queryset(fields))
+                if get_images or request.query_params.get('cursor'):
+                    serializer_original_imgs = ImageSerializer(get_images, many = True, fields = fields)
+                    payload = self.paginator.get_paginated_payload(serializer_original_imgs.data, 'original_imgs')
+                    cache.set(cache_key, payload, LIST_CACHE_TIMEOUT)
+                    return Response(payload, status = 200)
                 else:
                     return Response({"error": "Please upload image."}, status = 204)
             else:
@@ -63,21 +216,21 @@ class ImagesListApiView(ListAPIView):
 class ThumbnailsListApiView(ListAPIView):
     permission_classes = [IsAuthenticated, ]
     serializer_class = ThumbnailSerializer
+    pagination_class = PkCursorPagination
 
-    def get_queryset(self, heights: int):
+    def get_queryset(self, heights: int, fields = None):
         user = self.request.user
-        original_imgs = UploadedImage.objects.filter(user = user)
-        len_original_imgs = len(original_imgs)
-        if heights and len_original_imgs>0:
-            thumbnails = Thumbnail.objects.filter(user = user, height__available_height = heights)
-            return {'thumbnails_arr': thumbnails, 'len_original_imgs': len_original_imgs}
+        thumbnails = Thumbnail.objects.filter(user = user, height__available_height = heights)
+        if fields:
+            thumbnails = thumbnails.only('pk', *[field for field in fields if field != 'variants'])
+        if not fields or 'variants' in fields:
+            thumbnails = thumbnails.prefetch_related('variants')
+        return thumbnails
 
-    @method_decorator(cache_page(60*10)) # cache for 10minutes
-    @method_decorator(vary_on_headers("Authorization",)) # should take into account when building its cache key
     def list(self, request, *args, **kwargs):
         try:
             user = self.request.user
-            userTierHeights = user.userTier.thumbnailHeight.values_list('available_height',flat=True)
+            userTierHeights = request.tier.heights
             height = self.kwargs["height"]
 
             if height is None:
@@ -88,15 +241,36 @@ class ThumbnailsListApiView(ListAPIView):
                 return Response({"error": "Service temporarily unavailable."}, status = 405)
 
             if height in userTierHeights:
-                get_images = self.get_queryset(height)
-                if len(get_images['thumbnails_arr'])>0 and get_images['len_original_imgs']>0:
-                    serializer_thumbnails = ThumbnailSerializer(get_images['thumbnails_arr'], many = True)
-                    return Response({'thumbnails':serializer_thumbnails.data,}, status = 200)
-                elif get_images['len_original_imgs'] == 0:
+                try:
+                    fields = parse_requested_fields(request.query_params.get('fields'), ThumbnailSerializer)
+                except ValidationError as e:
+                    return Response({"error": str(e.detail[0])}, status = 400)
+
+                # Per-user cache, invalidated once user's images or thumbnails change (signals.py)
+                cache_key = list_cache_key(user.pk, 'thumbnails', height, *self.paginator.get_cache_args(request, fields))
+                payload = cache.get(cache_key)
+                if payload is not None:
+                    return Response(payload, status = 200)
+
+                page = self.paginate_queryset(self.get_queryset(height, fields))
+                if page or request.query_params.get('cursor'):
+                    serializer_thumbnails = ThumbnailSerializer(page, many = True, fields = fields)
+                    payload = self.paginator.get_paginated_payload(serializer_thumbnails.data, 'thumbnails')
+                    cache.set(cache_key, payload, LIST_CACHE_TIMEOUT)
+                    return Response(payload, status = 200)
+                elif not UploadedImage.objects.filter(user = user).exists():
                     return Response({"error":"Please upload image in order to get thumbnail."}, status = 204)
+                elif processing_in_progress(UploadedImage.objects.filter(user = user)).exists():
+                    # Thumbnails are being processed, client waits on status of the image instead of polling,
+                    # image stuck in progress (lost task) does not block the check below
+                    return Response({"error": "Thumbnails are being processed, please wait on images/<pk>/status/."}, status = 405)
+                elif settings.THUMBNAIL_RENDER_MODE == 'lazy':
+                    # Not rendered yet, thumbnails are rendered on first request (ImageThumbnailMediaView)
+                    return Response({"error": "Thumbnails are rendered on first request of media/images/<pk>/thumbnails/<height>/."}, status = 204)
                 else:
-                    # Check if user has thumbnails asynchronously just-in-case no objects got created (or removed)
-                    check_user_thumbs_task.delay(user.pk)
+                    # Check if user has thumbnails asynchronously just-in-case no objects got created (or removed),
+                    # polling client enqueues the check once
+                    enqueue_once(check_user_thumbs_task, user.pk)
                     return Response({"error": "Please try again in a moment. Temporarily unavailable."}, status = 405)
             else:
                 return Response({"error": "Please query thumbnail height based on account tier."}, status = 403)
@@ -106,6 +280,160 @@ class ThumbnailsListApiView(ListAPIView):
             return Response({'error': f'An error occurred: {str(e)}'}, status=500)
 
 
+class GalleryApiView(ListAPIView):
+    """Lists user's images, each with all its thumbnails allowed by account tier.
+    Page is read by three queries: images (with annotated thumbnails count),
+    their prefetched thumbnails and variants of these thumbnails.
+    """
+    permission_classes = [IsAuthenticated, ]
+    serializer_class = GallerySerializer
+    pagination_class = PkCursorPagination
+
+    def get_queryset(self, heights):
+        user = self.request.user
+        heights = sorted(heights)
+        allowed_thumbnails = Thumbnail.objects.filter(height__available_height__in = heights).order_by('height__available_height').prefetch_related('variants')
+        return UploadedImage.objects.filter(user = user).annotate(
+            thumbnailsCount = Count('thumbnail', filter = Q(thumbnail__height__available_height__in = heights))
+        ).prefetch_related(
+            Prefetch('thumbnail_set', queryset = allowed_thumbnails, to_attr = 'allowed_thumbnails')
+        )
+
+    def list(self, request, *args, **kwargs):
+        try:
+            user = self.request.user
+            tier = request.tier
+
+            if len(tier.heights) == 0 and not tier.accessOriginalFile:
+                return Response({"error": "Current account plan does not include this feature."}, status = 403)
+
+            # Per-user cache, invalidated once user's images or thumbnails change (signals.py),
+            # tier is part of the key, so the gallery changes with the tier at once
+            cache_key = list_cache_key(user.pk, 'gallery', tier.accessOriginalFile, *sorted(tier.heights), *self.paginator.get_cache_args(request))
+            payload = cache.get(cache_key)
+            if payload is not None:
+                return Response(payload, status = 200)
+
+            page = self.paginate_queryset(self.get_queryset(tier.heights))
+            if page or request.query_params.get('cursor'):
+                fields = None if tier.accessOriginalFile else [f for f in GallerySerializer.Meta.fields if f != 'uploadedImage']
+                serializer_gallery = GallerySerializer(page, many = True, fields = fields)
+                payload = self.paginator.get_paginated_payload(serializer_gallery.data, 'images')
+                cache.set(cache_key, payload, LIST_CACHE_TIMEOUT)
+                return Response(payload, status = 200)
+            else:
+                return Response({"error": "Please upload image."}, status = 204)
+
+        except Exception as e:
+            logger.exception(f"An error occurred in GalleryApiView -> list. {str(e)}")
+            return Response({'error': 'An error occurred'}, status=500)
+
+
+class ImageStatusView(APIView):
+    """Returns thumbnails processing state of the image. With `wait` query param (seconds)
+    the request is held until thumbnails are processed (long-poll), at most IMAGE_STATUS_MAX_WAIT.
+    """
+    permission_classes = [IsAuthenticated, ]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), settings.IMAGE_STATUS_MAX_WAIT)
+        except ValueError:
+            return Response({"error": "Wait has to be a number of seconds."}, status = 400)
+
+        uploaded_img = get_object_or_404(UploadedImage.objects.only('processingState'), pk = self.kwargs['pk'], user = request.user)
+        state = wait_processing_state(uploaded_img, wait) if wait > 0 else get_processing_state(uploaded_img)
+        response = Response({"id": uploaded_img.pk, "processingState": state}, status = 200)
+
+        if state in IN_PROGRESS_STATES:
+            response['Retry-After'] = '1'
+        return response
+
+
+class ImageStatusEventsView(View):
+    """Streams thumbnails processing state of the image as server-sent events,
+    until thumbnails are processed. Async view, waiting does not hold a thread under ASGI.
+    """
+    async def get(self, request, *args, **kwargs):
+        user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+
+        if user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status = 403)
+
+        try:
+            uploaded_img = await UploadedImage.objects.only('processingState').aget(pk = self.kwargs['pk'], user = user)
+        except UploadedImage.DoesNotExist:
+            return JsonResponse({"detail": "Not found."}, status = 404)
+
+        response = StreamingHttpResponse(
+            processing_state_events(uploaded_img, settings.IMAGE_STATUS_STREAM_TIMEOUT),
+            content_type = 'text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no' # nginx passes events at once
+        return response
+
+
+class ImageMediaView(APIView):
+    """Serves original image file to its owner, if account tier includes it."""
+    permission_classes = [IsAuthenticated, ]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+        if not request.tier.accessOriginalFile:
+            return Response({"error": "Current account plan does not include this feature."}, status = 403)
+
+        uploaded_img = get_object_or_404(UploadedImage.objects.only('uploadedImage', 'contentHash'), pk = self.kwargs['pk'], user = request.user)
+        return serve_media(request, uploaded_img.uploadedImage, uploaded_img.contentHash)
+
+
+class ThumbnailMediaView(APIView):
+    """Serves thumbnail file to its owner, if its height is included in account tier.
+    Variant (WebP, AVIF) is served instead, if client accepts its format.
+    """
+    permission_classes = [IsAuthenticated, ]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+        thumb = get_object_or_404(Thumbnail.objects.select_related('height'), pk = self.kwargs['pk'], user = request.user)
+
+        if thumb.height.available_height not in request.tier.heights:
+            return Response({"error": "Please query thumbnail height based on account tier."}, status = 403)
+
+        touch_thumbnail(thumb)
+        return serve_thumbnail(request, thumb)
+
+
+class ImageThumbnailMediaView(APIView):
+    """Serves thumbnail of the image in requested height, the thumbnail is rendered
+    on first request if it does not exist (lazy render mode, or evicted thumbnail).
+    """
+    permission_classes = [IsAuthenticated, ]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+        height = self.kwargs['height']
+
+        if height not in request.tier.heights:
+            return Response({"error": "Please query thumbnail height based on account tier."}, status = 403)
+
+        uploaded_img = get_object_or_404(UploadedImage, pk = self.kwargs['pk'], user = request.user)
+        thumbnailHeight = get_object_or_404(ThumbnailHeight, available_height = height)
+        thumb = render_thumbnail_on_demand(uploaded_img, thumbnailHeight)
+
+        if thumb is None:
+            if render_failed(uploaded_img, thumbnailHeight):
+                response = Response({"error": "Thumbnail could not be rendered. Please try again later."}, status = 503)
+                response['Retry-After'] = str(settings.THUMBNAIL_RENDER_RETRY_AFTER)
+                return response
+            response = Response({"error": "Please try again in a moment. Temporarily unavailable."}, status = 503)
+            response['Retry-After'] = '1'
+            return response
+
+        touch_thumbnail(thumb)
+        return serve_thumbnail(request, thumb)
+
+
 class ExpiringLinkCreateApiView(CreateAPIView):
     permission_classes = [IsAuthenticated, NewExpiringLinksCreatePermission]
     serializer_class = ExpiringLinkSerializer
@@ -113,6 +441,8 @@ class ExpiringLinkCreateApiView(CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=self.request.data)
         if serializer.is_valid():
+            if settings.EXPIRING_LINKS_SIGNED:
+                return self.create_signed(serializer)
             link = self.perform_create(serializer)
             headers = self.get_success_headers(serializer.data)
             response = {
@@ -128,21 +458,49 @@ class ExpiringLinkCreateApiView(CreateAPIView):
     def perform_create(self, serializer):
         link = serializer.create()
         link.user = self.request.user
-        link.linkUUID = uuid.uuid4().hex
+        link.linkToken = uuid.uuid4()
+        link.linkUUID = link.linkToken.hex
         link.save()
         return link
 
+    def create_signed(self, serializer):
+        """Stateless mode, link is not stored in db. Its token carries
+        ids of selections and expiry time, signed with HMAC.
+        """
+        link = serializer.create()
+        token = sign_link(link.image_id, link.thumbnail_id, link.expiryTime)
+        response = {
+            "link": self.request.build_absolute_uri(reverse('signed_expiring_link_view', kwargs = {'token': token})),
+            "created_at": timezone.now(),
+            "valid_for": f"{link.expiryTime} seconds",
+        }
+        return Response(response, status = 201)
+
 
 class ExpiringLinkRetrieveView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
-    queryset = ExpiringLink.objects.all()
+    queryset = ExpiringLink.objects.select_related('image', 'thumbnail').prefetch_related('thumbnail__variants')
     serializer_class = ExpiringLinkSerializer
     lookup_field = 'linkUUID'
 
+    def get_object(self):
+        # Links are resolved by indexed linkToken, linkUUID is used only for legacy non UUID values
+        lookup = self.kwargs[self.lookup_field]
+        try:
+            filter_kwargs = {'linkToken': uuid.UUID(lookup)}
+        except ValueError:
+            filter_kwargs = {'linkUUID': lookup}
+        return get_object_or_404(self.get_queryset(), **filter_kwargs)
+
     def get(self, request, *args, **kwargs):
+        # Resolved links are cached for their remaining lifetime, removed on delete (signals.py)
+        payload = get_cached_link(self.kwargs[self.lookup_field])
+        if payload is not None:
+            return Response(payload, status = 200)
+
         instance = self.get_object()
 
-        if (instance.createdAt + datetime.timedelta(seconds = instance.expiryTime)) <= timezone.now():
+        if instance.expiresAt <= timezone.now():
             instance.delete()
             return Response({"error": "Expiration link is not valid."}, status = 404)
 
@@ -152,8 +510,36 @@ class ExpiringLinkRetrieveView(RetrieveAPIView):
         serializer_images = ImageSerializer(image_file, many=False)
         serializer_thumbnails = ThumbnailSerializer(thumbnail_file, many = False)
 
-        return Response({
+        payload = {
             "image": serializer_images.data,
             "thumbnail": serializer_thumbnails.data
-        }, status = 200)
+        }
+        set_cached_link(self.kwargs[self.lookup_field], payload, instance.expiresAt)
+        return Response(payload, status = 200)
+
+
+
+class SignedExpiringLinkRetrieveView(APIView):
+    """Resolves stateless expiring link, the token is verified without database lookup,
+    then the payload is built from the selected image and thumbnail.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        link = unsign_link(self.kwargs['token'])
 
+        if link is None:
+            return Response({"error": "Expiration link is not valid."}, status = 404)
+
+        image_id, thumbnail_id = link
+        image_file = UploadedImage.objects.filter(pk = image_id).first() if image_id is not None else None
+        thumbnail_file = Thumbnail.objects.prefetch_related('variants').filter(pk = thumbnail_id).first() if thumbnail_id is not None else None
+
+        # Selection was deleted meanwhile
+        if (image_id is not None and image_file is None) or (thumbnail_id is not None and thumbnail_file is None):
+            return Response({"error": "Expiration link is not valid."}, status = 404)
+
+        return Response({
+            "image": ImageSerializer(image_file).data,
+            "thumbnail": ThumbnailSerializer(thumbnail_file).data
+        }, status = 200)
@@ -31,9 +31,19 @@ done
 # python manage.py createsuperuser --noinput
 
 # for debug
-until python -m celery -A backend worker --detach
+# One worker per queue (CELERY_TASK_ROUTES), concurrency is set per queue by TASK_QUEUE_WORKERS
+for queue in interactive bulk reconcile
 do
-    echo "Waiting for celery..."
+    until python -m celery -A backend worker -Q $queue -n $queue@%h --detach
+    do
+        echo "Waiting for celery $queue worker..."
+        sleep 2
+    done
+done
+
+until python -m celery -A backend beat --detach
+do
+    echo "Waiting for celery beat..."
     sleep 2
 done
 